@@ -0,0 +1,225 @@
+"""
+このファイルは、よくある質問への回答をセッションをまたいで使い回すための、回答キャッシュが記述されたファイルです。
+表記が完全に一致する質問に加え、質問文の埋め込みベクトルが十分に近い質問にもキャッシュ済みの回答を返します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Any, List, NamedTuple
+import numpy as np
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_question(question):
+    """
+    表記ゆれの影響を受けないよう質問文を正規化（全角・半角、大文字・小文字、空白、文末の記号を揃える）
+
+    Args:
+        question: 質問文
+
+    Returns:
+        正規化した質問文
+    """
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"\s+", "", text)
+    return text.rstrip("?!。.")
+
+
+############################################################
+# クラス定義
+############################################################
+
+class CachedAnswer(NamedTuple):
+    """
+    キャッシュ済みの回答
+    - 「answer」: 回答
+    - 「context」: 回答の参照元のドキュメントのリスト
+    - 「vector」: 質問文の埋め込みベクトル（長さ1に正規化済み、取得できなかった場合はNone）
+    - 「created_at」: キャッシュした時刻
+    """
+    answer: str
+    context: List[Any]
+    vector: Any
+    created_at: float
+
+
+class AnswerCache:
+    """
+    インデックスの世代・モード・正規化した質問文をキーに回答を保持するキャッシュ
+    有効期限を過ぎた回答は使わず、上限件数を超えた場合は最も長く使われていない回答から削除する
+    インデックスの世代は新しいものから指定数だけ保持し、それより古い世代の回答は破棄する
+    （切り替え前の世代を開いたままのセッションがあっても、新しい世代の回答は破棄しない）
+    """
+
+    def __init__(
+        self,
+        embeddings=None,
+        max_entries=ct.ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds=ct.ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold=ct.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        keep_generations=ct.INDEX_KEEP_GENERATIONS
+    ):
+        """
+        Args:
+            embeddings: 質問文の類似度の計算に使う埋め込みモデル（Noneの場合は完全一致のみ）
+            max_entries: 保持する回答の上限件数
+            ttl_seconds: 回答を使い回す最大秒数
+            similarity_threshold: 同じ質問とみなすコサイン類似度の下限
+            keep_generations: 回答を保持するインデックスの世代数（新しいものから数える）
+        """
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.keep_generations = keep_generations
+        self.hits = 0
+        self.misses = 0
+        # キャッシュに現れた順（古い順）の世代と、保持数を超えて破棄した世代
+        # 破棄した世代は、インデックスを更新するたびに増え続けないよう、直近の一定数のみ記録する
+        # （それより古い世代のフォルダは削除済みのため、開いたままのセッションが残っていることはほぼない）
+        self._generations = []
+        self._retired_generations = deque(maxlen=keep_generations * ct.ANSWER_CACHE_RETIRED_GENERATIONS_FACTOR)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        """
+        キャッシュの件数とヒット率
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries), "generations": len(self._generations),
+                "hits": self.hits, "misses": self.misses
+            }
+
+    def _embed(self, question):
+        """
+        質問文の埋め込みベクトルを、長さ1に正規化して取得（取得できない場合はNone）
+        """
+        if self.embeddings is None:
+            return None
+        try:
+            vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        except Exception:
+            # 埋め込みに失敗しても、表記が完全に一致する質問のキャッシュは使えるようにする
+            logging.getLogger(ct.LOGGER_NAME).exception("回答キャッシュの検索用に、質問文を埋め込めませんでした。")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _register_generation(self, generation):
+        """
+        インデックスの世代を登録し、保持数を超えた古い世代の回答を破棄（ロック取得済みの状態で呼び出す）
+        世代は新しい方向にのみ進め、破棄済みの世代は再び登録しない
+
+        Args:
+            generation: インデックスの世代
+
+        Returns:
+            回答を取得・追加してよい世代であればTrue
+        """
+        if generation in self._retired_generations:
+            return False
+        if generation not in self._generations:
+            self._generations.append(generation)
+            while len(self._generations) > self.keep_generations:
+                retired = self._generations.pop(0)
+                self._retired_generations.append(retired)
+                for key in [key for key in self._entries if key[0] == retired]:
+                    del self._entries[key]
+        return True
+
+    def _remove_expired(self, now):
+        """
+        有効期限を過ぎた回答を削除（ロック取得済みの状態で呼び出す）
+        """
+        # 追加・利用した順に並んでいるとは限らないため、すべての回答の作成時刻を確認
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, mode, question, generation):
+        """
+        キャッシュ済みの回答を取得
+
+        Args:
+            mode: モード（「社内文書検索」or「社内問い合わせ」）
+            question: 質問文
+            generation: インデックスの世代（インデックスのフォルダパス）
+
+        Returns:
+            キャッシュ済みの回答（存在しない場合はNone）
+        """
+        key = (generation, mode, normalize_question(question))
+        with self._lock:
+            if not self._register_generation(generation):
+                self.misses += 1
+                return None
+            self._remove_expired(time.time())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            candidates = [
+                (entry_key, entry) for entry_key, entry in self._entries.items()
+                if entry_key[:2] == (generation, mode) and entry.vector is not None
+            ]
+
+        # 表記が一致しない場合は、同じ世代・モードの回答の中から質問文が最も近いものを探す
+        if not candidates:
+            with self._lock:
+                self.misses += 1
+            return None
+        vector = self._embed(question)
+        if vector is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        similarities = np.stack([entry.vector for _, entry in candidates]) @ vector
+        best = int(np.argmax(similarities))
+
+        with self._lock:
+            entry_key, entry = candidates[best]
+            # 埋め込み中に、世代の破棄や上限件数で削除された回答は使わない
+            if similarities[best] < self.similarity_threshold or entry_key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return entry
+
+    def put(self, mode, question, generation, answer, context):
+        """
+        回答をキャッシュに追加
+
+        Args:
+            mode: モード（「社内文書検索」or「社内問い合わせ」）
+            question: 質問文
+            generation: インデックスの世代（インデックスのフォルダパス）
+            answer: 回答
+            context: 回答の参照元のドキュメントのリスト
+        """
+        # 埋め込みモデルへの問い合わせ中に他のセッションを待たせないよう、ロックの外で埋め込む
+        vector = self._embed(question)
+        with self._lock:
+            # 破棄済みの古い世代で作成した回答は追加しない
+            if not self._register_generation(generation):
+                return
+            self._entries[(generation, mode, normalize_question(question))] = CachedAnswer(
+                answer=answer, context=list(context), vector=vector, created_at=time.time()
+            )
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
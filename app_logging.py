@@ -0,0 +1,315 @@
+"""
+このファイルは、ログの書き込みを画面の処理から切り離すための、キューを介したログ出力の仕組みが記述されたファイルです。
+画面の処理ではログをキューに入れるだけで戻り、ファイルへの書き込み・ローテーション・圧縮は、プロセス内で1つだけ起動する専用のスレッドが行います。
+ログは1行1件のJSONとして出力し、記録したセッションのIDを各行に付けます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import copy
+import glob
+import gzip
+import json
+import queue
+import time
+import atexit
+import shutil
+import logging
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+import constants as ct
+
+
+############################################################
+# 設定関連
+############################################################
+# ログを記録したセッションのID（画面の処理を実行中のスレッド・そこから呼び出された処理の中でのみ参照できる）
+_session_id = ContextVar("session_id", default=None)
+# ロガー名ごとの、キューからファイルへ書き込む専用スレッド（プロセス内で1つずつ）
+_listeners = {}
+_setup_lock = threading.Lock()
+
+
+############################################################
+# 関数定義
+############################################################
+
+def set_session_id(session_id):
+    """
+    以降のログに付けるセッションIDを設定（画面の処理の実行ごとに呼び出す）
+
+    Args:
+        session_id: セッションID
+    """
+    _session_id.set(session_id)
+
+
+def setup_queued_logger(name, create_handler):
+    """
+    ロガーの出力を、キューを介して指定のハンドラーへ書き込むよう設定（プロセス内で1度だけ設定）
+
+    Args:
+        name: ロガー名
+        create_handler: 実際にログを書き込むハンドラーを作成する関数（初回のみ呼び出す。ハンドラーは専用スレッドの中でのみ使われる）
+
+    Returns:
+        ロガー
+    """
+    logger = logging.getLogger(name)
+    with _setup_lock:
+        if name in _listeners:
+            return logger
+
+        log_queue = queue.Queue(maxsize=ct.LOG_QUEUE_SIZE)
+        queue_handler = StructuredQueueHandler(log_queue, name)
+        # セッションIDは、ログを記録した側のスレッドで付ける必要があるため、キューに入れる前に付ける
+        queue_handler.addFilter(SessionIdFilter())
+        logger.addHandler(queue_handler)
+        logger.setLevel(logging.INFO)
+
+        listener = QueueListener(log_queue, create_handler(), respect_handler_level=True)
+        listener.start()
+        # プロセスの終了時に、キューに残ったログを書き出してからスレッドを止める
+        atexit.register(stop_listener, listener, queue_handler)
+        _listeners[name] = listener
+    return logger
+
+
+def stop_listener(listener, queue_handler):
+    """
+    キューに残ったログを書き出してから専用スレッドを止め、最後に報告していない破棄件数を書き込む
+
+    Args:
+        listener: キューからファイルへ書き込む専用スレッド
+        queue_handler: ログをキューに入れるハンドラー
+    """
+    listener.stop()
+    # スレッドを止めた後はキューを介さず、書き込み先のハンドラーへ直接渡す
+    record = queue_handler.take_dropped_record()
+    if record is not None:
+        listener.handle(record)
+
+
+def create_rotating_file_handler(file_name):
+    """
+    ログフォルダ内のファイルに、1行1件のJSONでログを書き込むハンドラーを作成
+
+    Args:
+        file_name: ログファイル名
+
+    Returns:
+        ハンドラー
+    """
+    os.makedirs(ct.LOG_DIR_PATH, exist_ok=True)
+    handler = SizedTimedRotatingFileHandler(
+        os.path.join(ct.LOG_DIR_PATH, file_name),
+        when=ct.LOG_ROTATE_WHEN,
+        max_bytes=ct.LOG_MAX_BYTES,
+        backup_count=ct.LOG_BACKUP_COUNT,
+        compress=ct.LOG_COMPRESS
+    )
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+############################################################
+# クラス定義
+############################################################
+
+class SessionIdFilter(logging.Filter):
+    """
+    ログに、記録したセッションのIDを付けるフィルター
+    （フォーマッターに埋め込むと最初のセッションのIDが全セッションで使われるため、ログごとに付ける）
+    """
+
+    def filter(self, record):
+        record.session_id = _session_id.get()
+        return True
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    ログを書式化せずにキューへ入れるハンドラー
+    辞書のログメッセージは、JSONの中で構造を保ったまま出力できるよう辞書のまま渡す
+    キューがあふれた場合は、画面の処理を待たせないようログを破棄し、破棄した件数を一定間隔ごとに警告のログとして記録する
+    """
+
+    def __init__(self, log_queue, logger_name):
+        """
+        Args:
+            log_queue: ログを受け渡すキュー
+            logger_name: 破棄件数の警告のログに付けるロガー名
+        """
+        super().__init__(log_queue)
+        self.logger_name = logger_name
+        # 報告していない破棄件数（複数のスレッドから更新されるため、ロックを取って更新する）
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._last_reported = time.monotonic()
+
+    def prepare(self, record):
+        """
+        キューに入れるログを用意（書式化は専用スレッドで行い、ここでは他のスレッドに渡せる形にするのみ）
+
+        Args:
+            record: ログ
+
+        Returns:
+            キューに入れるログ
+        """
+        record = copy.copy(record)
+        # 例外の情報は、発生したスレッドでしか参照できないため、ここで文字列にしておく
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        # 後から呼び出し元で変更されても影響を受けないよう、辞書は複製して渡す
+        if isinstance(record.msg, dict):
+            record.msg = dict(record.msg)
+        else:
+            record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+
+        # キューに空きが出た後、前回の報告から一定時間が経っていれば、破棄件数を報告する
+        if self.dropped and time.monotonic() - self._last_reported >= ct.LOG_DROP_REPORT_INTERVAL:
+            dropped_record = self.take_dropped_record()
+            if dropped_record is None:
+                return
+            try:
+                self.queue.put_nowait(dropped_record)
+            except queue.Full:
+                with self._dropped_lock:
+                    self.dropped += dropped_record.msg["dropped"]
+
+    def take_dropped_record(self):
+        """
+        報告していない破棄件数を取り出し、警告のログを作成（取り出した件数は0に戻す）
+
+        Returns:
+            警告のログ（破棄したログがない場合はNone）
+        """
+        with self._dropped_lock:
+            dropped = self.dropped
+            self.dropped = 0
+            self._last_reported = time.monotonic()
+        if not dropped:
+            return None
+        record = logging.LogRecord(
+            self.logger_name, logging.WARNING, __file__, 0,
+            {"message": "ログの書き込みが追いつかず、ログを破棄しました。", "dropped": dropped},
+            None, None, func="enqueue"
+        )
+        record.session_id = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    ログを1行1件のJSONに変換するフォーマッター
+    """
+
+    def format(self, record):
+        # - 「time」: ログのタイムスタンプ（いつ記録されたか）
+        # - 「level」: ログの重要度（INFO, WARNING, ERRORなど）
+        # - 「logger」・「module」・「line」・「func」: ログが出力されたロガー名・ファイル・行番号・関数名
+        # - 「session_id」: セッションID（誰のアプリ操作か分かるように）
+        # - 「message」: ログメッセージ（辞書の場合はそのままの構造で出力）
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "func": record.funcName,
+            "session_id": getattr(record, "session_id", None),
+            "message": record.msg
+        }
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    一定時間ごとに加え、ファイルサイズが上限を超えた場合にもログファイルを切り替えるハンドラー
+    切り替えたファイルは「ファイル名.日付」（同じ期間内に複数ある場合は連番付き）で保存し、指定があればgzipで圧縮する
+    """
+
+    def __init__(self, filename, when, max_bytes, backup_count, compress):
+        """
+        Args:
+            filename: ログファイルのパス
+            when: 時間で切り替える単位（TimedRotatingFileHandlerと同じ指定）
+            max_bytes: ファイルを切り替えるサイズ（0以下はサイズで切り替えない）
+            backup_count: 残しておく切り替え済みのファイル数（0以下はすべて残す）
+            compress: 切り替え済みのファイルをgzipで圧縮するかどうか
+        """
+        super().__init__(filename, when=when, backupCount=backup_count, encoding="utf8")
+        self.max_bytes = max_bytes
+        self.compress = compress
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes <= 0:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        return self.stream.tell() >= self.max_bytes
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        # 切り替え前のファイルが対象とする期間の開始日時を、ファイル名に付ける
+        now = int(time.time())
+        period_start = time.localtime(self.rolloverAt - self.interval)
+        base_name = f"{self.baseFilename}.{time.strftime(self.suffix, period_start)}"
+        rotated_name = base_name
+        index = 1
+        while os.path.exists(rotated_name) or os.path.exists(f"{rotated_name}.gz"):
+            rotated_name = f"{base_name}.{index}"
+            index += 1
+
+        if os.path.exists(self.baseFilename):
+            if self.compress:
+                with open(self.baseFilename, "rb") as src, gzip.open(f"{rotated_name}.gz", "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.baseFilename)
+            else:
+                os.rename(self.baseFilename, rotated_name)
+        self.remove_old_files()
+
+        self.stream = self._open()
+        # サイズでの切り替えの場合は、時間で切り替える日時は変えない
+        if now < self.rolloverAt:
+            return
+        rollover_at = self.computeRollover(now)
+        while rollover_at <= now:
+            rollover_at += self.interval
+        self.rolloverAt = rollover_at
+
+    def remove_old_files(self):
+        """
+        切り替え済みのファイルのうち、新しい順に指定数を超えた分を削除
+        """
+        if self.backupCount <= 0:
+            return
+        rotated_files = sorted(glob.glob(f"{glob.escape(self.baseFilename)}.*"), key=os.path.getmtime)
+        for path in rotated_files[:-self.backupCount]:
+            os.remove(path)
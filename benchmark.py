@@ -0,0 +1,400 @@
+"""
+このファイルは、変更前後の処理速度を比較するための、オフラインで再現可能なベンチマークが記述されたファイルです。
+「./data」を指定の倍率に複製した疑似コーパスを作成し、読み込み・チャンク分割・インデックス作成・全文検索・検索・回答生成を計測します。
+埋め込みモデルとLLMは、同じ入力に常に同じ結果を返すローカルの代替品を使うため、APIキーやネットワークは不要です。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import platform
+import subprocess
+import numpy as np
+import fitz
+import docx
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+import constants as ct
+import data_loader
+import index_store
+import keyword_index
+import rag_chain
+import utils
+from hybrid_retriever import HybridRetriever
+from query_condenser import QueryCondenser
+
+# ピークメモリの取得はUnix系のOSのみ対応
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_peak_rss_mb():
+    """
+    プロセスのこれまでの最大メモリ使用量（RSS）を取得
+
+    Returns:
+        自プロセスと、終了済みの子プロセス（ファイル読み込み用）の最大メモリ使用量（MB）の辞書
+    """
+    if resource is None:
+        return {"self": None, "children": None}
+    # Linuxはキロバイト、macOSはバイト単位で返される
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1)
+    }
+
+
+def get_git_commit():
+    """
+    計測対象のコミットのハッシュ値を取得（結果をコミット間で比較するため）
+
+    Returns:
+        コミットのハッシュ値（取得できない場合はNone）
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(seconds_list, items=None, total_seconds=None):
+    """
+    計測した所要時間の一覧から、スループットとレイテンシのパーセンタイルを算出
+
+    Args:
+        seconds_list: 1件ごとの所要時間（秒）のリスト
+        items: スループットの計算に使う処理件数（Noneの場合は計測回数）
+        total_seconds: スループットの計算に使う合計時間（Noneの場合は所要時間の合計）
+
+    Returns:
+        計測結果の辞書
+    """
+    items = len(seconds_list) if items is None else items
+    total_seconds = sum(seconds_list) if total_seconds is None else total_seconds
+    result = {
+        "count": len(seconds_list),
+        "items": items,
+        "seconds": round(total_seconds, 4),
+        "throughput_per_s": round(items / total_seconds, 2) if total_seconds else None
+    }
+    if seconds_list:
+        p50, p95, p99 = np.percentile(np.asarray(seconds_list) * 1000, [50, 95, 99])
+        result.update({"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)})
+    return result
+
+
+def write_replica_pdf(source_path, dest_path, replica):
+    """
+    PDFを複製し、複製ごとに内容が異なるよう1ページ目の余白に複製番号を書き込む
+
+    Args:
+        source_path: 複製元のファイルパス
+        dest_path: 複製先のファイルパス
+        replica: 複製番号
+    """
+    with fitz.open(source_path) as pdf:
+        pdf[0].insert_text((8, 8), f"replica {replica}", fontsize=4)
+        pdf.save(dest_path)
+
+
+def write_replica_docx(source_path, dest_path, replica):
+    """
+    Wordファイルを複製し、複製ごとに内容が異なるよう末尾に複製番号の段落を追加
+
+    Args:
+        source_path: 複製元のファイルパス
+        dest_path: 複製先のファイルパス
+        replica: 複製番号
+    """
+    document = docx.Document(source_path)
+    document.add_paragraph(f"複製番号: {replica}")
+    document.save(dest_path)
+
+
+def write_replica_csv(source_path, dest_path, replica):
+    """
+    CSVを複製し、社員名簿のように社員IDを持つ場合は、複製ごとに社員IDと氏名の組み合わせを入れ替えた疑似名簿にする
+
+    Args:
+        source_path: 複製元のファイルパス
+        dest_path: 複製先のファイルパス
+        replica: 複製番号
+    """
+    with open(source_path, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        shutil.copyfile(source_path, dest_path)
+        return
+
+    fieldnames = list(rows[0].keys())
+    rng = np.random.default_rng(replica)
+    names = [row.get("氏名（フルネーム）") for row in rows]
+    shuffled = [names[i] for i in rng.permutation(len(names))]
+    for i, row in enumerate(rows):
+        if "社員ID" in row:
+            row["社員ID"] = f"EMP{replica:04d}{i + 1:04d}"
+        if "氏名（フルネーム）" in row:
+            row["氏名（フルネーム）"] = shuffled[i]
+
+    with open(dest_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_replica_text(source_path, dest_path, replica):
+    """
+    テキストファイルを複製し、複製ごとに内容が異なるよう末尾に複製番号の行を追加
+
+    Args:
+        source_path: 複製元のファイルパス
+        dest_path: 複製先のファイルパス
+        replica: 複製番号
+    """
+    with open(source_path, encoding="utf-8") as f:
+        text = f.read()
+    with open(dest_path, "w", encoding="utf-8") as f:
+        f.write(f"{text}\n複製番号: {replica}\n")
+
+
+def generate_corpus(scale, source_dir=None, work_dir=ct.BENCHMARK_WORK_DIR):
+    """
+    「./data」を指定の倍率に複製した疑似コーパスを作成（同じ倍率のコーパスが作成済みであれば再利用）
+
+    Args:
+        scale: 複製する倍率
+        source_dir: 複製元のフォルダパス（Noneの場合は設定値）
+        work_dir: ベンチマーク用の作業フォルダパス
+
+    Returns:
+        疑似コーパスのフォルダパス
+    """
+    source_dir = source_dir or ct.RAG_TOP_FOLDER_PATH
+    corpus_dir = os.path.join(work_dir, f"corpus-{scale}x")
+    # 作成完了時にのみ印のファイルを置き、途中で中断したコーパスは作り直す
+    done_file = os.path.join(corpus_dir, ".done")
+    if os.path.isfile(done_file):
+        return corpus_dir
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    writers = {
+        ".pdf": write_replica_pdf,
+        ".docx": write_replica_docx,
+        ".csv": write_replica_csv,
+        ".txt": write_replica_text
+    }
+    source_files = data_loader.list_source_files(source_dir)
+    for replica in range(scale):
+        for source_path in source_files:
+            dest_path = os.path.join(corpus_dir, f"replica-{replica:04d}", os.path.relpath(source_path, source_dir))
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            writer = writers.get(os.path.splitext(source_path)[1])
+            if writer is None:
+                shutil.copyfile(source_path, dest_path)
+            else:
+                writer(source_path, dest_path, replica)
+
+    with open(done_file, "w", encoding="utf8") as f:
+        f.write(str(scale))
+    return corpus_dir
+
+
+def get_corpus_size(corpus_dir):
+    """
+    疑似コーパスのファイル数と合計サイズを取得
+
+    Args:
+        corpus_dir: 疑似コーパスのフォルダパス
+
+    Returns:
+        ファイル数と合計バイト数の辞書
+    """
+    paths = data_loader.list_source_files(corpus_dir)
+    return {"files": len(paths), "bytes": sum(os.path.getsize(path) for path in paths)}
+
+
+def create_fake_embeddings():
+    """
+    テキストのハッシュ値から常に同じベクトルを返す、埋め込みモデルの代替品を作成
+
+    Returns:
+        埋め込みモデル
+    """
+    return DeterministicFakeEmbedding(size=ct.BENCHMARK_EMBEDDING_SIZE)
+
+
+def create_fake_llm():
+    """
+    常に同じ回答を待ち時間なしで返す、LLMの代替品を作成
+
+    Returns:
+        LLM
+    """
+    return FakeListChatModel(responses=[ct.FAKE_LLM_RESPONSE])
+
+
+def get_queries(count):
+    """
+    計測に使う質問文を、設定値の一覧を繰り返して指定の件数だけ取得
+
+    Args:
+        count: 件数
+
+    Returns:
+        質問文のリスト
+    """
+    return [ct.BENCHMARK_QUERIES[i % len(ct.BENCHMARK_QUERIES)] for i in range(count)]
+
+
+def measure_each(func, inputs):
+    """
+    入力ごとに処理を実行し、1件ごとの所要時間を計測
+
+    Args:
+        func: 計測する処理
+        inputs: 入力値のリスト
+
+    Returns:
+        1件ごとの所要時間（秒）のリスト
+    """
+    seconds_list = []
+    for value in inputs:
+        start_time = time.perf_counter()
+        func(value)
+        seconds_list.append(time.perf_counter() - start_time)
+    return seconds_list
+
+
+def run_scale(scale, query_count=ct.BENCHMARK_QUERY_COUNT, work_dir=ct.BENCHMARK_WORK_DIR):
+    """
+    指定の倍率の疑似コーパスで、各処理段階を計測
+    （ピークメモリを倍率ごとに計測するため、倍率ごとに別プロセスで実行する）
+
+    Args:
+        scale: 疑似コーパスの倍率
+        query_count: 検索・回答生成の計測に使う質問数
+        work_dir: ベンチマーク用の作業フォルダパス
+
+    Returns:
+        計測結果の辞書
+    """
+    phases = {}
+
+    start_time = time.perf_counter()
+    corpus_dir = generate_corpus(scale, work_dir=work_dir)
+    generate_seconds = time.perf_counter() - start_time
+
+    # 読み込み（複数プロセスで並列に読み込み、ファイルごとの所要時間は順次返された間隔で計測）
+    load_seconds = []
+    documents = 0
+    split_seconds = []
+    chunks = 0
+    file_paths = data_loader.list_source_files(corpus_dir)
+    start_time = time.perf_counter()
+    previous_time = start_time
+    for _, docs in data_loader.iter_loaded_files(file_paths):
+        now = time.perf_counter()
+        load_seconds.append(now - previous_time)
+        documents += len(docs)
+        # チャンク分割は読み込みとは別に計測する
+        split_start_time = time.perf_counter()
+        chunks += len(data_loader.create_splitted_documents(docs))
+        split_seconds.append(time.perf_counter() - split_start_time)
+        previous_time = time.perf_counter()
+    phases["load"] = {**summarize(load_seconds), "documents": documents}
+    phases["split"] = summarize(split_seconds, items=chunks)
+
+    # インデックス作成（読み込み・分割・埋め込み・登録・全文検索用インデックスの作成を含む）
+    ct.RAG_TOP_FOLDER_PATH = corpus_dir
+    ct.INDEX_ROOT_DIR = os.path.join(work_dir, f"index-{scale}x")
+    shutil.rmtree(ct.INDEX_ROOT_DIR, ignore_errors=True)
+    os.makedirs(ct.INDEX_ROOT_DIR)
+    embeddings = create_fake_embeddings()
+    start_time = time.perf_counter()
+    with index_store.build_lock():
+        db, stats = index_store.update_index(embeddings, full_rebuild=True, refresh_web=False)
+    build_seconds = time.perf_counter() - start_time
+    phases["index_build"] = summarize([build_seconds], items=stats["chunks"])
+
+    index_path = index_store.get_current_index_path()
+    start_time = time.perf_counter()
+    index = keyword_index.load_keyword_index(index_path)
+    phases["keyword_index_load"] = summarize([time.perf_counter() - start_time])
+
+    queries = get_queries(query_count)
+    phases["keyword_search"] = summarize(measure_each(
+        lambda query: utils.search_documents_by_keyword(query, index, max_results=ct.MAX_KEYWORD_RESULTS), queries
+    ))
+
+    retriever = HybridRetriever(vectorstore=db, keyword_index=index)
+    phases["retrieval"] = summarize(measure_each(retriever.invoke, queries))
+
+    # 回答生成（会話履歴がない質問と、前の会話を指す語を含み質問文の書き換えが必要な質問の両方を計測）
+    llm = create_fake_llm()
+    chain = rag_chain.build_rag_chain(ct.ANSWER_MODE_2, retriever, llm, QueryCondenser(llm, ct.ANSWER_MODE_2))
+    chat_history = [HumanMessage(content=queries[0]), AIMessage(content=ct.FAKE_LLM_RESPONSE)]
+    phases["rag_chain"] = summarize(measure_each(
+        lambda query: chain.invoke({"input": query, "chat_history": []}), queries
+    ))
+    phases["rag_chain_with_history"] = summarize(measure_each(
+        lambda query: chain.invoke({"input": f"{ct.BENCHMARK_FOLLOW_UP_PREFIX}{query}", "chat_history": chat_history}),
+        queries
+    ))
+
+    return {
+        "scale": scale,
+        "corpus": {**get_corpus_size(corpus_dir), "generate_seconds": round(generate_seconds, 3)},
+        "chunks": stats["chunks"],
+        "phases": phases,
+        "peak_rss_mb": get_peak_rss_mb()
+    }
+
+
+def run_benchmark(scales, query_count=ct.BENCHMARK_QUERY_COUNT, work_dir=ct.BENCHMARK_WORK_DIR):
+    """
+    倍率ごとに別プロセスでベンチマークを実行し、結果をまとめる
+
+    Args:
+        scales: 疑似コーパスの倍率のリスト
+        query_count: 検索・回答生成の計測に使う質問数
+        work_dir: ベンチマーク用の作業フォルダパス
+
+    Returns:
+        計測結果の辞書
+    """
+    results = []
+    for scale in scales:
+        completed = subprocess.run(
+            [
+                sys.executable, "-m", "cli", "bench", "--scale-only", str(scale),
+                "--queries", str(query_count), "--work-dir", work_dir
+            ],
+            capture_output=True, text=True, encoding="utf8", check=True
+        )
+        # 子プロセスは結果のJSONのみを最終行に出力する
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    return {
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "query_count": query_count,
+        "results": results
+    }
@@ -0,0 +1,160 @@
+"""
+このファイルは、Webアプリとは別プロセスで実行する管理用コマンドが記述されたファイルです。
+
+使い方:
+    python -m cli build-index          # 変更のあったデータソースのみ反映してインデックスを作成
+    python -m cli build-index --full   # 全データソースを読み込み直してインデックスを作成
+    python -m cli watch                # データソースのフォルダを監視し、変更をインデックスに反映し続ける
+    python -m cli eval-recall --k 4    # 量子化ベクターストアの近似検索の recall@k を、厳密な検索と比較して計測
+    python -m cli bench --scales 10 100  # 「./data」を複製した疑似コーパスで、各処理段階の速度とメモリ使用量を計測
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+# Chroma が要求するバージョンの SQLite を使うため、利用可能であれば pysqlite3 を sqlite3 として使う（main.py と同様）
+try:
+    sys.modules["sqlite3"] = __import__("pysqlite3")
+except ImportError:
+    pass
+
+import json
+import time
+import logging
+import argparse
+from dotenv import load_dotenv
+import constants as ct
+import index_store
+import index_watcher
+import embedding_cache
+import quantized_store
+import benchmark
+
+
+############################################################
+# 設定関連
+############################################################
+# 「.env」ファイルで定義した環境変数の読み込み
+load_dotenv()
+
+
+############################################################
+# 関数定義
+############################################################
+
+def build_index(args):
+    """
+    インデックスを作成し、Webアプリから読み込めるよう公開する
+
+    Args:
+        args: コマンドライン引数
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    if args.workers is not None:
+        ct.INGEST_MAX_WORKERS = args.workers
+
+    embeddings = embedding_cache.create_embeddings()
+    start_time = time.perf_counter()
+    # Webアプリや他のコマンドと同時に作成処理が走らないよう、排他制御してから作成
+    with index_store.build_lock():
+        _, stats = index_store.update_index(embeddings, full_rebuild=args.full)
+
+    result = {
+        **stats,
+        "embedding_cache": embeddings.stats,
+        "index_path": index_store.get_current_index_path(),
+        "elapsed_seconds": round(time.perf_counter() - start_time, 3)
+    }
+    logger.info(result)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def watch(args):
+    """
+    データソースのフォルダを監視し、変更をインデックスに反映し続ける（Ctrl+Cで終了）
+
+    Args:
+        args: コマンドライン引数
+    """
+    index_watcher.watch_data_sources(embedding_cache.create_embeddings())
+
+
+def eval_recall(args):
+    """
+    公開中の量子化ベクターストアについて、近似検索の recall@k を厳密な検索と比較して計測
+
+    Args:
+        args: コマンドライン引数
+    """
+    db = index_store.open_index(embedding_cache.create_embeddings())
+    if not isinstance(db, quantized_store.QuantizedVectorStore):
+        raise SystemExit("公開中のインデックスが量子化ベクターストアではありません。"
+                         f"「VECTOR_STORE_BACKEND = \"{ct.VECTOR_STORE_BACKEND_QUANTIZED}\"」で作り直してください。")
+
+    # 倍率を複数指定した場合は、倍率ごとの精度と速度を並べて比較できるよう1行ずつ出力
+    for rerank_factor in args.rerank_factor or [db.rerank_factor]:
+        result = quantized_store.evaluate_recall(db, k=args.k, sample_size=args.samples, rerank_factor=rerank_factor)
+        print(json.dumps(result, ensure_ascii=False))
+
+
+def bench(args):
+    """
+    疑似コーパスと、埋め込みモデル・LLMの代替品を使って、各処理段階の速度とメモリ使用量を計測
+
+    Args:
+        args: コマンドライン引数
+    """
+    # 倍率ごとのピークメモリを分けて計測するため、1つの倍率の計測は別プロセスで行う（その結果のみを出力）
+    if args.scale_only is not None:
+        result = benchmark.run_scale(args.scale_only, query_count=args.queries, work_dir=args.work_dir)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    result = benchmark.run_benchmark(args.scales, query_count=args.queries, work_dir=args.work_dir)
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(output)
+    print(output)
+
+
+def main(argv=None):
+    """
+    コマンドライン引数を解析し、指定のコマンドを実行
+
+    Args:
+        argv: コマンドライン引数（Noneの場合は実行時の引数）
+    """
+    parser = argparse.ArgumentParser(prog="python -m cli", description=ct.APP_NAME)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build-index", help="RAG用のインデックスを作成する")
+    build_parser.add_argument("--full", action="store_true", help="差分ではなく全データソースから作り直す")
+    build_parser.add_argument("--workers", type=int, default=None, help="ファイル読み込みに使うプロセス数")
+    build_parser.set_defaults(func=build_index)
+
+    watch_parser = subparsers.add_parser("watch", help="データソースの変更をインデックスに反映し続ける")
+    watch_parser.set_defaults(func=watch)
+
+    recall_parser = subparsers.add_parser("eval-recall", help="量子化ベクターストアの recall@k を計測する")
+    recall_parser.add_argument("--k", type=int, default=ct.RETRIEVER_TOP_K, help="比較する上位件数")
+    recall_parser.add_argument("--samples", type=int, default=ct.QUANTIZED_RECALL_SAMPLE_SIZE, help="検索クエリとして使うベクトル数")
+    recall_parser.add_argument("--rerank-factor", type=int, nargs="*", default=None, help="並べ替え直す候補数の倍率（複数指定可）")
+    recall_parser.set_defaults(func=eval_recall)
+
+    bench_parser = subparsers.add_parser("bench", help="疑似コーパスで各処理段階の速度とメモリ使用量を計測する")
+    bench_parser.add_argument("--scales", type=int, nargs="+", default=ct.BENCHMARK_SCALES, help="「./data」を複製する倍率（複数指定可）")
+    bench_parser.add_argument("--queries", type=int, default=ct.BENCHMARK_QUERY_COUNT, help="検索・回答生成の計測に使う質問数")
+    bench_parser.add_argument("--work-dir", default=ct.BENCHMARK_WORK_DIR, help="疑似コーパスとインデックスを作成するフォルダ")
+    bench_parser.add_argument("--output", default=None, help="計測結果のJSONを書き込むファイルパス")
+    bench_parser.add_argument("--scale-only", type=int, default=None, help=argparse.SUPPRESS)
+    bench_parser.set_defaults(func=bench)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(asctime)s %(name)s: %(message)s")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,7 @@ def display_file_with_page(file_path, icon=None, page_number=None, style='succes
     ファイルパス＋ページ番号を一貫したUIで表示
     style: 'success'|'info'|'markdown'
     """
-    label = f"{file_path}"
-    if page_number is not None:
-        label += f"（ページNo.{page_number}）"
+    label = get_file_label(file_path, page_number)
     if style == 'success':
         st.success(label, icon=icon)
     elif style == 'info':
@@ -21,6 +19,14 @@ def display_file_with_page(file_path, icon=None, page_number=None, style='succes
     else:
         st.markdown(label)
 
+def get_file_label(file_path, page_number=None):
+    """
+    ファイルパス＋ページ番号の表示用の文字列を作成
+    """
+    if page_number is None:
+        return f"{file_path}"
+    return f"{file_path}（ページNo.{page_number}）"
+
 def display_sidebar():
     """
     サイドバーの表示（問題3用）
@@ -83,256 +89,424 @@ def display_initial_ai_message():
 def display_conversation_log():
     """
     会話ログの一覧表示
+    直近の会話のみを全て表示し、それより古い会話は切り替えスイッチをオンにした場合のみ、1ページ分を簡易表示する
+    （会話が長くなっても、再実行のたびに表示する量が一定になるようにする）
     """
-    # 会話ログのループ処理
-    for message in st.session_state.messages:
+    messages = st.session_state.messages
+    # 会話ログには「ユーザー入力値」と「LLMからの回答」が1往復ずつ交互に格納されている
+    recent_start = max(len(messages) - ct.CONVERSATION_LOG_RECENT_TURNS * 2, 0)
+
+    if recent_start:
+        display_conversation_archive(messages[:recent_start])
+
+    # 直近の会話は、回答作成時と同じ形式で表示
+    for message in messages[recent_start:]:
         # 「message」辞書の中の「role」キーには「user」か「assistant」が入っている
         with st.chat_message(message["role"]):
 
             # ユーザー入力値の場合、そのままテキストを表示するだけ
             if message["role"] == "user":
                 st.markdown(message["content"])
-            
-            # LLMからの回答の場合
+
+            # LLMからの回答の場合（作成時に整形済みの辞書データから表示し、LLMのレスポンスから整形し直すことはしない）
             else:
-                # 「社内文書検索」の場合、テキストの種類に応じて表示形式を分岐処理
-                if message["content"]["mode"] == ct.ANSWER_MODE_1:
-                    
-                    # ファイルのありかの情報が取得できた場合（通常時）の表示処理
-                    if not "no_file_path_flg" in message["content"]:
-                        # ==========================================
-                        # ユーザー入力値と最も関連性が高いメインドキュメントのありかを表示
-                        # ==========================================
-                        # 補足文の表示
-                        st.markdown(message["content"]["main_message"])
-
-                        # 参照元のありかに応じて、適したアイコンを取得
-                        icon = utils.get_source_icon(message['content']['main_file_path'])
-                        # 参照元ドキュメントのページ番号が取得できた場合にのみ、ページ番号を表示
-                        if "main_page_number" in message["content"]:
-                            st.success(f"{message['content']['main_file_path']}", icon=icon)
-                        else:
-                            st.success(f"{message['content']['main_file_path']}", icon=icon)
-                        
-                        # ==========================================
-                        # ユーザー入力値と関連性が高いサブドキュメントのありかを表示
-                        # ==========================================
-                        if "sub_message" in message["content"]:
-                            # 補足メッセージの表示
-                            st.markdown(message["content"]["sub_message"])
-
-                            # サブドキュメントのありかを一覧表示
-                            for sub_choice in message["content"]["sub_choices"]:
-                                # 参照元のありかに応じて、適したアイコンを取得
-                                icon = utils.get_source_icon(sub_choice['source'])
-                                if "page_number" in sub_choice:
-                                    st.info(f"{sub_choice['source']}（ページNo.{sub_choice['page_number']}）", icon=icon)
-                                else:
-                                    st.info(f"{sub_choice['source']}", icon=icon)
-                    # ファイルのありかの情報が取得できなかった場合、LLMからの回答のみ表示
-                    else:
-                        st.markdown(message["content"]["answer"])
-                
-                # 「社内問い合わせ」の場合の表示処理
-                else:
-                    # LLMからの回答を表示
-                    st.markdown(message["content"]["answer"])
-
-                    # 参照元のありかを一覧表示
-                    if "file_info_list" in message["content"]:
-                        # 区切り線の表示
-                        st.divider()
-                        # 「情報源」の文字を太字で表示
-                        st.markdown(f"##### {message['content']['message']}")
-                        # ドキュメントのありかを一覧表示
-                        for file_info in message["content"]["file_info_list"]:
-                            # 参照元のありかに応じて、適したアイコンを取得
-                            icon = utils.get_source_icon(file_info)
-                            st.info(file_info, icon=icon)
-
-
-def display_search_llm_response(llm_response):
-    """
-    「社内文書検索」モードにおけるLLMレスポンスを表示
+                display_assistant_content(message["content"])
+
+
+def display_conversation_archive(messages):
+    """
+    直近より古い会話ログを、切り替えスイッチをオンにした場合のみ、ページ単位で簡易表示
+    （スイッチがオフの間は、古い会話の表示処理を一切行わない）
 
     Args:
-        llm_response: LLMからの回答
+        messages: 直近より古い会話ログのメッセージのリスト
+    """
+    turn_count = len(messages) // 2
+    if not st.toggle(f"{ct.CONVERSATION_LOG_ARCHIVE_LABEL}（{turn_count}件）", key="show_conversation_archive"):
+        return
+
+    # 1ページ目を最も新しい会話とし、ページ内は古い順に表示
+    page_count = -(-turn_count // ct.CONVERSATION_LOG_ARCHIVE_PAGE_TURNS)
+    page = 1
+    if page_count > 1:
+        page = st.number_input("ページ（1が最新）", min_value=1, max_value=page_count, value=1, key="conversation_archive_page")
+    end = len(messages) - (page - 1) * ct.CONVERSATION_LOG_ARCHIVE_PAGE_TURNS * 2
+    start = max(end - ct.CONVERSATION_LOG_ARCHIVE_PAGE_TURNS * 2, 0)
+
+    for message in messages[start:end]:
+        with st.chat_message(message["role"]):
+            # 1メッセージを1つのMarkdownとして表示（作成済みのMarkdownを使い回す）
+            st.markdown(get_message_markdown(message))
+
+
+def get_message_markdown(message):
+    """
+    会話ログのメッセージを簡易表示するためのMarkdownを取得
+    （メッセージごとに1度だけ作成し、メッセージの辞書に保持して使い回す）
+
+    Args:
+        message: 会話ログのメッセージ
 
     Returns:
-        LLMからの回答を画面表示用に整形した辞書データ
+        Markdownのテキスト
     """
-    # LLMからのレスポンスに参照元情報が入っており、かつ「該当資料なし」が回答として返された場合
-    if llm_response["context"] and llm_response["answer"] != ct.NO_DOC_MATCH_ANSWER:
+    if "markdown" not in message:
+        message["markdown"] = build_message_markdown(message)
+    return message["markdown"]
 
-        # ==========================================
-        # ユーザー入力値と最も関連性が高いメインドキュメントのありかを表示
-        # ==========================================
-        # LLMからのレスポンス（辞書）の「context」属性の中の「0」に、最も関連性が高いドキュメント情報が入っている
-        main_file_path = llm_response["context"][0].metadata["source"]
 
-        # 補足メッセージの表示
-        main_message = "入力内容に関する情報は、以下のファイルに含まれている可能性があります。"
-        st.markdown(main_message)
-        
-        # 参照元のありかに応じて、適したアイコンを取得
-        icon = utils.get_source_icon(main_file_path)
-        # ページ番号が取得できた場合のみ、ページ番号を表示（ドキュメントによっては取得できない場合がある）
-        if "page" in llm_response["context"][0].metadata:
-            main_page_number = llm_response["context"][0].metadata["page"]
+def build_message_markdown(message):
+    """
+    会話ログのメッセージを、1つのMarkdownのテキストに変換
+
+    Args:
+        message: 会話ログのメッセージ
+
+    Returns:
+        Markdownのテキスト
+    """
+    # ユーザー入力値の場合、そのままのテキスト
+    if message["role"] == "user":
+        return message["content"]
+
+    content = message["content"]
+    lines = []
+    # 「社内文書検索」の場合、ファイルのありかを一覧にする
+    if content["mode"] == ct.ANSWER_MODE_1:
+        if "no_file_path_flg" in content:
+            lines.append(content["answer"].strip())
         else:
-            main_page_number = None
-        display_file_with_page(main_file_path, icon=icon, page_number=main_page_number, style='success')
-
-        # ==========================================
-        # ユーザー入力値と関連性が高いサブドキュメントのありかを表示
-        # ==========================================
-        # メインドキュメント以外で、関連性が高いサブドキュメントを格納する用のリストを用意
-        sub_choices = []
-        # 重複チェック用のリストを用意
-        duplicate_check_list = []
-
-        # ドキュメントが2件以上検索できた場合（サブドキュメントが存在する場合）のみ、サブドキュメントのありかを一覧表示
-        # 「source_documents」内のリストの2番目以降をスライスで参照（2番目以降がなければfor文内の処理は実行されない）
-        for document in llm_response["context"][1:]:
-            # ドキュメントのファイルパスを取得
-            sub_file_path = document.metadata["source"]
-
-            # メインドキュメントのファイルパスと重複している場合、処理をスキップ（表示しない）
-            if sub_file_path == main_file_path:
-                continue
-            
-            # 同じファイル内の異なる箇所を参照した場合、2件目以降のファイルパスに重複が発生する可能性があるため、重複を除去
-            if sub_file_path in duplicate_check_list:
-                continue
-
-            # 重複チェック用のリストにファイルパスを順次追加
-            duplicate_check_list.append(sub_file_path)
-            
-            # ページ番号が取得できない場合のための分岐処理
-            if "page" in document.metadata:
-                # ページ番号を取得
-                sub_page_number = document.metadata["page"]
-                # 「サブドキュメントのファイルパス」と「ページ番号」の辞書を作成
-                sub_choice = {"source": sub_file_path, "page_number": sub_page_number}
-            else:
-                # 「サブドキュメントのファイルパス」の辞書を作成
-                sub_choice = {"source": sub_file_path}
-            
-            # 後ほど一覧表示するため、サブドキュメントに関する情報を順次リストに追加
-            sub_choices.append(sub_choice)
-        
-        # サブドキュメントが存在する場合のみの処理
-        if sub_choices:
-            # 補足メッセージの表示
-            sub_message = "その他、ファイルありかの候補を提示します。"
-            st.markdown(sub_message)
-
-            # サブドキュメントに対してのループ処理
-            for sub_choice in sub_choices:
-                # 参照元のありかに応じて、適したアイコンを取得
-                icon = utils.get_source_icon(sub_choice['source'])
-                if 'page_number' in sub_choice:
-                    st.info(f"{sub_choice['source']}（ページNo.{sub_choice['page_number']}）", icon=icon)
-                else:
-                    st.info(f"{sub_choice['source']}", icon=icon)
-        
-        # 表示用の会話ログに格納するためのデータを用意
-        # - 「mode」: モード（「社内文書検索」or「社内問い合わせ」）
-        # - 「main_message」: メインドキュメントの補足メッセージ
-        # - 「main_file_path」: メインドキュメントのファイルパス
-        # - 「main_page_number」: メインドキュメントのページ番号
-        # - 「sub_message」: サブドキュメントの補足メッセージ
-        # - 「sub_choices」: サブドキュメントの情報リスト
-        content = {}
-        content["mode"] = ct.ANSWER_MODE_1
-        content["main_message"] = main_message
-        content["main_file_path"] = main_file_path
-        # メインドキュメントのページ番号は、取得できた場合にのみ追加
-        if "page" in llm_response["context"][0].metadata:
-            content["main_page_number"] = main_page_number
-        # サブドキュメントの情報は、取得できた場合にのみ追加
-        if sub_choices:
-            content["sub_message"] = sub_message
-            content["sub_choices"] = sub_choices
-    
-    # LLMからのレスポンスに、ユーザー入力値と関連性の高いドキュメント情報が入って「いない」場合
+            lines.append(content["main_message"])
+            lines.append(f"- {utils.get_source_icon(content['main_file_path'])}{get_file_label(content['main_file_path'], content.get('main_page_number'))}")
+            if "sub_message" in content:
+                lines.append("")
+                lines.append(content["sub_message"])
+                for sub_choice in content["sub_choices"]:
+                    lines.append(f"- {utils.get_source_icon(sub_choice['source'])}{get_file_label(sub_choice['source'], sub_choice.get('page_number'))}")
+    # 「社内問い合わせ」の場合、LLMからの回答と参照元のありかの一覧にする
     else:
-        # contextに情報があればcontext内容をリストで抜粋表示
-        if llm_response.get("context"):
-            st.markdown("#### 🔍 検索ヒット文書一覧（AI回答が該当資料なしの場合も表示）")
-            for doc in llm_response["context"]:
-                st.expander(f"{doc.metadata.get('source', '')}").write(doc.page_content)
-        # 関連ドキュメントが取得できなかった場合のメッセージ表示
-        st.markdown(ct.NO_DOC_MATCH_MESSAGE)
-
-        # 表示用の会話ログに格納するためのデータを用意
-        content = {}
-        content["mode"] = ct.ANSWER_MODE_1
+        lines.append(content["answer"])
+        if "file_info_list" in content:
+            lines.append("")
+            lines.append(f"##### {content['message']}")
+            for file_info in content["file_info_list"]:
+                lines.append(f"- {utils.get_source_icon(file_info)}{file_info}")
+
+    # 全文検索の結果は、本文を省略してファイルのありかのみ一覧にする
+    if content.get("keyword_hits"):
+        lines.append("")
+        lines.append("**🔍 キーワード一致による全文検索結果**")
+        for hit in content["keyword_hits"]:
+            lines.append(f"- {utils.get_source_icon(hit['source'])}{hit['source']}")
+
+    return "\n".join(lines)
+
+
+def build_search_content(llm_response):
+    """
+    「社内文書検索」モードにおけるLLMレスポンスを、画面表示用の辞書データに整形（表示はしない）
+
+    Args:
+        llm_response: LLMからの回答
+
+    Returns:
+        LLMからの回答を画面表示用に整形した辞書データ
+    """
+    content = {}
+    content["mode"] = ct.ANSWER_MODE_1
+
+    # LLMからのレスポンスに、ユーザー入力値と関連性の高いドキュメント情報が入って「いない」場合
+    if not llm_response["context"] or llm_response["answer"] == ct.NO_DOC_MATCH_ANSWER:
+        # - 「answer」: 関連ドキュメントが取得できなかった場合のメッセージ
+        # - 「no_file_path_flg」: ファイルのありかの情報が取得できなかったことを示すフラグ
+        # - 「context_hits」: 検索でヒットしたドキュメントの一覧（AI回答が該当資料なしの場合も表示）
         content["answer"] = ct.NO_DOC_MATCH_MESSAGE
         content["no_file_path_flg"] = True
+        content["context_hits"] = [
+            {"source": doc.metadata.get("source", ""), "text": doc.page_content}
+            for doc in llm_response["context"]
+        ]
+        return content
+
+    # ==========================================
+    # ユーザー入力値と最も関連性が高いメインドキュメントのありか
+    # ==========================================
+    # LLMからのレスポンス（辞書）の「context」属性の中の「0」に、最も関連性が高いドキュメント情報が入っている
+    main_file_path = llm_response["context"][0].metadata["source"]
+
+    # - 「mode」: モード（「社内文書検索」or「社内問い合わせ」）
+    # - 「main_message」: メインドキュメントの補足メッセージ
+    # - 「main_file_path」: メインドキュメントのファイルパス
+    # - 「main_page_number」: メインドキュメントのページ番号
+    # - 「sub_message」: サブドキュメントの補足メッセージ
+    # - 「sub_choices」: サブドキュメントの情報リスト
+    content["main_message"] = "入力内容に関する情報は、以下のファイルに含まれている可能性があります。"
+    content["main_file_path"] = main_file_path
+    # メインドキュメントのページ番号は、取得できた場合にのみ追加（ドキュメントによっては取得できない場合がある）
+    if "page" in llm_response["context"][0].metadata:
+        content["main_page_number"] = llm_response["context"][0].metadata["page"]
+
+    # ==========================================
+    # ユーザー入力値と関連性が高いサブドキュメントのありか
+    # ==========================================
+    # メインドキュメント以外で、関連性が高いサブドキュメントを格納する用のリストを用意
+    sub_choices = []
+    # 重複チェック用のリストを用意（メインドキュメントと同じファイルは表示しない）
+    duplicate_check_list = [main_file_path]
+
+    # 「context」内のリストの2番目以降をスライスで参照（2番目以降がなければfor文内の処理は実行されない）
+    for document in llm_response["context"][1:]:
+        # ドキュメントのファイルパスを取得
+        sub_file_path = document.metadata["source"]
+
+        # 同じファイル内の異なる箇所を参照した場合、ファイルパスに重複が発生する可能性があるため、重複を除去
+        if sub_file_path in duplicate_check_list:
+            continue
+        duplicate_check_list.append(sub_file_path)
+
+        # ページ番号が取得できない場合のための分岐処理
+        sub_choice = {"source": sub_file_path}
+        if "page" in document.metadata:
+            sub_choice["page_number"] = document.metadata["page"]
+        sub_choices.append(sub_choice)
+
+    # サブドキュメントの情報は、取得できた場合にのみ追加
+    if sub_choices:
+        content["sub_message"] = "その他、ファイルありかの候補を提示します。"
+        content["sub_choices"] = sub_choices
+
     return content
 
 
-def display_contact_llm_response(llm_response):
+def build_contact_sources(context):
     """
-    「社内問い合わせ」モードにおけるLLMレスポンスを表示
+    「社内問い合わせ」モードにおいて、LLMが回答生成の参照元として使ったドキュメントの一覧を、表示用に整形（表示はしない）
 
     Args:
-        llm_response: LLMからの回答
+        context: 参照元のドキュメントのリスト
 
     Returns:
-        LLMからの回答を画面表示用に整形した辞書データ
+        補足メッセージと、ファイル情報のリストの組
     """
-    # LLMからの回答を表示
-    st.markdown(llm_response["answer"])
+    message = "情報源"
+
+    # 参照元のファイルパスの一覧を格納するためのリストを用意
+    file_path_list = []
+    file_info_list = []
+
+    # LLMが回答生成の参照元として使ったドキュメントの一覧が「context」内のリストの中に入っているため、ループ処理
+    for document in context:
+        # ファイルパスを取得
+        file_path = document.metadata["source"]
+        # ファイルパスの重複は除去
+        if file_path in file_path_list:
+            continue
+
+        if "page" in document.metadata:
+            # 「ファイルパス」と「ページ番号」
+            file_info = f"{file_path}（ページNo.{document.metadata['page']+1}）"
+        else:
+            # 「ファイルパス」のみ
+            file_info = f"{file_path}"
 
-    # ユーザーの質問・要望に適切な回答を行うための情報が、社内文書のデータベースに存在しなかった場合
-    if llm_response["answer"] != ct.INQUIRY_NO_MATCH_ANSWER:
-        # 区切り線を表示
-        st.divider()
+        # 重複チェック用に、ファイルパスをリストに順次追加
+        file_path_list.append(file_path)
+        # ファイル情報をリストに順次追加
+        file_info_list.append(file_info)
 
-        # 補足メッセージを表示
-        message = "情報源"
-        st.markdown(f"##### {message}")
-
-        # 参照元のファイルパスの一覧を格納するためのリストを用意
-        file_path_list = []
-        file_info_list = []
-
-        # LLMが回答生成の参照元として使ったドキュメントの一覧が「context」内のリストの中に入っているため、ループ処理
-        for document in llm_response["context"]:
-            # ファイルパスを取得
-            file_path = document.metadata["source"]
-            # ファイルパスの重複は除去
-            if file_path in file_path_list:
-                continue
-
-            page_number = document.metadata["page"] if "page" in document.metadata else None
-            if "page" in document.metadata:
-                # 「ファイルパス」と「ページ番号」
-                file_info = f"{file_path}（ページNo.{page_number+1}）"
-            else:
-                # 「ファイルパス」のみ
-                file_info = f"{file_path}"
-            icon = utils.get_source_icon(file_path)
-            display_file_with_page(file_path, icon=icon, page_number=page_number, style='info')
+    return message, file_info_list
 
-            # 重複チェック用に、ファイルパスをリストに順次追加
-            file_path_list.append(file_path)
-            # ファイル情報をリストに順次追加
-            file_info_list.append(file_info)
 
-    # 表示用の会話ログに格納するためのデータを用意
+def build_contact_content(answer, message=None, file_info_list=None):
+    """
+    「社内問い合わせ」モードにおいて、表示用の会話ログに格納するためのデータを用意
+
+    Args:
+        answer: LLMからの回答
+        message: 情報源の補足メッセージ
+        file_info_list: ファイル情報のリスト
+
+    Returns:
+        画面表示用に整形した辞書データ
+    """
     # - 「mode」: モード（「社内文書検索」or「社内問い合わせ」）
     # - 「answer」: LLMからの回答
     # - 「message」: 補足メッセージ
     # - 「file_path_list」: ファイルパスの一覧リスト
     content = {}
     content["mode"] = ct.ANSWER_MODE_2
-    content["answer"] = llm_response["answer"]
+    content["answer"] = answer
     # 参照元のドキュメントが取得できた場合のみ
-    if llm_response["answer"] != ct.INQUIRY_NO_MATCH_ANSWER:
+    if answer != ct.INQUIRY_NO_MATCH_ANSWER and message is not None:
         content["message"] = message
         content["file_info_list"] = file_info_list
 
-    return content
\ No newline at end of file
+    return content
+
+
+def build_llm_response_content(mode, llm_response):
+    """
+    モードに応じて、LLMレスポンスを画面表示用の辞書データに整形（表示はしない）
+
+    Args:
+        mode: 回答モード
+        llm_response: LLMからの回答
+
+    Returns:
+        LLMからの回答を画面表示用に整形した辞書データ
+    """
+    if mode != ct.ANSWER_MODE_2:
+        return build_search_content(llm_response)
+
+    # ユーザーの質問・要望に適切な回答を行うための情報が、社内文書のデータベースに存在しなかった場合は情報源を付けない
+    if llm_response["answer"] == ct.INQUIRY_NO_MATCH_ANSWER:
+        return build_contact_content(llm_response["answer"])
+    message, file_info_list = build_contact_sources(llm_response["context"])
+    return build_contact_content(llm_response["answer"], message, file_info_list)
+
+
+def build_keyword_hits(keyword_results):
+    """
+    全文検索（キーワード一致）の結果を、会話ログに格納できる表示用の形式に整形
+
+    Args:
+        keyword_results: ヒット結果（KeywordHit型）のリスト
+
+    Returns:
+        ファイルパスと本文の辞書のリスト
+    """
+    return [
+        {"source": hit.document.metadata.get("source", ""), "text": hit.document.page_content}
+        for hit in keyword_results
+    ]
+
+
+def display_assistant_content(content):
+    """
+    画面表示用に整形済みの回答の辞書データを、モードに応じた形式で表示
+
+    Args:
+        content: LLMからの回答を画面表示用に整形した辞書データ
+    """
+    # 「社内文書検索」の場合、テキストの種類に応じて表示形式を分岐処理
+    if content["mode"] == ct.ANSWER_MODE_1:
+        display_search_content(content)
+    # 「社内問い合わせ」の場合、LLMからの回答と参照元のありかを表示
+    else:
+        st.markdown(content["answer"])
+        if "file_info_list" in content:
+            display_contact_sources(content["message"], content["file_info_list"])
+
+    display_keyword_hits(content.get("keyword_hits"))
+
+
+def display_search_content(content):
+    """
+    「社内文書検索」モードにおける、整形済みの回答の辞書データを表示
+
+    Args:
+        content: LLMからの回答を画面表示用に整形した辞書データ
+    """
+    # ファイルのありかの情報が取得できなかった場合、検索でヒットした文書と、LLMからの回答のみ表示
+    if "no_file_path_flg" in content:
+        if content.get("context_hits"):
+            st.markdown("#### 🔍 検索ヒット文書一覧（AI回答が該当資料なしの場合も表示）")
+            for hit in content["context_hits"]:
+                st.expander(hit["source"]).write(hit["text"])
+        st.markdown(content["answer"])
+        return
+
+    # ==========================================
+    # ユーザー入力値と最も関連性が高いメインドキュメントのありかを表示
+    # ==========================================
+    # 補足文の表示
+    st.markdown(content["main_message"])
+    # 参照元のありかに応じて、適したアイコンを取得
+    icon = utils.get_source_icon(content["main_file_path"])
+    # 参照元ドキュメントのページ番号が取得できた場合にのみ、ページ番号を表示
+    display_file_with_page(content["main_file_path"], icon=icon, page_number=content.get("main_page_number"), style='success')
+
+    # ==========================================
+    # ユーザー入力値と関連性が高いサブドキュメントのありかを表示
+    # ==========================================
+    if "sub_message" in content:
+        # 補足メッセージの表示
+        st.markdown(content["sub_message"])
+
+        # サブドキュメントのありかを一覧表示
+        for sub_choice in content["sub_choices"]:
+            # 参照元のありかに応じて、適したアイコンを取得
+            icon = utils.get_source_icon(sub_choice["source"])
+            display_file_with_page(sub_choice["source"], icon=icon, page_number=sub_choice.get("page_number"), style='info')
+
+
+def display_contact_sources(message, file_info_list):
+    """
+    「社内問い合わせ」モードにおいて、LLMが回答生成の参照元として使ったドキュメントの一覧を表示
+
+    Args:
+        message: 情報源の補足メッセージ
+        file_info_list: ファイル情報のリスト
+    """
+    # 区切り線の表示
+    st.divider()
+    # 「情報源」の文字を太字で表示
+    st.markdown(f"##### {message}")
+    # ドキュメントのありかを一覧表示
+    for file_info in file_info_list:
+        # 参照元のありかに応じて、適したアイコンを取得
+        icon = utils.get_source_icon(file_info)
+        st.info(file_info, icon=icon)
+
+
+def display_keyword_hits(keyword_hits):
+    """
+    全文検索（キーワード一致）の結果を表示
+
+    Args:
+        keyword_hits: ファイルパスと本文の辞書のリスト
+    """
+    if not keyword_hits:
+        return
+
+    st.markdown("#### 🔍 キーワード一致による全文検索結果")
+    for hit in keyword_hits:
+        st.expander(hit["source"]).write(hit["text"])
+
+
+def display_contact_llm_response_stream(response_stream):
+    """
+    「社内問い合わせ」モードにおけるLLMレスポンスを、生成され次第順次表示
+    検索が終わった時点で情報源を表示し、回答は1トークンずつ追記する
+
+    Args:
+        response_stream: 「context」または「answer」のいずれかを持つ辞書を順次返すイテレーター
+
+    Returns:
+        LLMからの回答を画面表示用に整形した辞書データ
+    """
+    # 回答を情報源より上に表示するため、表示領域を先に確保しておく
+    answer_container = st.container()
+    sources_placeholder = st.empty()
+    sources = {}
+
+    def answer_tokens():
+        for chunk in response_stream:
+            # 回答の生成が始まる前に、検索で取得した情報源を表示
+            if "context" in chunk:
+                sources["message"], sources["file_info_list"] = build_contact_sources(chunk["context"])
+                with sources_placeholder.container():
+                    display_contact_sources(sources["message"], sources["file_info_list"])
+            if "answer" in chunk:
+                yield chunk["answer"]
+
+    answer = answer_container.write_stream(answer_tokens())
+    if not isinstance(answer, str):
+        answer = "".join(str(token) for token in answer)
+
+    # 社内文書のデータベースに回答に必要な情報が存在しなかった場合、表示済みの情報源を消す
+    if answer == ct.INQUIRY_NO_MATCH_ANSWER:
+        sources_placeholder.empty()
+        sources = {}
+
+    return build_contact_content(answer, sources.get("message"), sources.get("file_info_list"))
@@ -1,4 +1,5 @@
 # マジックナンバー定数化
+# チャンクの最大トークン数と、見出しのまとまりの途中で区切った場合に次のチャンクへ重ねるトークン数
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
 """
@@ -41,6 +42,11 @@ LINK_SOURCE_ICON = ":material/link: "
 WARNING_ICON = ":material/warning:"
 ERROR_ICON = ":material/error:"
 SPINNER_TEXT = "回答生成中..."
+# 会話ログのうち、画面に全て表示する直近の会話数（1往復を1件と数える）
+CONVERSATION_LOG_RECENT_TURNS = 5
+# それより古い会話は、切り替えスイッチをオンにした場合のみ、1ページあたりこの会話数ずつ簡易表示する
+CONVERSATION_LOG_ARCHIVE_PAGE_TURNS = 10
+CONVERSATION_LOG_ARCHIVE_LABEL = "過去の会話を表示"
 
 
 # ==========================================
@@ -49,14 +55,68 @@ SPINNER_TEXT = "回答生成中..."
 LOG_DIR_PATH = "./logs"
 LOGGER_NAME = "ApplicationLog"
 LOG_FILE = "application.log"
+# ログファイルを切り替える時間の単位と、サイズの上限（どちらかに達した時点で切り替える）
+LOG_ROTATE_WHEN = "D"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+# 残しておく切り替え済みのログファイル数と、切り替え済みのファイルをgzipで圧縮するかどうか
+LOG_BACKUP_COUNT = 14
+LOG_COMPRESS = False
+# 書き込み待ちのログを溜めておく最大件数（あふれた分は、画面の処理を待たせないよう破棄する）
+LOG_QUEUE_SIZE = 10000
+# キューがあふれて破棄したログの件数を、警告のログとして記録する間隔（秒。プロセスの終了時にも記録する）
+LOG_DROP_REPORT_INTERVAL = 60
 APP_BOOT_MESSAGE = "アプリが起動されました。"
 
 
+# ==========================================
+# 計測系
+# ==========================================
+# 1ターンごとの処理段階別の所要時間・トークン数を、1行1件のJSONで出力するロガー名とファイル名
+TRACE_LOGGER_NAME = "ChatTurnTrace"
+TRACE_LOG_FILE = "trace.jsonl"
+# OpenTelemetryのスパン・メトリクスに付けるサービス名
+TRACE_SERVICE_NAME = "company-inner-search"
+# この環境変数にOTLPの送信先（例: http://localhost:4317）が設定されている場合のみ、OpenTelemetryで送信する
+TRACE_OTLP_ENDPOINT_ENV_NAME = "OTEL_EXPORTER_OTLP_ENDPOINT"
+TRACE_METRIC_EXPORT_INTERVAL_MS = 15000
+# 質問文の書き換えのLLM呼び出しを、回答生成と区別するためのタグ
+TRACE_QUERY_REWRITE_TAG = "query_rewrite"
+# ベンチマーク（python -m cli bench）で「./data」を複製して作る疑似コーパスの倍率
+BENCHMARK_SCALES = [10, 100, 1000]
+# 疑似コーパスとインデックスを作成する作業フォルダ（同じ倍率の疑似コーパスは再利用する）
+BENCHMARK_WORK_DIR = "./.benchmark"
+# 検索・回答生成の計測に使う質問数と、質問文の一覧（質問数に達するまで繰り返して使う）
+BENCHMARK_QUERY_COUNT = 50
+BENCHMARK_QUERIES = [
+    "有給休暇の取得方法を教えてください",
+    "人事部に所属している従業員の一覧",
+    "EMP00010001",
+    "経費精算の申請期限はいつですか",
+    "会社の事業内容と沿革",
+    "リモートワークの規定について",
+    "育児休業の申請手続き",
+    "新入社員研修のスケジュール"
+]
+# 前の会話を指す質問として計測する際に、質問文の前に付ける語句
+BENCHMARK_FOLLOW_UP_PREFIX = "それに関連して、"
+# ベンチマークで使う疑似埋め込みモデルのベクトルの次元数
+BENCHMARK_EMBEDDING_SIZE = 256
+
+
 # ==========================================
 # LLM設定系
 # ==========================================
 MODEL = "gpt-4o-mini"
 TEMPERATURE = 0.5
+# LLMのAPIとの通信に使うHTTP接続の上限（プロセス内の全セッションで接続を使い回す）
+LLM_HTTP_MAX_CONNECTIONS = 20
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+LLM_HTTP_TIMEOUT = 60
+# 環境変数「APP_FAKE_LLM」に「1」を指定した場合、APIを呼び出さず固定の回答を返す疑似LLMを使う（動作確認・テスト用）
+FAKE_LLM_ENV_NAME = "APP_FAKE_LLM"
+FAKE_LLM_RESPONSE = "これは疑似LLMによる回答です。実際の回答を表示するには、環境変数「APP_FAKE_LLM」を解除してください。"
+# 疑似LLMが1文字ずつ返す間隔の秒数（ストリーミング表示の確認用）
+FAKE_LLM_SLEEP = 0.02
 
 
 # ==========================================
@@ -72,6 +132,194 @@ SUPPORTED_EXTENSIONS = {
 WEB_URL_LOAD_TARGETS = [
     "https://generative-ai.web-camp.io/"
 ]
+# ファイル読み込みに使うプロセス数（NoneはCPUコア数、1以下は並列化しない）
+INGEST_MAX_WORKERS = None
+# 1プロセスあたり先行して読み込みを依頼するファイル数
+INGEST_PREFETCH_PER_WORKER = 2
+
+
+# ==========================================
+# ベクターストア（インデックス）系
+# ==========================================
+INDEX_ROOT_DIR = "./.chroma"
+INDEX_CURRENT_FILE = "CURRENT"
+INDEX_LOCK_FILE = "build.lock"
+# 作成途中で異常終了したロックを破棄するまでの秒数
+INDEX_LOCK_TIMEOUT = 60 * 60
+INDEX_LOCK_POLL_INTERVAL = 1
+# 読み込み中の他プロセスのために残しておく世代数
+INDEX_KEEP_GENERATIONS = 2
+INDEX_MANIFEST_FILE = "manifest.json"
+KEYWORD_INDEX_FILE = "keyword_index.pkl"
+# チャンクの本文・メタデータを連結したバイト列と、その区切り位置の配列を保存するファイル（文書ストア）
+DOC_STORE_BLOB_FILE = "documents.bin"
+DOC_STORE_OFFSETS_FILE = "documents_offsets.npy"
+# ベクターストアの種類（「chroma」: Chroma、「quantized」: int8量子化ベクトルで概算し、float32で並べ替える独自形式）
+# 変更後は「python -m cli build-index --full」でインデックスを作り直す
+VECTOR_STORE_BACKEND = "chroma"
+VECTOR_STORE_BACKEND_CHROMA = "chroma"
+VECTOR_STORE_BACKEND_QUANTIZED = "quantized"
+# 量子化ベクターストアのファイルを格納する、インデックスのフォルダ内のフォルダ名とファイル名
+QUANTIZED_STORE_DIR = "quantized"
+QUANTIZED_INFO_FILE = "info.json"
+QUANTIZED_IDS_FILE = "ids.txt"
+QUANTIZED_DELETED_FILE = "deleted.txt"
+QUANTIZED_CODES_FILE = "codes.i8"
+QUANTIZED_SCALES_FILE = "scales.f32"
+QUANTIZED_VECTORS_FILE = "vectors.f32"
+QUANTIZED_BLOB_FILE = "documents.bin"
+QUANTIZED_OFFSETS_FILE = "documents_offsets.u64"
+# 最終的に返す件数に対して、float32のベクトルで並べ替え直す候補数の倍率（大きいほど厳密な検索に近づくが遅くなる）
+QUANTIZED_RERANK_FACTOR = 10
+# 類似度を概算する際に、1度に計算するベクトル数（一時的に使うメモリ量の上限になる）
+QUANTIZED_SEARCH_BLOCK_SIZE = 8192
+# 削除済みの行が全行に占める割合がこの値を超えたら、インデックスの更新時に削除済みの行を取り除く
+QUANTIZED_COMPACT_DELETED_RATIO = 0.2
+# recall@kの計測時に、検索クエリとして使う格納済みのベクトル数
+QUANTIZED_RECALL_SAMPLE_SIZE = 200
+# マニフェストの形式やチャンク分割の方法を変更した場合に値を上げる（古い形式のインデックスは作り直す）
+INDEX_MANIFEST_VERSION = 4
+# ハッシュ値計算時に1度に読み込むバイト数
+HASH_READ_BLOCK_SIZE = 1024 * 1024
+# 1回の登録でまとめて埋め込むチャンク数（中断時に再計算が必要になるのは最大この件数分）
+INDEX_UPSERT_BATCH_SIZE = 1000
+CHROMA_COLLECTION_NAME = "company_inner_search"
+# アプリの起動中にデータソースのフォルダを監視し、変更をインデックスへ自動で反映するかどうか
+# （複数プロセスで起動する場合は無効にし、「python -m cli watch」を1つだけ実行してもよい）
+INDEX_WATCH_ENABLED = True
+# 連続した変更をまとめて反映するまでの待機ミリ秒数
+INDEX_WATCH_DEBOUNCE_MS = 3000
+# インデックスが未作成の場合に、画面の初期化処理の中で作成するかどうか（通常はコマンドで事前に作成する）
+INDEX_BUILD_ON_STARTUP = False
+
+# ==========================================
+# チャンク分割系
+# ==========================================
+# 見出しとみなす行の最大文字数
+SPLITTER_HEADING_MAX_CHARS = 40
+# 見出しとみなす行の書式（「# 概要」「第2章」「1. 基本情報」「3.1 議題」「【目的】」「■ 手順」など。「●」「○」は箇条書きの記号として扱う）
+SPLITTER_HEADING_PATTERN = r"^(#{1,6}\s|第[0-9０-９一二三四五六七八九十百]+[章節条項]|[0-9０-９]+(\.[0-9０-９]+)*\.?\s|【[^】]+】|[■□◆◇▼▶])"
+# PDFの折り返しではなく、意図した改行とみなす行末（文末の記号・コロン）
+SPLITTER_LINE_END_PATTERN = r"[。！？!?:：]$"
+# 箇条書き・番号付きの項目とみなす行頭の記号（「● 企業名」「○ 100株以上」「・ 手順」「1. 手順」「(1) 内容」など）
+# この記号で始まる行は、前の行に連結しない
+SPLITTER_LIST_MARKER_PATTERN = r"^([●○◎◯・•▪■□◆◇▼▶※\-－*＊]|[0-9０-９]+[.．)）]|[(（][0-9０-９]+[)）])"
+
+# ==========================================
+# 検索系
+# ==========================================
+# LLMに渡すチャンク数（ベクトル検索とキーワード検索を統合して絞り込むため、少なめにしている）
+RETRIEVER_TOP_K = 4
+# 統合前に、ベクトル検索・キーワード検索のそれぞれから取得する候補数
+HYBRID_CANDIDATE_K = 10
+# Reciprocal Rank Fusionの定数（大きいほど下位の順位との差が小さくなる）
+RRF_K = 60
+# BM25のパラメータ（出現回数の飽和度と、文書長による正規化の強さ）
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 語全体の一致を加点する英数字の語（社員ID・メールアドレスなど）のパターン
+BM25_EXACT_TERM_PATTERN = r"[A-Za-z0-9][A-Za-z0-9_.@-]{2,}"
+# 全文検索（キーワード一致）の最大表示件数
+MAX_KEYWORD_RESULTS = 10
+# LLMに渡す参照元のチャンクの合計トークン数の上限（関連度の高い順に詰め、あふれた分は渡さない）
+CONTEXT_MAX_TOKENS = 3000
+# 上限に収まらないチャンクを切り詰めて渡す場合の、最小のトークン数（これより少なくなる場合は渡さない）
+CONTEXT_MIN_TRUNCATED_TOKENS = 100
+# 隣り合うチャンクを結合する際に、重複とみなす文字数の範囲
+CONTEXT_MIN_OVERLAP_CHARS = 10
+CONTEXT_MAX_OVERLAP_CHARS = 200
+
+
+# ==========================================
+# 会話履歴系
+# ==========================================
+# LLMに原文のまま渡す直近の会話数（1往復を1件と数える）と、その合計トークン数の上限
+CHAT_HISTORY_MAX_TURNS = 6
+CHAT_HISTORY_MAX_TOKENS = 2000
+# 上限を超えた古い会話は要約にまとめる（要約のトークン数の上限と、1つの発言から抜き出す最大文字数）
+CHAT_HISTORY_SUMMARY_MAX_TOKENS = 500
+CHAT_HISTORY_SUMMARY_SENTENCE_CHARS = 100
+CHAT_HISTORY_SUMMARY_HEADER = "これまでの会話の要約:"
+
+
+# ==========================================
+# 質問文の書き換え系
+# ==========================================
+# 会話履歴を踏まえた質問文の書き換えに使う、直近の会話履歴のメッセージ数
+QUERY_CONDENSE_HISTORY_MESSAGES = 4
+# 書き換え結果をプロセス内で保持する件数
+QUERY_CONDENSE_CACHE_SIZE = 256
+# これらの語を含む質問は、前の会話を指している可能性があるため書き換える
+QUERY_CONDENSE_ANAPHORA_TERMS = [
+    "それ", "その", "これ", "この", "あれ", "あの", "そこ", "ここ", "上記", "前述", "先ほど", "さっき",
+    "同じ", "他に", "ほかに", "他の", "ほかの", "もっと", "詳しく", "続き"
+]
+# この文字数未満の短い質問（「なぜ？」など）は、単独では意味が通らないとみなして書き換える
+QUERY_CONDENSE_MIN_STANDALONE_LENGTH = 8
+# Falseの場合、LLMを呼び出さずに直前の質問と連結するだけの簡易な書き換えを行う
+QUERY_CONDENSE_USE_LLM = True
+
+
+# ==========================================
+# 回答キャッシュ系
+# ==========================================
+# 同じ質問への回答を、セッションをまたいでプロセス内で使い回すかどうか
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_MAX_ENTRIES = 512
+# 回答を使い回す最大秒数
+ANSWER_CACHE_TTL_SECONDS = 60 * 60
+# 表記が異なる質問でも、質問文の埋め込みベクトルのコサイン類似度がこの値以上であれば同じ質問とみなす
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+# 破棄済みとして記録しておく世代数の、保持する世代数に対する倍率（古い世代を開いたままのセッションが、新しい世代の回答を押し出さないようにするため）
+ANSWER_CACHE_RETIRED_GENERATIONS_FACTOR = 4
+
+
+# ==========================================
+# 社員名簿検索系
+# ==========================================
+ROSTER_FILE_PATH = "./data/社員について/社員名簿.csv"
+# 値ごとの行番号を事前に作成しておく列
+ROSTER_INDEXED_COLUMNS = ["部署", "役職", "従業員区分", "性別"]
+# 「, 」区切りで複数の値を持つ列（値ごとの行番号を事前に作成しておく）
+ROSTER_MULTI_VALUE_COLUMNS = ["スキルセット", "保有資格"]
+ROSTER_DATE_COLUMNS = ["生年月日", "入社日", "卒業年月日"]
+# 一覧表示する列
+ROSTER_DISPLAY_COLUMNS = ["社員ID", "氏名（フルネーム）", "部署", "役職", "従業員区分", "メールアドレス"]
+# 従業員の一覧を求める質問と判定するための語
+# 「社員」「スタッフ」などは「正社員」（従業員区分）・「スタッフ」（役職）の一部や、制度についての質問にも含まれるため判定に使わない
+ROSTER_LIST_KEYWORDS = ["一覧", "名簿", "リスト", "全員", "誰", "だれ"]
+# 件数のみを求める質問と判定するための語
+ROSTER_COUNT_KEYWORDS = ["人数", "何人", "何名", "社員数", "従業員数"]
+# 「部署ごと」「役職別」などの集計の質問で、集計する列とその呼び方
+ROSTER_GROUP_ALIASES = {
+    "部署": ["部署", "部門"],
+    "役職": ["役職"],
+    "従業員区分": ["従業員区分", "雇用形態", "雇用区分"],
+    "性別": ["性別", "男女"]
+}
+ROSTER_GROUP_SUFFIXES = ["ごと", "別"]
+
+
+# ==========================================
+# 埋め込みモデル系
+# ==========================================
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_CACHE_PATH = "./.chroma/embedding_cache.sqlite3"
+# 他プロセスの書き込み完了を待つ最大秒数
+EMBEDDING_CACHE_TIMEOUT = 30
+# 1回の問い合わせで検索するキーの数（SQLiteのプレースホルダ数の上限対策）
+EMBEDDING_CACHE_QUERY_BATCH_SIZE = 500
+# モデル名からトークナイザーを判定できない場合に使うエンコーディング
+EMBEDDING_DEFAULT_ENCODING = "cl100k_base"
+# 1リクエストあたりの合計トークン数・件数の上限
+EMBEDDING_BATCH_MAX_TOKENS = 8000
+EMBEDDING_BATCH_MAX_SIZE = 256
+# 同時に送信するリクエスト数の最大値（レート制限に達すると自動で減らす）
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_MAX_RETRIES = 6
+# レート制限時の再試行待機秒数（基準値と最大値）
+EMBEDDING_BACKOFF_BASE = 1
+EMBEDDING_BACKOFF_MAX = 60
 
 
 # ==========================================
@@ -121,6 +369,7 @@ NO_DOC_MATCH_ANSWER = "該当資料なし"
 # ==========================================
 COMMON_ERROR_MESSAGE = "このエラーが繰り返し発生する場合は、管理者にお問い合わせください。"
 INITIALIZE_ERROR_MESSAGE = "初期化処理に失敗しました。"
+INDEX_NOT_FOUND_MESSAGE = "検索用のインデックスが作成されていません。「python -m cli build-index」を実行してインデックスを作成してください。"
 NO_DOC_MATCH_MESSAGE = """
     入力内容と関連する社内文書が見つかりませんでした。\n
     入力内容を変更してください。
@@ -0,0 +1,172 @@
+"""
+このファイルは、検索で取得したチャンクをLLMに渡す前に、重複を除いてトークン数の上限内に詰め直す処理が記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from langchain_core.documents import Document
+import constants as ct
+from conversation_memory import count_tokens, get_encoding
+import tracing
+
+
+############################################################
+# 関数定義
+############################################################
+
+def parse_chunk_position(doc):
+    """
+    チャンクIDから、データソースごとのIDの接頭辞と、データソース内での通し番号を取得
+
+    Args:
+        doc: チャンクのドキュメント
+
+    Returns:
+        接頭辞と通し番号の組（チャンクIDがない場合はNone）
+    """
+    chunk_id = doc.metadata.get("chunk_id")
+    if not chunk_id:
+        return None
+    prefix, _, ordinal = chunk_id.rpartition("-")
+    if not prefix or not ordinal.isdigit():
+        return None
+    return prefix, int(ordinal)
+
+
+def remove_overlap(previous_text, next_text, heading_chars=0, overlap_chars=0):
+    """
+    前のチャンクの末尾と重複する、次のチャンクの先頭部分を取り除く
+    分割時に引き継いだ部分の文字数が分かる場合は、先頭に引き継いだ見出しを除いてから、前のチャンクの末尾と照合する
+    （見出しは前のチャンクの末尾ではなく先頭にあるため、そのままでは重複として照合できない）
+
+    Args:
+        previous_text: 前のチャンクのテキスト
+        next_text: 次のチャンクのテキスト
+        heading_chars: 次のチャンクの先頭に引き継いだ見出しの文字数（直後の改行を含む）
+        overlap_chars: 次のチャンクの先頭に引き継いだ見出しと文の合計文字数（直後の改行を含む）
+
+    Returns:
+        重複部分を取り除いた次のチャンクのテキスト
+    """
+    if overlap_chars:
+        carried_tail = next_text[heading_chars:overlap_chars].rstrip("\n")
+        if previous_text.endswith(carried_tail):
+            return next_text[overlap_chars:]
+
+    max_chars = min(len(previous_text), len(next_text), ct.CONTEXT_MAX_OVERLAP_CHARS)
+    for size in range(max_chars, ct.CONTEXT_MIN_OVERLAP_CHARS - 1, -1):
+        if previous_text.endswith(next_text[:size]):
+            return next_text[size:].lstrip("\n")
+    return next_text
+
+
+def join_run(run):
+    """
+    通し番号が連続するチャンクを1つのドキュメントに結合
+
+    Args:
+        run: 通し番号・順位・ドキュメントの組のリスト（通し番号順）
+
+    Returns:
+        最も高い順位と、結合後のドキュメントの組
+    """
+    best_rank = min(rank for _, rank, _ in run)
+    if len(run) == 1:
+        return best_rank, run[0][2]
+
+    text = run[0][2].page_content
+    for _, _, doc in run[1:]:
+        text = "\n".join([text, remove_overlap(
+            text, doc.page_content,
+            doc.metadata.get("overlap_heading_chars", 0), doc.metadata.get("overlap_chars", 0)
+        )])
+    metadata = dict(run[0][2].metadata)
+    metadata["merged_chunk_ids"] = [doc.metadata["chunk_id"] for _, _, doc in run]
+    return best_rank, Document(page_content=text, metadata=metadata)
+
+
+def merge_adjacent_chunks(docs):
+    """
+    同じデータソース・ページで通し番号が連続するチャンクを、重複部分を除いて1つに結合
+
+    Args:
+        docs: 関連度の高い順に並んだチャンクのリスト
+
+    Returns:
+        結合後のドキュメントのリスト（結合に含まれるチャンクのうち、最も関連度の高いものの順位順）
+    """
+    # 通し番号が取得できるチャンクを、データソース・ページごとにまとめる
+    groups = {}
+    for rank, doc in enumerate(docs):
+        position = parse_chunk_position(doc)
+        if position is None:
+            groups[("rank", rank)] = [(0, rank, doc)]
+            continue
+        prefix, ordinal = position
+        groups.setdefault((prefix, doc.metadata.get("page")), []).append((ordinal, rank, doc))
+
+    merged = []
+    for members in groups.values():
+        members.sort(key=lambda member: member[0])
+        # 通し番号が連続する範囲ごとに結合する
+        run = [members[0]]
+        for member in members[1:]:
+            if member[0] == run[-1][0] + 1:
+                run.append(member)
+            else:
+                merged.append(join_run(run))
+                run = [member]
+        merged.append(join_run(run))
+
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged]
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    テキストを指定のトークン数までに切り詰める
+
+    Args:
+        text: 対象のテキスト
+        max_tokens: 最大トークン数
+
+    Returns:
+        切り詰めたテキスト
+    """
+    encoding = get_encoding()
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def pack_documents(docs, max_tokens=ct.CONTEXT_MAX_TOKENS):
+    """
+    検索で取得したチャンクの重複を除き、関連度の高い順にトークン数の上限まで詰める
+
+    Args:
+        docs: 関連度の高い順に並んだチャンクのリスト
+        max_tokens: 合計トークン数の上限
+
+    Returns:
+        LLMに渡すドキュメントのリスト（関連度の高い順）
+    """
+    packed = []
+    remaining = max_tokens
+    for doc in merge_adjacent_chunks(docs):
+        tokens = count_tokens(doc.page_content)
+        if tokens <= remaining:
+            packed.append(doc)
+            remaining -= tokens
+            continue
+        # 上限に収まらない巨大なチャンク（長いCSVの行など）は、残りのトークン数まで切り詰めて渡す
+        # 最も関連度の高いチャンクは、切り詰めてでも必ず渡す
+        if remaining >= ct.CONTEXT_MIN_TRUNCATED_TOKENS or not packed:
+            packed.append(Document(
+                page_content=truncate_to_tokens(doc.page_content, remaining),
+                metadata={**doc.metadata, "truncated": True}
+            ))
+            remaining = 0
+            break
+        # 切り詰めると短くなりすぎる場合は渡さず、後続の小さいチャンクが収まるかを確認
+
+    tracing.add_tokens("context", max_tokens - remaining)
+    return packed
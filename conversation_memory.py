@@ -0,0 +1,183 @@
+"""
+このファイルは、LLMとのやりとり用の会話履歴を、件数とトークン数の上限内に保つための処理が記述されたファイルです。
+直近の会話は原文のまま保持し、上限を超えた古い会話は発言の冒頭を抜き出した要約にまとめます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+from collections import deque
+from functools import lru_cache
+from typing import NamedTuple
+import tiktoken
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """
+    トークン数の計測に使うtiktokenのエンコーディングを取得（プロセス内で1度だけ読み込む）
+
+    Returns:
+        エンコーディング
+    """
+    try:
+        return tiktoken.encoding_for_model(ct.MODEL)
+    except KeyError:
+        return tiktoken.get_encoding(ct.EMBEDDING_DEFAULT_ENCODING)
+
+
+def count_tokens(text):
+    """
+    テキストのトークン数を計測
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        トークン数
+    """
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def extract_lead_sentence(text, max_chars=ct.CHAT_HISTORY_SUMMARY_SENTENCE_CHARS):
+    """
+    発言の最初の1文を抜き出す（長い場合は指定の文字数で切り詰める）
+
+    Args:
+        text: 発言
+        max_chars: 最大文字数
+
+    Returns:
+        最初の1文
+    """
+    text = re.sub(r"[#*`|>]+", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    sentence = re.split(r"(?<=[。！？!?])", text, maxsplit=1)[0].strip()
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars] + "…"
+    return sentence
+
+
+############################################################
+# クラス定義
+############################################################
+
+class ConversationTurn(NamedTuple):
+    """
+    1往復分の会話
+    - 「user_message」: ユーザーの発言
+    - 「ai_message」: 回答
+    - 「tokens」: 2つの発言の合計トークン数
+    """
+    user_message: HumanMessage
+    ai_message: AIMessage
+    tokens: int
+
+
+class ConversationMemory:
+    """
+    LLMとのやりとり用の会話履歴
+    直近の会話は件数・トークン数の上限内で原文のまま保持し、あふれた古い会話は要約の1メッセージにまとめる
+    LLMに渡すメッセージのリストは会話の追加時に更新しておき、呼び出しのたびに作り直さない
+    """
+
+    def __init__(
+        self,
+        max_turns=ct.CHAT_HISTORY_MAX_TURNS,
+        max_tokens=ct.CHAT_HISTORY_MAX_TOKENS,
+        summary_max_tokens=ct.CHAT_HISTORY_SUMMARY_MAX_TOKENS
+    ):
+        """
+        Args:
+            max_turns: 原文のまま保持する会話数
+            max_tokens: 原文のまま保持する会話の合計トークン数の上限
+            summary_max_tokens: 要約のトークン数の上限
+        """
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.turns = deque()
+        self.turn_tokens = 0
+        # 要約の各行と、そのトークン数
+        self.summary_lines = deque()
+        self.summary_tokens = 0
+        self.summary_message = None
+        self._messages = []
+
+    def __len__(self):
+        """
+        保持している会話数（要約にまとめた会話は含まない）
+        """
+        return len(self.turns)
+
+    def __bool__(self):
+        return bool(self.turns) or self.summary_message is not None
+
+    @property
+    def messages(self):
+        """
+        LLMに渡すメッセージのリスト（要約があれば先頭に要約、続いて直近の会話）
+        """
+        return list(self._messages)
+
+    def add(self, user_text, answer):
+        """
+        1往復分の会話を追加し、上限を超えた古い会話を要約にまとめる
+
+        Args:
+            user_text: ユーザーの発言
+            answer: 回答
+        """
+        turn = ConversationTurn(
+            user_message=HumanMessage(content=user_text),
+            ai_message=AIMessage(content=answer),
+            tokens=count_tokens(user_text) + count_tokens(answer)
+        )
+        self.turns.append(turn)
+        self.turn_tokens += turn.tokens
+        self._messages.extend([turn.user_message, turn.ai_message])
+
+        # 直近の1往復は、トークン数の上限を超えていても原文のまま残す
+        rolled = False
+        while len(self.turns) > 1 and (len(self.turns) > self.max_turns or self.turn_tokens > self.max_tokens):
+            self._roll_oldest_turn()
+            rolled = True
+        if rolled:
+            self._rebuild_summary_message()
+
+    def _roll_oldest_turn(self):
+        """
+        最も古い会話を原文の保持対象から外し、要約の1行として追加
+        """
+        turn = self.turns.popleft()
+        self.turn_tokens -= turn.tokens
+        line = (
+            f"- 質問: {extract_lead_sentence(turn.user_message.content)}"
+            f" / 回答: {extract_lead_sentence(turn.ai_message.content)}"
+        )
+        line_tokens = count_tokens(line)
+        self.summary_lines.append((line, line_tokens))
+        self.summary_tokens += line_tokens
+        # 要約も上限を超えた場合は、古い行から捨てる
+        while len(self.summary_lines) > 1 and self.summary_tokens > self.summary_max_tokens:
+            _, removed_tokens = self.summary_lines.popleft()
+            self.summary_tokens -= removed_tokens
+
+    def _rebuild_summary_message(self):
+        """
+        要約のメッセージと、LLMに渡すメッセージのリストを更新（古い会話を要約にまとめた場合のみ）
+        """
+        self.summary_message = SystemMessage(
+            content="\n".join([ct.CHAT_HISTORY_SUMMARY_HEADER] + [line for line, _ in self.summary_lines])
+        )
+        messages = [self.summary_message]
+        for turn in self.turns:
+            messages.extend([turn.user_message, turn.ai_message])
+        self._messages = messages
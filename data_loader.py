@@ -0,0 +1,223 @@
+"""
+このファイルは、RAGの参照先となるデータソースの読み込み・チャンク分割処理が記述されたファイルです。
+画面表示（Streamlit）に依存しないため、インデックス作成処理からも利用できます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import hashlib
+import itertools
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from langchain_community.document_loaders import WebBaseLoader
+from japanese_splitter import JapaneseTextSplitter
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def load_web_sources():
+    """
+    指定のWebページ内のデータ読み込み
+
+    Returns:
+        読み込んだWebページのデータソース
+    """
+    web_docs_all = []
+    # 読み込み対象のWebページ一覧に対して処理
+    for web_url in ct.WEB_URL_LOAD_TARGETS:
+        # 指定のWebページを読み込み
+        loader = WebBaseLoader(web_url)
+        web_docs = loader.load()
+        # for文の外のリストに読み込んだデータソースを追加
+        web_docs_all.extend(web_docs)
+
+    return web_docs_all
+
+
+def list_source_files(path=None):
+    """
+    読み込み対象となるファイルパスの一覧を取得
+
+    Args:
+        path: 探索を開始するフォルダのパス（Noneの場合は設定値。ベンチマークなどで設定値を差し替えられるよう、呼び出し時に参照する）
+
+    Returns:
+        読み込み対象のファイルパスのリスト（毎回同じ順序になるよう並び替え済み）
+    """
+    path = path or ct.RAG_TOP_FOLDER_PATH
+    file_paths = []
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1] in ct.SUPPORTED_EXTENSIONS:
+                file_paths.append(os.path.join(dir_path, file_name))
+
+    return sorted(file_paths)
+
+
+def iter_loaded_files(file_paths, max_workers=None):
+    """
+    複数ファイルを複数プロセスで並列に読み込み、渡した順序どおりに結果を順次返す
+
+    Args:
+        file_paths: 読み込み対象のファイルパスのリスト
+        max_workers: 読み込みに使うプロセス数（Noneの場合は設定値、設定値もNoneの場合はCPUコア数）
+
+    Returns:
+        ファイルパスと読み込んだドキュメントのリストの組を順次返すジェネレーター
+    """
+    workers = max_workers or ct.INGEST_MAX_WORKERS or os.cpu_count() or 1
+
+    # 並列化の効果がない場合は、プロセス起動のコストを避けて同じプロセス内で読み込む
+    if workers <= 1 or len(file_paths) <= 1:
+        for path in file_paths:
+            yield path, load_file(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        path_iter = iter(file_paths)
+        # 読み込み結果がメモリに溜まり過ぎないよう、先行して投入するファイル数に上限を設ける
+        pending = deque(
+            (path, executor.submit(load_file, path))
+            for path in itertools.islice(path_iter, workers * ct.INGEST_PREFETCH_PER_WORKER)
+        )
+        while pending:
+            # 先頭から順に結果を待つことで、完了順ではなく投入順に結果を返す
+            path, future = pending.popleft()
+            docs = future.result()
+            next_path = next(path_iter, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(load_file, next_path)))
+            yield path, docs
+
+
+def load_file(path):
+    """
+    1ファイル分のデータ読み込み
+
+    Args:
+        path: ファイルパス
+
+    Returns:
+        読み込んだドキュメントのリスト（想定外のファイル形式の場合は空リスト）
+    """
+    # ファイルの拡張子を取得
+    file_extension = os.path.splitext(path)[1]
+    # ファイル名（拡張子を含む）を取得
+    file_name = os.path.basename(path)
+
+    # 想定していたファイル形式の場合のみ読み込む
+    if file_extension not in ct.SUPPORTED_EXTENSIONS:
+        return []
+
+    loader = ct.SUPPORTED_EXTENSIONS[file_extension](path)
+    docs = loader.load()
+    # 社員名簿.csvの場合は各行のテキスト先頭に「社員一覧:」＋部門名（あれば）を付与
+    if file_name == "社員名簿.csv":
+        for doc in docs:
+            # 部門名を抽出（"部門"や"部署"などのカラムが含まれていれば）
+            dept = ""
+            # メタデータに部門情報があれば利用
+            if "部門" in doc.metadata:
+                dept = doc.metadata["部門"]
+            elif "部署" in doc.metadata:
+                dept = doc.metadata["部署"]
+            # テキストにも部門名が含まれていれば先頭に付与
+            if dept:
+                doc.page_content = f"社員一覧: {dept}: {doc.page_content}"
+            else:
+                doc.page_content = f"社員一覧: {doc.page_content}"
+    # 顧客について配下のファイルは「顧客一覧:」を付与
+    elif "顧客について" in path:
+        for doc in docs:
+            doc.page_content = f"顧客一覧: {doc.page_content}"
+
+    return docs
+
+
+def compute_file_hash(path):
+    """
+    ファイル内容のハッシュ値を計算
+
+    Args:
+        path: ファイルパス
+
+    Returns:
+        SHA-256のハッシュ値（16進数文字列）
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        # 大きなファイルでもメモリを使い過ぎないよう、一定サイズずつ読み込む
+        for block in iter(lambda: f.read(ct.HASH_READ_BLOCK_SIZE), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def compute_text_hash(text):
+    """
+    文字列のハッシュ値を計算
+
+    Args:
+        text: 対象の文字列
+
+    Returns:
+        SHA-256のハッシュ値（16進数文字列）
+    """
+    return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+
+def create_splitted_documents(docs_all):
+    """
+    インデックス作成用に、ドキュメントの文字列調整とチャンク分割を行う
+
+    Args:
+        docs_all: 1つのデータソースから読み込んだドキュメントのリスト
+
+    Returns:
+        チャンク分割済みのドキュメントのリスト
+    """
+    # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
+    for doc in docs_all:
+        doc.page_content = adjust_string(doc.page_content)
+        for key in doc.metadata:
+            doc.metadata[key] = adjust_string(doc.metadata[key])
+
+    # チャンク分割用のオブジェクトを作成（文・見出し・ページの区切りを考慮し、トークン数単位で分割）
+    text_splitter = JapaneseTextSplitter(
+        chunk_size=ct.CHUNK_SIZE,
+        chunk_overlap=ct.CHUNK_OVERLAP
+    )
+
+    # チャンク分割を実施
+    return text_splitter.split_documents(docs_all)
+
+
+def adjust_string(s):
+    """
+    Windows環境でRAGが正常動作するよう調整
+
+    Args:
+        s: 調整を行う文字列
+
+    Returns:
+        調整を行った文字列
+    """
+    # 調整対象は文字列のみ
+    if type(s) is not str:
+        return s
+
+    # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
+    if sys.platform.startswith("win"):
+        s = unicodedata.normalize('NFC', s)
+        s = s.encode("cp932", "ignore").decode("cp932")
+        return s
+
+    # OSがWindows以外の場合はそのまま返す
+    return s
@@ -0,0 +1,189 @@
+"""
+このファイルは、インデックスに格納したチャンクの本文とメタデータを、全セッション・全プロセスで共有するための文書ストアが記述されたファイルです。
+本文とメタデータはUTF-8の1つのバイト列と、その区切り位置の配列としてインデックスのフォルダに保存し、読み込み専用でメモリマップします。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import io
+import os
+import json
+import mmap
+import numpy as np
+from langchain_core.documents import Document
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def encode_metadata(metadata):
+    """
+    メタデータを保存用のバイト列に変換
+
+    Args:
+        metadata: メタデータの辞書
+
+    Returns:
+        UTF-8のJSONのバイト列
+    """
+    return json.dumps(metadata, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def write_document_store(index_path, documents):
+    """
+    チャンクを文書ストアの形式でインデックスのフォルダに書き込む
+    （チャンクを1件ずつ書き込むため、全チャンクをメモリ上に保持しない）
+
+    Args:
+        index_path: インデックスのフォルダパス
+        documents: チャンクのドキュメントのイテラブル
+    """
+    # 区切り位置は「本文の開始, メタデータの開始, 次の本文の開始, ...」の順に並べ、末尾に全体の長さを置く
+    offsets = [0]
+    with open(os.path.join(index_path, ct.DOC_STORE_BLOB_FILE), "wb") as f:
+        for doc in documents:
+            for data in (doc.page_content.encode("utf-8"), encode_metadata(doc.metadata)):
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+    np.save(os.path.join(index_path, ct.DOC_STORE_OFFSETS_FILE), np.asarray(offsets, dtype=np.uint64))
+
+
+def open_document_store(index_path):
+    """
+    インデックスのフォルダに保存済みの文書ストアを、読み込み専用でメモリマップして開く
+
+    Args:
+        index_path: インデックスのフォルダパス
+
+    Returns:
+        文書ストア（保存されていない場合はNone）
+    """
+    blob_path = os.path.join(index_path, ct.DOC_STORE_BLOB_FILE)
+    offsets_path = os.path.join(index_path, ct.DOC_STORE_OFFSETS_FILE)
+    if not os.path.isfile(blob_path) or not os.path.isfile(offsets_path):
+        return None
+
+    offsets = np.load(offsets_path, mmap_mode="r")
+    # 長さ0のファイルはメモリマップできないため、チャンクがない場合は空のバイト列で代替
+    if os.path.getsize(blob_path) == 0:
+        return DocumentStore(b"", offsets)
+    with open(blob_path, "rb") as f:
+        # ファイルを閉じてもメモリマップは有効なまま残る
+        blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return DocumentStore(blob, offsets)
+
+
+############################################################
+# クラス定義
+############################################################
+
+class DocumentStore:
+    """
+    チャンクの本文とメタデータを、1つのバイト列と区切り位置の配列で保持する読み込み専用の文書ストア
+    チャンク番号を指定して、必要な部分だけをバイト列から取り出す
+    同じファイルをメモリマップした場合、内容はOSのページキャッシュ上で全プロセスに共有される
+    """
+
+    def __init__(self, blob, offsets):
+        """
+        Args:
+            blob: 本文とメタデータを連結したバイト列（メモリマップまたはbytes）
+            offsets: 本文・メタデータの区切り位置の配列
+        """
+        self._blob = blob
+        self._offsets = offsets
+
+    @classmethod
+    def from_documents(cls, documents):
+        """
+        ファイルに保存せず、メモリ上に文書ストアを作成
+
+        Args:
+            documents: チャンクのドキュメントのイテラブル
+
+        Returns:
+            文書ストア
+        """
+        buffer = io.BytesIO()
+        offsets = [0]
+        for doc in documents:
+            for data in (doc.page_content.encode("utf-8"), encode_metadata(doc.metadata)):
+                buffer.write(data)
+                offsets.append(offsets[-1] + len(data))
+        return cls(buffer.getvalue(), np.asarray(offsets, dtype=np.uint64))
+
+    def __len__(self):
+        return (len(self._offsets) - 1) // 2
+
+    def __getitem__(self, doc_id):
+        """
+        チャンク番号を指定して、チャンクをドキュメントとして取得
+        """
+        return Document(page_content=self.text(doc_id), metadata=self.metadata(doc_id))
+
+    def __iter__(self):
+        for doc_id in range(len(self)):
+            yield self[doc_id]
+
+    def _span(self, index):
+        """
+        区切り位置の配列から、index番目の部分の開始・終了位置を取得
+        """
+        return int(self._offsets[index]), int(self._offsets[index + 1])
+
+    def text(self, doc_id):
+        """
+        チャンクの本文を取得
+
+        Args:
+            doc_id: チャンク番号
+
+        Returns:
+            本文
+        """
+        start, end = self._span(doc_id * 2)
+        # バイト列を複製せず、該当部分から直接デコードする
+        with memoryview(self._blob) as view:
+            return str(view[start:end], "utf-8")
+
+    def metadata(self, doc_id):
+        """
+        チャンクのメタデータを取得
+
+        Args:
+            doc_id: チャンク番号
+
+        Returns:
+            メタデータの辞書
+        """
+        start, end = self._span(doc_id * 2 + 1)
+        with memoryview(self._blob) as view:
+            return json.loads(str(view[start:end], "utf-8"))
+
+    def contains(self, doc_id, term):
+        """
+        チャンクの本文に検索語が含まれるかを、本文をデコードせずに判定
+
+        Args:
+            doc_id: チャンク番号
+            term: 検索語
+
+        Returns:
+            含まれていればTrue
+        """
+        start, end = self._span(doc_id * 2)
+        # UTF-8は文字の途中から一致することがないため、バイト列のまま検索できる
+        return self._blob.find(term.encode("utf-8"), start, end) != -1
+
+    def iter_texts(self):
+        """
+        全チャンクの本文を、チャンク番号の順に順次返す
+
+        Returns:
+            本文を順次返すジェネレーター
+        """
+        for doc_id in range(len(self)):
+            yield self.text(doc_id)
@@ -0,0 +1,197 @@
+"""
+このファイルは、チャンクの埋め込みベクトルをローカルにキャッシュし、同じテキストの埋め込みを再計算しないための処理が記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+from langchain_core.embeddings import Embeddings
+import constants as ct
+from embedding_pipeline import BatchedEmbeddings
+
+
+############################################################
+# 関数定義
+############################################################
+
+def create_embeddings(http_client=None):
+    """
+    アプリ共通で利用する、キャッシュ付きの埋め込みモデルを作成
+
+    Args:
+        http_client: 検索クエリなどの埋め込みに使う、接続を使い回すHTTPクライアント（Noneの場合は埋め込みモデルごとに作成）
+
+    Returns:
+        キャッシュ付きの埋め込みモデル
+    """
+    return CachedEmbeddings(BatchedEmbeddings(model=ct.EMBEDDING_MODEL, http_client=http_client), ct.EMBEDDING_MODEL)
+
+
+def normalize_text(text):
+    """
+    キャッシュのキー作成用に、表記ゆれの影響を受けないようテキストを正規化
+
+    Args:
+        text: 正規化するテキスト
+
+    Returns:
+        正規化したテキスト
+    """
+    text = unicodedata.normalize("NFC", text)
+    # 連続する空白・改行は1つの空白にまとめる
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def create_cache_key(model_name, text):
+    """
+    キャッシュのキー（モデル名と正規化テキストのハッシュ値）を作成
+
+    Args:
+        model_name: 埋め込みモデル名
+        text: 埋め込み対象のテキスト
+
+    Returns:
+        キャッシュのキー
+    """
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf8")).hexdigest()
+
+
+############################################################
+# クラス定義
+############################################################
+
+class CachedEmbeddings(Embeddings):
+    """
+    埋め込みベクトルをSQLite（float32のバイナリ）にキャッシュする埋め込みモデル
+    キャッシュにないテキストのみ、元の埋め込みモデルに問い合わせる
+    """
+
+    def __init__(self, base_embeddings, model_name, cache_path=ct.EMBEDDING_CACHE_PATH):
+        """
+        Args:
+            base_embeddings: キャッシュにない場合に利用する埋め込みモデル
+            model_name: 埋め込みモデル名（キャッシュのキーに含める）
+            cache_path: キャッシュファイルのパス
+        """
+        self.base_embeddings = base_embeddings
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Streamlitは複数スレッドから呼び出すため、接続は共有しつつロックで排他制御
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False, timeout=ct.EMBEDDING_CACHE_TIMEOUT)
+        # 複数プロセスから同時に読み書きしても待たされにくいよう、WALモードを利用
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    @property
+    def stats(self):
+        """
+        キャッシュのヒット数・ミス数
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def embed_documents(self, texts):
+        """
+        複数テキストの埋め込み（キャッシュにないテキストのみ元の埋め込みモデルに問い合わせる）
+
+        Args:
+            texts: 埋め込み対象のテキストのリスト
+
+        Returns:
+            埋め込みベクトルのリスト
+        """
+        keys = [create_cache_key(self.model_name, text) for text in texts]
+        vectors = self._get_many(keys)
+
+        # キャッシュにないテキストを、同じテキストは1回だけ問い合わせるようまとめる
+        miss_texts = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in miss_texts:
+                miss_texts[key] = text
+
+        with self._lock:
+            self.hits += len(keys) - sum(1 for key in keys if key in miss_texts)
+            self.misses += sum(1 for key in keys if key in miss_texts)
+
+        if miss_texts:
+            new_vectors = self.base_embeddings.embed_documents(list(miss_texts.values()))
+            new_entries = self._put_many(dict(zip(miss_texts.keys(), new_vectors)))
+            vectors.update(new_entries)
+
+        return [list(vectors[key]) for key in keys]
+
+    def embed_query(self, text):
+        """
+        検索クエリの埋め込み
+
+        Args:
+            text: 検索クエリ
+
+        Returns:
+            埋め込みベクトル
+        """
+        key = create_cache_key(self.model_name, text)
+        vectors = self._get_many([key])
+        if key in vectors:
+            with self._lock:
+                self.hits += 1
+            return list(vectors[key])
+
+        with self._lock:
+            self.misses += 1
+        vector = self.base_embeddings.embed_query(text)
+        return self._put_many({key: vector})[key]
+
+    def _get_many(self, keys):
+        """
+        キャッシュ済みの埋め込みベクトルを取得
+
+        Args:
+            keys: キャッシュのキーのリスト
+
+        Returns:
+            キーと埋め込みベクトルの辞書（キャッシュにあったもののみ）
+        """
+        vectors = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLiteのプレースホルダ数の上限を超えないよう、分割して問い合わせる
+            for i in range(0, len(unique_keys), ct.EMBEDDING_CACHE_QUERY_BATCH_SIZE):
+                batch = unique_keys[i:i + ct.EMBEDDING_CACHE_QUERY_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    vectors[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return vectors
+
+    def _put_many(self, entries):
+        """
+        埋め込みベクトルをキャッシュに保存
+
+        Args:
+            entries: キーと埋め込みベクトルの辞書
+
+        Returns:
+            キーとfloat32に変換した埋め込みベクトルの辞書（キャッシュから取得した場合と同じ値になる）
+        """
+        arrays = {key: np.asarray(vector, dtype=np.float32) for key, vector in entries.items()}
+        rows = [(key, array.tobytes()) for key, array in arrays.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+        return {key: array.tolist() for key, array in arrays.items()}
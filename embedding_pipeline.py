@@ -0,0 +1,356 @@
+"""
+このファイルは、大量のチャンクをトークン数単位のバッチにまとめ、並列かつレート制限に合わせて埋め込むための処理が記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import time
+import random
+import asyncio
+import threading
+import tiktoken
+import openai
+from langchain_core.embeddings import Embeddings
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def create_batches(texts, encoding, max_batch_tokens, max_batch_size):
+    """
+    テキストを、合計トークン数と件数の上限を超えないバッチに分割
+
+    Args:
+        texts: 埋め込み対象のテキストのリスト
+        encoding: トークン数の計測に使うtiktokenのエンコーディング
+        max_batch_tokens: 1バッチあたりの合計トークン数の上限
+        max_batch_size: 1バッチあたりの件数の上限
+
+    Returns:
+        バッチのリスト（各バッチは元のリストにおける位置のリスト）
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = len(encoding.encode(text, disallowed_special=()))
+        # 上限を超える場合は、現在のバッチを確定して新しいバッチを開始
+        if batch and (batch_tokens + tokens > max_batch_tokens or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def get_retry_after(error):
+    """
+    レート制限エラーのレスポンスヘッダーから、再試行までの待機秒数を取得
+
+    Args:
+        error: レート制限エラー
+
+    Returns:
+        待機秒数（ヘッダーがない場合はNone）
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff_seconds(attempt):
+    """
+    待機秒数の指定がない場合の、再試行までの待機秒数を取得
+    指数関数的に待機時間を延ばし、同時に再試行が集中しないよう揺らぎを加える
+
+    Args:
+        attempt: 何回目の再試行か（0始まり）
+
+    Returns:
+        待機秒数
+    """
+    return min(ct.EMBEDDING_BACKOFF_MAX, ct.EMBEDDING_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def run_coroutine(coroutine):
+    """
+    同期処理の中から非同期処理を実行（イベントループ実行中のスレッドからでも呼び出せるようにする）
+
+    Args:
+        coroutine: 実行する非同期処理
+
+    Returns:
+        非同期処理の戻り値
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # 実行中のイベントループはブロックできないため、別スレッドで新しいイベントループを使う
+    result = {}
+    def target():
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            result["error"] = e
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+############################################################
+# クラス定義
+############################################################
+
+class AdaptiveConcurrencyLimiter:
+    """
+    同時実行数の上限を、レート制限（429）の発生状況に応じて増減させるリミッター
+    429が返るたびに上限を半分にし、成功が続けば1つずつ元の上限まで戻す
+    """
+
+    def __init__(self, max_concurrency):
+        """
+        Args:
+            max_concurrency: 同時実行数の最大値
+        """
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self.successes = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """
+        実行枠が空くまで待機して確保
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self, rate_limited=False):
+        """
+        実行枠を解放し、結果に応じて同時実行数の上限を調整
+
+        Args:
+            rate_limited: レート制限に達したかどうか
+        """
+        async with self._condition:
+            self.active -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.limit < self.max_concurrency and self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+            self._condition.notify_all()
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    OpenAI互換の埋め込みAPIに、トークン数単位のバッチを並列で送信する埋め込みモデル
+    1バッチに収まる少量のテキスト（検索クエリなど）は、接続を使い回す同期のクライアントで送信する
+    base_url（または環境変数OPENAI_BASE_URL）を指定すれば、ローカルの疑似サーバーにも接続できる
+    """
+
+    def __init__(
+        self,
+        model=ct.EMBEDDING_MODEL,
+        base_url=None,
+        api_key=None,
+        max_batch_tokens=ct.EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_size=ct.EMBEDDING_BATCH_MAX_SIZE,
+        max_concurrency=ct.EMBEDDING_MAX_CONCURRENCY,
+        max_retries=ct.EMBEDDING_MAX_RETRIES,
+        http_client=None
+    ):
+        """
+        Args:
+            model: 埋め込みモデル名
+            base_url: 埋め込みAPIのURL（Noneの場合はOpenAIの既定値）
+            api_key: APIキー（Noneの場合は環境変数から取得）
+            max_batch_tokens: 1バッチあたりの合計トークン数の上限
+            max_batch_size: 1バッチあたりの件数の上限
+            max_concurrency: 同時に送信するバッチ数の最大値
+            max_retries: レート制限・一時的なエラー時の再試行回数
+            http_client: 同期のクライアントの通信に使うHTTPクライアント（Noneの場合は初回の送信時に作成）
+        """
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.http_client = http_client
+        self._sync_client = None
+        self._sync_client_lock = threading.Lock()
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding(ct.EMBEDDING_DEFAULT_ENCODING)
+
+    def _create_client(self, client_class, **kwargs):
+        """
+        APIクライアントを作成（再試行は本クラスで制御するため、クライアント側の再試行は無効化）
+        """
+        return client_class(base_url=self.base_url, api_key=self.api_key, max_retries=0, **kwargs)
+
+    def _get_sync_client(self):
+        """
+        同期のAPIクライアントを取得（初回のみ作成し、以降は接続を使い回す）
+        """
+        with self._sync_client_lock:
+            if self._sync_client is None:
+                self._sync_client = self._create_client(openai.OpenAI, http_client=self.http_client)
+            return self._sync_client
+
+    def embed_documents(self, texts):
+        """
+        複数テキストの埋め込み
+
+        Args:
+            texts: 埋め込み対象のテキストのリスト
+
+        Returns:
+            埋め込みベクトルのリスト（渡したテキストと同じ順序）
+        """
+        if not texts:
+            return []
+        batches = create_batches(texts, self.encoding, self.max_batch_tokens, self.max_batch_size)
+        # 1バッチに収まる場合は、イベントループや接続を新たに作らず、同期のクライアントで送信する
+        if len(batches) == 1:
+            return self._embed_sync(texts)
+        # 分割済みのバッチを渡し、トークン数の計測をやり直さない
+        return run_coroutine(self._aembed_batches(texts, batches))
+
+    def embed_query(self, text):
+        """
+        検索クエリの埋め込み
+
+        Args:
+            text: 検索クエリ
+
+        Returns:
+            埋め込みベクトル
+        """
+        return self.embed_documents([text])[0]
+
+    def _embed_sync(self, batch_texts):
+        """
+        1バッチ分の埋め込みを、同期のクライアントで送信（レート制限時は待機して再試行）
+
+        Args:
+            batch_texts: バッチ内のテキストのリスト
+
+        Returns:
+            埋め込みベクトルのリスト
+        """
+        client = self._get_sync_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = client.embeddings.create(model=self.model, input=batch_texts, encoding_format="float")
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except openai.RateLimitError as e:
+                error = e
+                wait = get_retry_after(e)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                error = e
+                wait = None
+
+            if attempt == self.max_retries:
+                raise error
+            time.sleep(get_backoff_seconds(attempt) if wait is None else wait)
+
+    async def aembed_documents(self, texts):
+        """
+        複数テキストの埋め込み（バッチを並列で送信）
+
+        Args:
+            texts: 埋め込み対象のテキストのリスト
+
+        Returns:
+            埋め込みベクトルのリスト（渡したテキストと同じ順序）
+        """
+        batches = create_batches(texts, self.encoding, self.max_batch_tokens, self.max_batch_size)
+        return await self._aembed_batches(texts, batches)
+
+    async def _aembed_batches(self, texts, batches):
+        """
+        分割済みのバッチを並列で送信し、埋め込む
+
+        Args:
+            texts: 埋め込み対象のテキストのリスト
+            batches: バッチのリスト（各バッチはテキストのリストにおける位置のリスト）
+
+        Returns:
+            埋め込みベクトルのリスト（渡したテキストと同じ順序）
+        """
+        limiter = AdaptiveConcurrencyLimiter(self.max_concurrency)
+        vectors = [None] * len(texts)
+
+        async with self._create_client(openai.AsyncOpenAI) as client:
+            async def embed_batch(batch):
+                batch_vectors = await self._embed_with_retry(client, limiter, [texts[i] for i in batch])
+                for i, vector in zip(batch, batch_vectors):
+                    vectors[i] = vector
+
+            await asyncio.gather(*(embed_batch(batch) for batch in batches))
+
+        return vectors
+
+    async def aembed_query(self, text):
+        """
+        検索クエリの埋め込み（非同期）
+        """
+        return (await self.aembed_documents([text]))[0]
+
+    async def _embed_with_retry(self, client, limiter, batch_texts):
+        """
+        1バッチ分の埋め込み（レート制限時は待機して再試行）
+
+        Args:
+            client: 非同期のAPIクライアント
+            limiter: 同時実行数を制御するリミッター
+            batch_texts: バッチ内のテキストのリスト
+
+        Returns:
+            埋め込みベクトルのリスト
+        """
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            rate_limited = False
+            try:
+                response = await client.embeddings.create(
+                    model=self.model, input=batch_texts, encoding_format="float"
+                )
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except openai.RateLimitError as e:
+                rate_limited = True
+                error = e
+                wait = get_retry_after(e)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                error = e
+                wait = None
+            finally:
+                await limiter.release(rate_limited=rate_limited)
+
+            if attempt == self.max_retries:
+                raise error
+            await asyncio.sleep(get_backoff_seconds(attempt) if wait is None else wait)
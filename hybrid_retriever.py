@@ -0,0 +1,93 @@
+"""
+このファイルは、キーワード検索（BM25）とベクトル検索の結果を統合するRetrieverが記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from typing import Any, List
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+import constants as ct
+import tracing
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_document_key(doc):
+    """
+    同じチャンクかどうかを判定するためのキーを取得
+
+    Args:
+        doc: ドキュメント
+
+    Returns:
+        チャンクIDがあればチャンクID、なければ参照元と本文の組
+    """
+    if "chunk_id" in doc.metadata:
+        return doc.metadata["chunk_id"]
+    return (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+
+
+def reciprocal_rank_fusion(ranked_lists, rrf_k=ct.RRF_K):
+    """
+    複数の検索結果の順位を、Reciprocal Rank Fusion（順位の逆数の合計）で統合
+
+    Args:
+        ranked_lists: 関連度の高い順に並んだドキュメントのリストのリスト
+        rrf_k: 下位の順位の影響を和らげる定数
+
+    Returns:
+        統合スコアの高い順に並んだドキュメントのリスト
+    """
+    scores = {}
+    documents = {}
+    for ranked_docs in ranked_lists:
+        for rank, doc in enumerate(ranked_docs):
+            key = get_document_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+
+    # 同点の場合は、先に出現した（上位の検索結果に含まれる）ドキュメントを優先
+    ranked_keys = sorted(scores, key=lambda key: -scores[key])
+    return [documents[key] for key in ranked_keys]
+
+
+############################################################
+# クラス定義
+############################################################
+
+class HybridRetriever(BaseRetriever):
+    """
+    ベクトル検索と、N-gram転置インデックスのBM25検索の結果を統合するRetriever
+    意味の近いチャンクに加え、社員IDや会社名などが完全一致するチャンクも上位に取得できる
+    """
+
+    vectorstore: Any
+    """ベクトル検索に使うベクターストア"""
+    keyword_index: Any
+    """BM25検索に使う転置インデックス"""
+    k: int = ct.RETRIEVER_TOP_K
+    """最終的に返すチャンク数"""
+    candidate_k: int = ct.HYBRID_CANDIDATE_K
+    """統合前に、各検索方式から取得する候補数"""
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any) -> List[Document]:
+        """
+        ベクトル検索とBM25検索を行い、順位を統合した上位のチャンクを取得
+
+        Args:
+            query: 検索クエリ
+            run_manager: コールバック管理用のオブジェクト
+
+        Returns:
+            関連度の高い順に並んだドキュメントのリスト
+        """
+        with tracing.stage("vector_search"):
+            vector_docs = self.vectorstore.similarity_search(query, k=self.candidate_k)
+        with tracing.stage("bm25_search"):
+            keyword_docs = [doc for doc, _ in self.keyword_index.bm25_search(query, max_results=self.candidate_k)]
+
+        return reciprocal_rank_fusion([vector_docs, keyword_docs])[:self.k]
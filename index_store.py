@@ -0,0 +1,498 @@
+"""
+このファイルは、RAG用のベクターストアをディスク上に永続化し、全セッション・全プロセスで共有するための処理が記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import time
+import shutil
+import itertools
+from contextlib import contextmanager
+from uuid import uuid4
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+import constants as ct
+import data_loader
+import doc_store
+import keyword_index
+import quantized_store
+from quantized_store import QuantizedVectorStore
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_current_index_path():
+    """
+    現在公開中のインデックス（世代）のフォルダパスを取得
+
+    Returns:
+        公開中のインデックスのフォルダパス（未作成の場合はNone）
+    """
+    current_file = os.path.join(ct.INDEX_ROOT_DIR, ct.INDEX_CURRENT_FILE)
+    if not os.path.isfile(current_file):
+        return None
+
+    with open(current_file, encoding="utf8") as f:
+        generation = f.read().strip()
+    index_path = os.path.join(ct.INDEX_ROOT_DIR, generation)
+
+    # ポインタだけ残ってフォルダが消えている場合は未作成として扱う
+    if not generation or not os.path.isdir(index_path):
+        return None
+    return index_path
+
+
+def open_index(embeddings, index_path=None):
+    """
+    インデックスを読み込み専用で開く
+
+    Args:
+        embeddings: 検索時のクエリ埋め込みに使う埋め込みモデル
+        index_path: 開くインデックスのフォルダパス（Noneの場合は公開中のインデックス）
+
+    Returns:
+        ベクターストア（インデックス未作成の場合はNone）
+    """
+    if index_path is None:
+        index_path = get_current_index_path()
+    if index_path is None:
+        return None
+
+    # 設定を切り替えた直後でも読み込めるよう、インデックスの作成時に使った種類のベクターストアで開く
+    manifest = load_manifest(index_path, check_backend=False)
+    return create_vectorstore(embeddings, index_path, manifest.get("backend", ct.VECTOR_STORE_BACKEND_CHROMA))
+
+
+def create_vectorstore(embeddings, index_path, backend=None):
+    """
+    指定の種類のベクターストアを、インデックスのフォルダに作成または開く
+
+    Args:
+        embeddings: 埋め込みモデル
+        index_path: インデックスのフォルダパス
+        backend: ベクターストアの種類（Noneの場合は設定値）
+
+    Returns:
+        ベクターストア
+    """
+    backend = backend or ct.VECTOR_STORE_BACKEND
+    if backend == ct.VECTOR_STORE_BACKEND_QUANTIZED:
+        return QuantizedVectorStore(embedding_function=embeddings, persist_directory=index_path)
+    if backend != ct.VECTOR_STORE_BACKEND_CHROMA:
+        raise ValueError(f"未対応のベクターストアの種類です: {backend}")
+    return Chroma(
+        collection_name=ct.CHROMA_COLLECTION_NAME,
+        embedding_function=embeddings,
+        persist_directory=index_path
+    )
+
+
+def update_index(embeddings, full_rebuild=False, refresh_web=True, changed_paths=None):
+    """
+    データソースの変更点のみを反映した新しい世代のインデックスを作成し、公開する
+    （公開中のインデックスがない場合は、全データソースを読み込んで新規作成する）
+
+    Args:
+        embeddings: 埋め込みモデル
+        full_rebuild: 公開中のインデックスを使わず、全データソースから作り直すかどうか
+        refresh_web: Webページを読み込み直して変更を確認するかどうか
+        changed_paths: 変更があったファイルのパスのリスト（指定した場合は、これらのファイルのみ変更を確認する。Noneの場合は全ファイル）
+
+    Returns:
+        ベクターストア, 反映件数の集計結果
+    """
+    base_path = None if full_rebuild else get_current_index_path()
+    old_manifest = load_manifest(base_path)
+
+    # マニフェストと比較し、追加・変更・削除されたデータソースを洗い出す
+    new_manifest, changed_sources, removed_sources, web_docs = detect_changes(
+        old_manifest, refresh_web=refresh_web, changed_paths=changed_paths
+    )
+    stats = {
+        "added": sum(1 for source in changed_sources if source not in old_manifest["sources"]),
+        "updated": sum(1 for source in changed_sources if source in old_manifest["sources"]),
+        "removed": len(removed_sources),
+        "unchanged": len(new_manifest["sources"]) - len(changed_sources),
+        "chunks": 0
+    }
+
+    # 変更がなければ、公開中のインデックスをそのまま利用
+    if base_path is not None and not changed_sources and not removed_sources:
+        return open_index(embeddings), stats
+
+    # 公開中の世代は読み込み中のセッションがあるため直接は更新せず、新しい世代に変更を反映
+    # マニフェストのない古い形式のインデックスは差分を反映できないため、引き継がずに作り直す
+    index_path = create_generation_dir()
+    if base_path is not None and old_manifest["sources"]:
+        copy_generation(base_path, index_path)
+    db = create_vectorstore(embeddings, index_path)
+
+    # 変更・削除されたデータソースの古いチャンクを削除
+    stale_ids = []
+    for source in changed_sources + removed_sources:
+        if source in old_manifest["sources"]:
+            stale_ids.extend(old_manifest["sources"][source]["chunk_ids"])
+    if stale_ids:
+        db.delete(ids=stale_ids)
+
+    # 読み込み→文字列調整・チャンク分割→埋め込み・登録を、データソースごとに順次流す
+    # 一度に保持するのは、読み込み中の数ファイル分と、登録待ちの1バッチ分のチャンクのみ
+    # 埋め込み結果はバッチごとにキャッシュへ保存されるため、中断しても再実行時は続きから埋め込まれる
+    source_docs = iter_changed_documents(changed_sources, web_docs)
+    chunks = iter_chunks(source_docs, new_manifest)
+    for batch in iter_batches(chunks, ct.INDEX_UPSERT_BATCH_SIZE):
+        db.add_documents([doc for _, doc in batch], ids=[chunk_id for chunk_id, _ in batch])
+        stats["chunks"] += len(batch)
+
+    # 量子化ベクターストアは削除済みの行をファイルに残したまま追記していくため、
+    # 作り直し時と、削除済みの行が一定の割合を超えた時に、削除済みの行を取り除いたファイルに置き換える
+    if isinstance(db, QuantizedVectorStore) and db.deleted_rows:
+        if full_rebuild or len(db.deleted_rows) > len(db.ids) * ct.QUANTIZED_COMPACT_DELETED_RATIO:
+            db.compact()
+
+    # チャンクの本文は文書ストアに書き出し、全セッション・全プロセスでメモリマップして共有する
+    # 全文検索用の転置インデックスも、同じ世代の文書ストアから作成して一緒に公開する
+    doc_store.write_document_store(index_path, iter_indexed_documents(db))
+    keyword_index.KeywordIndex(doc_store.open_document_store(index_path)).save(index_path)
+
+    save_manifest(index_path, new_manifest)
+    publish_generation(index_path)
+
+    return db, stats
+
+
+def detect_changes(old_manifest, refresh_web=True, changed_paths=None):
+    """
+    マニフェストと現在のデータソースを比較し、変更点を洗い出す
+
+    Args:
+        old_manifest: 公開中のインデックスのマニフェスト
+        refresh_web: Webページを読み込み直して変更を確認するかどうか
+        changed_paths: 変更があったファイルのパスのリスト
+            （指定した場合は、これらのファイルのみ更新日時・ハッシュ値を確認し、その他のファイルはマニフェストの内容を引き継ぐ。
+            Noneの場合や、マニフェストが空の場合は、フォルダ内の全ファイルを確認する）
+
+    Returns:
+        新しいマニフェスト, 追加・変更されたデータソースのリスト, 削除されたデータソースのリスト,
+        追加・変更されたWebページと読み込んだドキュメントの辞書
+        （ファイルはここでは読み込まず、チャンク分割の直前に順次読み込む）
+    """
+    old_sources = old_manifest["sources"]
+    new_manifest = {"version": ct.INDEX_MANIFEST_VERSION, "backend": ct.VECTOR_STORE_BACKEND, "sources": {}}
+    changed_sources = []
+    web_docs = {}
+
+    # 変更があったファイルが分かっている場合は、フォルダ全体を走査せず、それ以外のファイルはマニフェストの内容を引き継ぐ
+    if changed_paths is not None and old_sources:
+        changed_paths = set(changed_paths)
+        for source, old_entry in old_sources.items():
+            if old_entry["kind"] == "file" and source not in changed_paths:
+                new_manifest["sources"][source] = old_entry
+        source_files = sorted(
+            path for path in changed_paths
+            if os.path.isfile(path) and os.path.splitext(path)[1] in ct.SUPPORTED_EXTENSIONS
+        )
+    else:
+        source_files = data_loader.list_source_files()
+
+    # ファイルは更新日時とサイズが同じなら未変更とみなし、異なる場合のみハッシュ値で中身を比較
+    for path in source_files:
+        stat = os.stat(path)
+        old_entry = old_sources.get(path)
+        entry = {"kind": "file", "mtime": stat.st_mtime, "size": stat.st_size}
+        if old_entry and old_entry["mtime"] == stat.st_mtime and old_entry["size"] == stat.st_size:
+            entry["sha256"] = old_entry["sha256"]
+        else:
+            entry["sha256"] = data_loader.compute_file_hash(path)
+
+        if old_entry and old_entry["sha256"] == entry["sha256"]:
+            entry["chunk_ids"] = old_entry["chunk_ids"]
+        else:
+            changed_sources.append(path)
+        new_manifest["sources"][path] = entry
+
+    # Webページを読み込み直さない場合は、公開中のインデックスの内容をそのまま引き継ぐ
+    if not refresh_web:
+        for source, old_entry in old_sources.items():
+            if old_entry["kind"] == "web":
+                new_manifest["sources"][source] = old_entry
+
+    # Webページは更新日時を取得できないため、読み込んだ本文のハッシュ値で比較
+    web_docs_by_source = {}
+    for doc in (data_loader.load_web_sources() if refresh_web else []):
+        web_docs_by_source.setdefault(doc.metadata["source"], []).append(doc)
+    for source, docs in web_docs_by_source.items():
+        old_entry = old_sources.get(source)
+        entry = {
+            "kind": "web",
+            "sha256": data_loader.compute_text_hash("".join(doc.page_content for doc in docs))
+        }
+        if old_entry and old_entry["sha256"] == entry["sha256"]:
+            entry["chunk_ids"] = old_entry["chunk_ids"]
+        else:
+            changed_sources.append(source)
+            web_docs[source] = docs
+        new_manifest["sources"][source] = entry
+
+    removed_sources = [source for source in old_sources if source not in new_manifest["sources"]]
+
+    return new_manifest, changed_sources, removed_sources, web_docs
+
+
+def iter_changed_documents(changed_sources, web_docs):
+    """
+    追加・変更されたデータソースを読み込み、データソースごとに順次返す
+    （ファイルは複数プロセスで並列に読み込み、先読みする件数には上限を設ける）
+
+    Args:
+        changed_sources: 追加・変更されたデータソースのリスト
+        web_docs: 追加・変更されたWebページと読み込み済みのドキュメントの辞書
+
+    Returns:
+        データソースと読み込んだドキュメントのリストの組を順次返すジェネレーター
+    """
+    file_paths = [source for source in changed_sources if source not in web_docs]
+    yield from data_loader.iter_loaded_files(file_paths)
+    for source in changed_sources:
+        if source in web_docs:
+            # 返した後は参照を残さないよう、辞書から取り出して渡す
+            yield source, web_docs.pop(source)
+
+
+def iter_chunks(source_docs, manifest):
+    """
+    データソースごとに文字列調整・チャンク分割を行い、チャンクIDを付けて順次返す
+    （データソースごとのチャンクIDは、マニフェストにも記録する）
+
+    Args:
+        source_docs: データソースと読み込んだドキュメントのリストの組のイテラブル
+        manifest: 新しいマニフェスト
+
+    Returns:
+        チャンクIDとチャンクのドキュメントの組を順次返すジェネレーター
+    """
+    for source, docs in source_docs:
+        entry = manifest["sources"][source]
+        splitted_docs = data_loader.create_splitted_documents(docs)
+        chunk_ids = create_chunk_ids(source, entry["sha256"], len(splitted_docs))
+        entry["chunk_ids"] = chunk_ids
+        for doc, chunk_id in zip(splitted_docs, chunk_ids):
+            doc.metadata["chunk_id"] = chunk_id
+            yield chunk_id, doc
+
+
+def iter_batches(items, batch_size):
+    """
+    イテラブルの要素を、一定件数ずつのリストにまとめて順次返す
+
+    Args:
+        items: 要素のイテラブル
+        batch_size: 1つのリストの最大件数
+
+    Returns:
+        要素のリストを順次返すジェネレーター
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def create_chunk_ids(source, content_hash, count):
+    """
+    チャンクのIDを作成（データソースと内容が同じであれば、常に同じIDになる）
+
+    Args:
+        source: データソースのパス/URL
+        content_hash: データソースの内容のハッシュ値
+        count: チャンク数
+
+    Returns:
+        チャンクIDのリスト
+    """
+    prefix = f"{data_loader.compute_text_hash(source)[:16]}-{content_hash[:16]}"
+    return [f"{prefix}-{i}" for i in range(count)]
+
+
+def load_manifest(index_path, check_backend=True):
+    """
+    インデックスのマニフェスト（データソースごとの更新日時・サイズ・ハッシュ値・チャンクID）を読み込む
+
+    Args:
+        index_path: インデックスのフォルダパス
+        check_backend: ベクターストアの種類が設定値と異なる場合に、空のマニフェストとして扱うかどうか
+
+    Returns:
+        マニフェスト（存在しない場合は空のマニフェスト）
+    """
+    empty_manifest = {"version": ct.INDEX_MANIFEST_VERSION, "backend": ct.VECTOR_STORE_BACKEND, "sources": {}}
+    if index_path is None:
+        return empty_manifest
+
+    manifest_file = os.path.join(index_path, ct.INDEX_MANIFEST_FILE)
+    if not os.path.isfile(manifest_file):
+        return empty_manifest
+
+    with open(manifest_file, encoding="utf8") as f:
+        manifest = json.load(f)
+    # 形式が異なるマニフェストは差分判定に使えないため、全件作り直す
+    if manifest.get("version") != ct.INDEX_MANIFEST_VERSION:
+        return empty_manifest
+    # ベクターストアの種類を切り替えた場合は、差分を反映できないため全件作り直す
+    if check_backend and manifest.get("backend", ct.VECTOR_STORE_BACKEND_CHROMA) != ct.VECTOR_STORE_BACKEND:
+        return empty_manifest
+    return manifest
+
+
+def save_manifest(index_path, manifest):
+    """
+    インデックスのマニフェストを書き込む
+
+    Args:
+        index_path: インデックスのフォルダパス
+        manifest: マニフェスト
+    """
+    with open(os.path.join(index_path, ct.INDEX_MANIFEST_FILE), "w", encoding="utf8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+
+def create_generation_dir():
+    """
+    新しい世代のインデックスを書き込むためのフォルダを作成
+
+    Returns:
+        作成したフォルダのパス
+    """
+    # 世代名は作成時刻順に並ぶようにし、同時刻の衝突はランダム文字列で回避
+    generation = f"gen-{time.strftime('%Y%m%d%H%M%S')}-{uuid4().hex[:8]}"
+    index_path = os.path.join(ct.INDEX_ROOT_DIR, generation)
+    os.makedirs(index_path)
+
+    return index_path
+
+
+def copy_generation(base_path, index_path):
+    """
+    公開中の世代のうち、新しい世代で更新するファイルのみを新しい世代のフォルダに用意
+    - 文書ストア・転置インデックス・マニフェストは、新しい世代で全件から書き直すため引き継がない
+    - 量子化ベクターストアは、追記しかしないファイルをハードリンクで共有し、世代ごとに異なるIDの一覧などのみを複製する
+      （1回の更新で複製する量は、チャンク数に比例する数十バイト/件程度）
+    - Chromaは、SQLiteとベクトルのファイルをその場で書き換えるため、ベクトルストア全体を複製する
+      （1回の更新ごとにインデックス全体のサイズ分の複製が発生するため、大量のチャンクを頻繁に更新する場合は量子化ベクターストアを使う）
+
+    Args:
+        base_path: 公開中の世代のフォルダパス
+        index_path: 新しい世代のフォルダパス
+    """
+    rewritten_files = {ct.DOC_STORE_BLOB_FILE, ct.DOC_STORE_OFFSETS_FILE, ct.KEYWORD_INDEX_FILE, ct.INDEX_MANIFEST_FILE}
+    for name in os.listdir(base_path):
+        source = os.path.join(base_path, name)
+        target = os.path.join(index_path, name)
+        if name in rewritten_files:
+            continue
+        if name == ct.QUANTIZED_STORE_DIR:
+            quantized_store.link_store_files(base_path, index_path)
+        elif os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copy2(source, target)
+
+
+def publish_generation(index_path):
+    """
+    作成済みの世代を公開中のインデックスとして切り替える
+
+    Args:
+        index_path: 公開する世代のフォルダパス
+    """
+    current_file = os.path.join(ct.INDEX_ROOT_DIR, ct.INDEX_CURRENT_FILE)
+    tmp_file = f"{current_file}.{uuid4().hex}.tmp"
+
+    # 一時ファイルに書き込んでから置き換えることで、読み込み側が書きかけのポインタを見ないようにする
+    with open(tmp_file, "w", encoding="utf8") as f:
+        f.write(os.path.basename(index_path))
+    os.replace(tmp_file, current_file)
+
+    remove_old_generations()
+
+
+def remove_old_generations():
+    """
+    古い世代のインデックスフォルダを削除
+    """
+    current_path = get_current_index_path()
+    generation_paths = [
+        os.path.join(ct.INDEX_ROOT_DIR, name) for name in os.listdir(ct.INDEX_ROOT_DIR)
+        if name.startswith("gen-") and os.path.isdir(os.path.join(ct.INDEX_ROOT_DIR, name))
+    ]
+    # 同じ秒に作成された世代もあるため、名前ではなく作成順（更新日時）で並べる
+    generation_paths.sort(key=os.path.getmtime)
+
+    # 他プロセスが直前の世代を開いている可能性があるため、指定数の世代は残す
+    for index_path in generation_paths[:-ct.INDEX_KEEP_GENERATIONS]:
+        # 公開中の世代は削除しない
+        if index_path == current_path:
+            continue
+        shutil.rmtree(index_path, ignore_errors=True)
+
+
+@contextmanager
+def build_lock():
+    """
+    インデックス作成の排他制御（複数プロセスが同時に作成処理を行わないようにする）
+    """
+    os.makedirs(ct.INDEX_ROOT_DIR, exist_ok=True)
+    lock_file = os.path.join(ct.INDEX_ROOT_DIR, ct.INDEX_LOCK_FILE)
+
+    while True:
+        try:
+            # O_EXCLでの作成はOSを問わずアトミックなため、ロックファイルとして利用
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            # 作成途中でプロセスが落ちた場合に備え、一定時間を超えたロックは破棄
+            try:
+                if time.time() - os.path.getmtime(lock_file) > ct.INDEX_LOCK_TIMEOUT:
+                    os.remove(lock_file)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(ct.INDEX_LOCK_POLL_INTERVAL)
+
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(lock_file)
+        except FileNotFoundError:
+            pass
+
+
+def iter_indexed_documents(db, batch_size=ct.INDEX_UPSERT_BATCH_SIZE):
+    """
+    インデックスに格納済みのチャンクを、一定件数ずつ読み出してドキュメントとして順次返す
+
+    Args:
+        db: ベクターストア
+        batch_size: 1度に読み出すチャンク数
+
+    Returns:
+        チャンクのドキュメントを順次返すジェネレーター
+    """
+    offset = 0
+    while True:
+        records = db.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if not records["ids"]:
+            return
+        for text, metadata in zip(records["documents"], records["metadatas"]):
+            yield Document(page_content=text, metadata=metadata or {})
+        offset += len(records["ids"])
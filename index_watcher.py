@@ -0,0 +1,115 @@
+"""
+このファイルは、データソースのフォルダを監視し、ファイルの変更をバックグラウンドでインデックスに反映するための処理が記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import logging
+import threading
+from watchfiles import watch
+import constants as ct
+import index_store
+
+
+############################################################
+# 関数定義
+############################################################
+
+def is_source_file(change, path):
+    """
+    監視対象のファイルかどうかを判定（読み込み対象外のファイルや、Officeの一時ファイルは無視する）
+    拡張子のないパスはフォルダの可能性があるため対象とする（フォルダごと移動・削除された場合、中のファイルごとの変更は通知されない）
+
+    Args:
+        change: 変更の種類
+        path: 変更があったファイルのパス
+
+    Returns:
+        監視対象であればTrue
+    """
+    file_name = os.path.basename(path)
+    if file_name.startswith("~$") or file_name.startswith("."):
+        return False
+    extension = os.path.splitext(file_name)[1]
+    return extension in ct.SUPPORTED_EXTENSIONS or extension == ""
+
+
+def get_changed_source_paths(changes):
+    """
+    監視で通知された変更を、マニフェストと同じ形式（データソースのフォルダパスを起点とするパス）のファイルパスに変換
+
+    Args:
+        changes: 変更の種類と、変更があったパスの組の集合
+
+    Returns:
+        変更があったファイルのパスのリスト（フォルダの変更が含まれる場合は、フォルダ内のどのファイルが変わったか分からないためNone）
+    """
+    root_path = os.path.abspath(ct.RAG_TOP_FOLDER_PATH)
+    source_paths = []
+    for _, path in changes:
+        if os.path.splitext(path)[1] not in ct.SUPPORTED_EXTENSIONS:
+            # 拡張子のないファイルは読み込み対象外のため無視する
+            if os.path.isfile(path):
+                continue
+            return None
+        source_paths.append(os.path.join(ct.RAG_TOP_FOLDER_PATH, os.path.relpath(path, root_path)))
+    return sorted(source_paths)
+
+
+def watch_data_sources(embeddings, stop_event=None):
+    """
+    データソースのフォルダを監視し、変更があるたびにインデックスを差分更新する
+    （stop_eventがセットされるまで処理を継続する）
+
+    Args:
+        embeddings: 埋め込みモデル
+        stop_event: 監視を終了させるためのイベント
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    # 短時間に続けて発生した変更（フォルダのコピーなど）は、debounceの間まとめてから1回で反映する
+    for changes in watch(
+        ct.RAG_TOP_FOLDER_PATH,
+        watch_filter=is_source_file,
+        debounce=ct.INDEX_WATCH_DEBOUNCE_MS,
+        stop_event=stop_event
+    ):
+        try:
+            # 他プロセスの監視処理やコマンドと同時に更新しないよう、排他制御してから反映
+            # 新しい世代は作成し終えてから公開されるため、各セッションが作成途中のインデックスを見ることはない
+            # 変更があったファイルのみ、更新日時・ハッシュ値を確認する
+            changed_paths = get_changed_source_paths(changes)
+            with index_store.build_lock():
+                _, stats = index_store.update_index(embeddings, refresh_web=False, changed_paths=changed_paths)
+            logger.info({
+                "message": "データソースの変更をインデックスに反映しました。",
+                "changed_files": changed_paths if changed_paths is not None else sorted(path for _, path in changes),
+                **stats
+            })
+        except Exception:
+            # 反映に失敗しても監視は止めず、公開中のインデックスを使い続ける
+            logger.exception("データソースの変更をインデックスに反映できませんでした。")
+
+
+def start_watcher_thread(embeddings):
+    """
+    データソースの監視をバックグラウンドのスレッドで開始
+
+    Args:
+        embeddings: 埋め込みモデル
+
+    Returns:
+        監視を終了させるためのイベント
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=watch_data_sources,
+        args=(embeddings, stop_event),
+        name="index-watcher",
+        daemon=True
+    )
+    thread.start()
+
+    return stop_event
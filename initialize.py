@@ -1,7 +1,8 @@
-# chat_historyの初期化（未定義なら空リストで初期化）
+# chat_historyの初期化（未定義なら空の会話履歴で初期化）
 import streamlit as st
+from conversation_memory import ConversationMemory
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+    st.session_state.chat_history = ConversationMemory()
 """
 このファイルは、最初の画面読み込み時にのみ実行される初期化処理が記述されたファイルです。
 """
@@ -11,18 +12,22 @@ if "chat_history" not in st.session_state:
 ############################################################
 import os
 import logging
-from logging.handlers import TimedRotatingFileHandler
 from uuid import uuid4
-import sys
-import unicodedata
 from dotenv import load_dotenv
 import streamlit as st
 from docx import Document
-from langchain_community.document_loaders import WebBaseLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
 import constants as ct
+import index_store
+import index_watcher
+import doc_store
+import keyword_index
+from hybrid_retriever import HybridRetriever
+from query_condenser import QueryCondenser
+from answer_cache import AnswerCache
+import embedding_cache
+import roster
+import rag_chain
+import app_logging
 
 
 ############################################################
@@ -48,49 +53,20 @@ def initialize():
     initialize_logger()
     # RAGのRetrieverを作成
     initialize_retriever()
+    # 社員名簿の表を用意
+    initialize_roster()
 
 
 def initialize_logger():
     """
     ログ出力の設定
     """
-    # 指定のログフォルダが存在すれば読み込み、存在しなければ新規作成
-    os.makedirs(ct.LOG_DIR_PATH, exist_ok=True)
-    
-    # 引数に指定した名前のロガー（ログを記録するオブジェクト）を取得
-    # 再度別の箇所で呼び出した場合、すでに同じ名前のロガーが存在していれば読み込む
-    logger = logging.getLogger(ct.LOGGER_NAME)
-
-    # すでにロガーにハンドラー（ログの出力先を制御するもの）が設定されている場合、同じログ出力が複数回行われないよう処理を中断する
-    if logger.hasHandlers():
-        return
-
-    # 1日単位でログファイルの中身をリセットし、切り替える設定
-    log_handler = TimedRotatingFileHandler(
-        os.path.join(ct.LOG_DIR_PATH, ct.LOG_FILE),
-        when="D",
-        encoding="utf8"
-    )
-    # 出力するログメッセージのフォーマット定義
-    # - 「levelname」: ログの重要度（INFO, WARNING, ERRORなど）
-    # - 「asctime」: ログのタイムスタンプ（いつ記録されたか）
-    # - 「lineno」: ログが出力されたファイルの行番号
-    # - 「funcName」: ログが出力された関数名
-    # - 「session_id」: セッションID（誰のアプリ操作か分かるように）
-    # - 「message」: ログメッセージ
-    formatter = logging.Formatter(
-        f"[%(levelname)s] %(asctime)s line %(lineno)s, in %(funcName)s, session_id={st.session_state.session_id}: %(message)s"
-    )
+    # 以降のログに、このセッションのIDを付ける（画面の処理は実行のたびに別のスレッドで動くため、毎回設定する）
+    app_logging.set_session_id(st.session_state.session_id)
 
-    # 定義したフォーマッターの適用
-    log_handler.setFormatter(formatter)
-
-    # ログレベルを「INFO」に設定
-    logger.setLevel(logging.INFO)
-
-    # 作成したハンドラー（ログ出力先を制御するオブジェクト）を、
-    # ロガー（ログメッセージを実際に生成するオブジェクト）に追加してログ出力の最終設定
-    logger.addHandler(log_handler)
+    # ログはキューに入れるだけで戻り、ファイルへの書き込みはプロセス内で1つだけ起動する専用のスレッドが行う
+    # （全セッションで同じ設定を共有するため、2回目以降の呼び出しでは何もしない）
+    app_logging.setup_queued_logger(ct.LOGGER_NAME, lambda: app_logging.create_rotating_file_handler(ct.LOG_FILE))
 
 
 def initialize_session_id():
@@ -105,163 +81,232 @@ def initialize_session_id():
 def initialize_retriever():
     """
     画面読み込み時にRAGのRetriever（ベクターストアから検索するオブジェクト）を作成
+    インデックスの新しい世代が公開されていれば、次の画面読み込み時に切り替える
     """
     # ロガーを読み込むことで、後続の処理中に発生したエラーなどがログファイルに記録される
     logger = logging.getLogger(ct.LOGGER_NAME)
 
-    # すでにRetrieverが作成済みの場合、後続の処理を中断
-    if "retriever" in st.session_state:
+    # データソースの変更を監視するスレッドを開始（プロセス内で1度だけ）
+    if ct.INDEX_WATCH_ENABLED:
+        start_index_watcher()
+
+    # すでに公開中の世代のRetriever・Chainを取得済みの場合、後続の処理を中断
+    index_path = index_store.get_current_index_path()
+    if "rag_chains" in st.session_state and st.session_state.get("index_path") == index_path:
         return
-    
-    # RAGの参照先となるデータソースの読み込み
-    docs_all = load_data_sources()
-    st.session_state.docs_all = docs_all
-
-    # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
-    for doc in docs_all:
-        doc.page_content = adjust_string(doc.page_content)
-        for key in doc.metadata:
-            doc.metadata[key] = adjust_string(doc.metadata[key])
-    
-    # 埋め込みモデルの用意
-    embeddings = OpenAIEmbeddings()
-    
-    # チャンク分割用のオブジェクトを作成
-    text_splitter = CharacterTextSplitter(
-        chunk_size=ct.CHUNK_SIZE,
-        chunk_overlap=ct.CHUNK_OVERLAP,
-        separator="\n"
-    )
 
-    # チャンク分割を実施
-    splitted_docs = text_splitter.split_documents(docs_all)
+    # 全文検索用の転置インデックスとRetrieverは、同じ世代のものをプロセス内で共有し、セッションごとには作成しない
+    st.session_state.keyword_index = get_shared_keyword_index(index_path)
+    st.session_state.retriever = get_shared_retriever(index_path)
+    # モードごとのRAGのChainも、同じ世代のものをプロセス内で共有
+    st.session_state.rag_chains = {
+        mode: get_shared_rag_chain(mode, index_path)
+        for mode in [ct.ANSWER_MODE_1, ct.ANSWER_MODE_2]
+    }
+    st.session_state.query_condensers = {
+        mode: get_shared_query_condenser(mode)
+        for mode in [ct.ANSWER_MODE_1, ct.ANSWER_MODE_2]
+    }
+    # 回答キャッシュは全セッションで共有し、世代が変わった時点でキャッシュ側で破棄される
+    st.session_state.answer_cache = get_shared_answer_cache() if ct.ANSWER_CACHE_ENABLED else None
+    # 初回作成時はここで公開された世代を記録する
+    st.session_state.index_path = index_path or index_store.get_current_index_path()
+
+
+@st.cache_resource(show_spinner=False)
+def get_shared_embeddings():
+    """
+    埋め込みモデルの用意（プロセス内で1度だけ実行され、全セッションで共有される）
 
-    # ベクターストアの作成
-    db = Chroma.from_documents(splitted_docs, embedding=embeddings)
+    Returns:
+        キャッシュ付きの埋め込みモデル
+    """
+    # 作成済みの埋め込みはキャッシュから再利用
+    # 検索クエリの埋め込みでも、LLMと同じ接続を使い回す
+    return embedding_cache.create_embeddings(http_client=get_shared_http_client())
 
-    # ベクターストアを検索するRetrieverの作成
-    st.session_state.retriever = db.as_retriever(search_kwargs={"k": 5})
 
+@st.cache_resource(show_spinner=False)
+def start_index_watcher():
+    """
+    データソースの監視スレッドを開始（プロセス内で1度だけ実行）
 
-def initialize_session_state():
+    Returns:
+        監視を終了させるためのイベント
     """
-    初期化データの用意
+    return index_watcher.start_watcher_thread(get_shared_embeddings())
+
+
+@st.cache_resource(show_spinner=False, max_entries=ct.INDEX_KEEP_GENERATIONS)
+def get_shared_vectorstore(index_path):
     """
-    if "messages" not in st.session_state:
-        # 「表示用」の会話ログを順次格納するリストを用意
-        st.session_state.messages = []
-        # 「LLMとのやりとり用」の会話ログを順次格納するリストを用意
-        st.session_state.chat_history = []
+    事前に作成済みのインデックスを開く
+    世代ごとにプロセス内で1度だけ実行され、結果は全セッションで共有される
+    （インデックスは「python -m cli build-index」で作成する）
+
+    Args:
+        index_path: 開くインデックスのフォルダパス（未作成の場合はNone）
+
+    Returns:
+        ベクターストア
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    embeddings = get_shared_embeddings()
+
+    # 作成済みのインデックスがあれば、読み込むだけで終了
+    if index_path is not None:
+        return index_store.open_index(embeddings, index_path)
+
+    # 画面表示中に全データソースを埋め込むと初回表示が止まるため、通常は作成済みのインデックスのみ利用
+    if not ct.INDEX_BUILD_ON_STARTUP:
+        raise RuntimeError(ct.INDEX_NOT_FOUND_MESSAGE)
+
+    # 複数プロセスが同時に起動した場合でも、インデックスの作成は1プロセスだけが行う
+    with index_store.build_lock():
+        # ロック待ちの間に他プロセスが作成を終えていれば、それを読み込む
+        db = index_store.open_index(embeddings)
+        if db is not None:
+            return db
 
+        logger.info("インデックスが存在しないため、新規作成します。")
+        db, stats = index_store.update_index(embeddings)
+        logger.info({"message": "インデックスを作成しました。", **stats, "embedding_cache": embeddings.stats})
 
-def load_data_sources():
+    return db
+
+
+@st.cache_resource(show_spinner=False, max_entries=ct.INDEX_KEEP_GENERATIONS)
+def get_shared_retriever(index_path):
     """
-    RAGの参照先となるデータソースの読み込み
+    ベクトル検索とキーワード検索（BM25）の結果を統合して検索するRetrieverの作成（世代ごとにプロセス内で1度だけ実行）
+
+    Args:
+        index_path: インデックスのフォルダパス
 
     Returns:
-        読み込んだ通常データソース
+        Retriever
     """
-    # データソースを格納する用のリスト
-    docs_all = []
-    # ファイル読み込みの実行（渡した各リストにデータが格納される）
-    recursive_file_check(ct.RAG_TOP_FOLDER_PATH, docs_all)
+    return HybridRetriever(
+        vectorstore=get_shared_vectorstore(index_path),
+        keyword_index=get_shared_keyword_index(index_path)
+    )
 
-    web_docs_all = []
-    # ファイルとは別に、指定のWebページ内のデータも読み込み
-    # 読み込み対象のWebページ一覧に対して処理
-    for web_url in ct.WEB_URL_LOAD_TARGETS:
-        # 指定のWebページを読み込み
-        loader = WebBaseLoader(web_url)
-        web_docs = loader.load()
-        # for文の外のリストに読み込んだデータソースを追加
-        web_docs_all.extend(web_docs)
-    # 通常読み込みのデータソースにWebページのデータを追加
-    docs_all.extend(web_docs_all)
 
-    return docs_all
+@st.cache_resource(show_spinner=False)
+def get_shared_http_client():
+    """
+    LLMのAPIとの通信に使うHTTPクライアントの用意（プロセス内で1度だけ実行され、全セッションで接続を使い回す）
 
+    Returns:
+        HTTPクライアント
+    """
+    return rag_chain.create_http_client()
 
-def recursive_file_check(path, docs_all):
+
+@st.cache_resource(show_spinner=False, max_entries=2 * ct.INDEX_KEEP_GENERATIONS)
+def get_shared_rag_chain(mode, index_path):
     """
-    RAGの参照先となるデータソースの読み込み
+    モードごとのRAGのChainを作成（モード・世代ごとにプロセス内で1度だけ実行され、全セッションで共有される）
+    ユーザー入力値と会話履歴は、Chainの実行時にのみ渡す
 
     Args:
-        path: 読み込み対象のファイル/フォルダのパス
-        docs_all: データソースを格納する用のリスト
+        mode: モード（「社内文書検索」or「社内問い合わせ」）
+        index_path: インデックスのフォルダパス
+
+    Returns:
+        RAGのChain
+    """
+    llm = rag_chain.create_chat_model(http_client=get_shared_http_client())
+    return rag_chain.build_rag_chain(
+        mode, get_shared_retriever(index_path), llm, query_condenser=get_shared_query_condenser(mode)
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_shared_query_condenser(mode):
+    """
+    検索用の質問文への書き換えを行うオブジェクトの用意
+    （モードごとにプロセス内で1度だけ作成し、書き換え結果と集計をインデックスの世代をまたいで引き継ぐ）
+
+    Args:
+        mode: モード（「社内文書検索」or「社内問い合わせ」）
+
+    Returns:
+        質問文の書き換えを行うオブジェクト
     """
-    # パスがフォルダかどうかを確認
-    if os.path.isdir(path):
-        # フォルダの場合、フォルダ内のファイル/フォルダ名の一覧を取得
-        files = os.listdir(path)
-        # 各ファイル/フォルダに対して処理
-        for file in files:
-            # ファイル/フォルダ名だけでなく、フルパスを取得
-            full_path = os.path.join(path, file)
-            # フルパスを渡し、再帰的にファイル読み込みの関数を実行
-            recursive_file_check(full_path, docs_all)
-    else:
-        # パスがファイルの場合、ファイル読み込み
-        file_load(path, docs_all)
+    llm = rag_chain.create_chat_model(http_client=get_shared_http_client())
+    return QueryCondenser(llm, mode)
 
 
-def file_load(path, docs_all):
+@st.cache_resource(show_spinner=False)
+def get_shared_answer_cache():
     """
-    ファイル内のデータ読み込み
+    回答キャッシュの用意（プロセス内で1度だけ作成され、全セッションで共有される）
+
+    Returns:
+        回答キャッシュ
+    """
+    return AnswerCache(get_shared_embeddings())
+
+
+@st.cache_resource(show_spinner=False, max_entries=ct.INDEX_KEEP_GENERATIONS)
+def get_shared_keyword_index(index_path):
+    """
+    全文検索用の転置インデックスを読み込む（世代ごとにプロセス内で1度だけ実行）
 
     Args:
-        path: ファイルパス
-        docs_all: データソースを格納する用のリスト
-    """
-    # ファイルの拡張子を取得
-    file_extension = os.path.splitext(path)[1]
-    # ファイル名（拡張子を含む）を取得
-    file_name = os.path.basename(path)
-
-    # 想定していたファイル形式の場合のみ読み込む
-    if file_extension in ct.SUPPORTED_EXTENSIONS:
-        loader = ct.SUPPORTED_EXTENSIONS[file_extension](path)
-        docs = loader.load()
-        # 社員名簿.csvの場合は各行のテキスト先頭に「社員一覧:」＋部門名（あれば）を付与
-        if file_name == "社員名簿.csv":
-            for doc in docs:
-                # 部門名を抽出（"部門"や"部署"などのカラムが含まれていれば）
-                dept = ""
-                # メタデータに部門情報があれば利用
-                if "部門" in doc.metadata:
-                    dept = doc.metadata["部門"]
-                elif "部署" in doc.metadata:
-                    dept = doc.metadata["部署"]
-                # テキストにも部門名が含まれていれば先頭に付与
-                if dept:
-                    doc.page_content = f"社員一覧: {dept}: {doc.page_content}"
-                else:
-                    doc.page_content = f"社員一覧: {doc.page_content}"
-        # 顧客について配下のファイルは「顧客一覧:」を付与
-        elif "顧客について" in path:
-            for doc in docs:
-                doc.page_content = f"顧客一覧: {doc.page_content}"
-        docs_all.extend(docs)
-
-
-def adjust_string(s):
-    """
-    Windows環境でRAGが正常動作するよう調整
-    
+        index_path: インデックスのフォルダパス
+
+    Returns:
+        転置インデックス
+    """
+    index = keyword_index.load_keyword_index(index_path) if index_path else None
+    # 転置インデックス・文書ストアを保存していない世代の場合は、チャンクからメモリ上に作成
+    if index is None:
+        db = get_shared_vectorstore(index_path)
+        index = keyword_index.KeywordIndex(
+            doc_store.DocumentStore.from_documents(index_store.iter_indexed_documents(db))
+        )
+    return index
+
+
+def initialize_roster():
+    """
+    社員名簿への質問に回答するための、社員名簿の表を用意
+    ファイルが更新されていれば、次の画面読み込み時に読み込み直す
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    try:
+        modified_time = os.path.getmtime(ct.ROSTER_FILE_PATH)
+    except OSError:
+        # 社員名簿がない場合は、他の質問と同様にRAGで回答する
+        logger.warning(f"社員名簿が見つかりません: {ct.ROSTER_FILE_PATH}")
+        st.session_state.roster = None
+        return
+    st.session_state.roster = get_shared_roster(ct.ROSTER_FILE_PATH, modified_time)
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def get_shared_roster(path, modified_time):
+    """
+    社員名簿の読み込み（ファイルの更新日時ごとにプロセス内で1度だけ実行され、全セッションで共有される）
+
     Args:
-        s: 調整を行う文字列
-    
+        path: 社員名簿のファイルパス
+        modified_time: ファイルの更新日時（更新時に読み込み直すためのキー）
+
     Returns:
-        調整を行った文字列
-    """
-    # 調整対象は文字列のみ
-    if type(s) is not str:
-        return s
-
-    # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
-    if sys.platform.startswith("win"):
-        s = unicodedata.normalize('NFC', s)
-        s = s.encode("cp932", "ignore").decode("cp932")
-        return s
-    
-    # OSがWindows以外の場合はそのまま返す
-    return s
\ No newline at end of file
+        社員名簿
+    """
+    return roster.EmployeeRoster.from_csv(path)
+
+
+def initialize_session_state():
+    """
+    初期化データの用意
+    """
+    if "messages" not in st.session_state:
+        # 「表示用」の会話ログを順次格納するリストを用意
+        st.session_state.messages = []
+        # 「LLMとのやりとり用」の会話ログを、件数・トークン数の上限内で保持するオブジェクトを用意
+        st.session_state.chat_history = ConversationMemory()
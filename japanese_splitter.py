@@ -0,0 +1,363 @@
+"""
+このファイルは、日本語の文書を文・見出し・ページの区切りを考慮して、トークン数単位のチャンクに分割する処理が記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+from functools import lru_cache
+from typing import List, NamedTuple
+import tiktoken
+from langchain_core.documents import Document
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """
+    チャンクのトークン数の計測に使う、埋め込みモデルのtiktokenのエンコーディングを取得
+
+    Returns:
+        エンコーディング
+    """
+    try:
+        return tiktoken.encoding_for_model(ct.EMBEDDING_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding(ct.EMBEDDING_DEFAULT_ENCODING)
+
+
+def count_tokens(text):
+    """
+    テキストのトークン数を計測
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        トークン数
+    """
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def is_heading(line):
+    """
+    見出しの行かどうかを判定（「1. 基本情報」「3.1 議題」「第2条」「【概要】」「■ 目的」など）
+
+    Args:
+        line: 前後の空白を除いた1行
+
+    Returns:
+        見出しであればTrue
+    """
+    if not line or len(line) > ct.SPLITTER_HEADING_MAX_CHARS or line.endswith("。"):
+        return False
+    return re.match(ct.SPLITTER_HEADING_PATTERN, line) is not None
+
+
+def is_wrapped_line(previous, line):
+    """
+    PDFのテキストで、行が前の行からページ幅で折り返された続きかどうかを判定
+    （前の行が文末の記号・コロンで終わる場合や、どちらかが見出し・空行の場合、行が箇条書きの記号で始まる場合は続きとみなさない）
+
+    Args:
+        previous: 前の行
+        line: 対象の行
+
+    Returns:
+        折り返された続きであればTrue
+    """
+    previous = previous.rstrip()
+    line = line.strip()
+    if not previous or not line:
+        return False
+    if re.search(ct.SPLITTER_LINE_END_PATTERN, previous):
+        return False
+    if is_heading(previous.strip()) or is_heading(line):
+        return False
+    return re.match(ct.SPLITTER_LIST_MARKER_PATTERN, line) is None
+
+
+def join_wrapped_lines(text):
+    """
+    PDFのテキストで、ページ幅による折り返しで途中に入った改行を取り除く
+    （見出し・箇条書きの行と、文末の記号・コロンで終わる行、空行の前後の改行は残す）
+
+    Args:
+        text: PDFの1ページ分のテキスト
+
+    Returns:
+        折り返しを取り除いたテキスト
+    """
+    lines = [line.rstrip() for line in text.split("\n")]
+    joined = []
+    for line in lines:
+        if joined and is_wrapped_line(joined[-1], line):
+            # 英単語どうしが折り返された場合のみ、空白を挟んで連結する
+            separator = " " if joined[-1][-1].isascii() and line[0].isascii() else ""
+            joined[-1] = joined[-1] + separator + line.lstrip()
+        else:
+            joined.append(line)
+    return "\n".join(joined)
+
+
+def split_sentences(text):
+    """
+    テキストを文（。！？の区切り、または改行）の単位に分割
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        文のリスト
+    """
+    return [sentence.strip() for sentence in re.split(r"(?<=[。！？!?])|\n+", text) if sentence and sentence.strip()]
+
+
+def split_sections(text):
+    """
+    テキストを見出しごとのまとまりに分割
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        まとまりのリスト（各まとまりは、見出しと本文の文のリストの組）
+    """
+    sections = [Section(heading=None, sentences=[])]
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if is_heading(stripped):
+            sections.append(Section(heading=stripped, sentences=[]))
+        else:
+            sections[-1].sentences.extend(split_sentences(stripped))
+    return [section for section in sections if section.heading or section.sentences]
+
+
+def split_long_sentence(sentence, max_tokens):
+    """
+    上限を超える長さの文を、トークン数の上限ごとに切り分ける
+
+    Args:
+        sentence: 対象の文
+        max_tokens: 最大トークン数
+
+    Returns:
+        切り分けた文のリスト
+    """
+    encoding = get_encoding()
+    tokens = encoding.encode(sentence, disallowed_special=())
+    # マルチバイト文字の途中で切れた場合に備え、デコードできない部分は置換文字ではなく除去する
+    return [
+        encoding.decode_bytes(tokens[i:i + max_tokens]).decode("utf-8", "ignore")
+        for i in range(0, len(tokens), max_tokens)
+    ]
+
+
+############################################################
+# クラス定義
+############################################################
+
+class Section(NamedTuple):
+    """
+    見出しごとのまとまり
+    - 「heading」: 見出し（文書の先頭で見出しがない場合はNone）
+    - 「sentences」: 本文の文のリスト
+    """
+    heading: str
+    sentences: List[str]
+
+
+class JapaneseTextSplitter:
+    """
+    日本語の文書を、文・見出し・ページの区切りを考慮してトークン数単位のチャンクに分割するクラス
+    - 文の途中では区切らず、1つの見出しのまとまりがチャンクに収まる場合は、見出しの前で区切る
+    - PDFはページごとに分割し、ページをまたいだチャンクは作らない
+    - CSVの行は、上限のトークン数までまとめて1つのチャンクにする
+    """
+
+    def __init__(self, chunk_size=ct.CHUNK_SIZE, chunk_overlap=ct.CHUNK_OVERLAP):
+        """
+        Args:
+            chunk_size: 1チャンクの最大トークン数
+            chunk_overlap: 見出しのまとまりの途中で区切った場合に、次のチャンクに重ねて含めるトークン数
+        """
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split_documents(self, docs):
+        """
+        ドキュメントをチャンクに分割
+
+        Args:
+            docs: 1つのデータソースから読み込んだドキュメントのリスト
+
+        Returns:
+            チャンクのドキュメントのリスト
+        """
+        chunks = []
+        csv_rows = []
+        for doc in docs:
+            # CSVの行は、連続する行をまとめてからチャンクにする
+            if "row" in doc.metadata:
+                if csv_rows and csv_rows[-1].metadata.get("source") != doc.metadata.get("source"):
+                    chunks.extend(self.group_rows(csv_rows))
+                    csv_rows = []
+                csv_rows.append(doc)
+                continue
+            if csv_rows:
+                chunks.extend(self.group_rows(csv_rows))
+                csv_rows = []
+
+            text = doc.page_content
+            # PDFは1ページが1ドキュメントとして読み込まれ、ページ番号を持つ
+            if "page" in doc.metadata:
+                text = join_wrapped_lines(text)
+            for chunk_text, heading_chars, overlap_chars in self.split_text_with_overlap(text):
+                metadata = dict(doc.metadata)
+                # 前のチャンクから引き継いだ先頭部分の文字数（隣接するチャンクを結合する際に、重複として取り除く）
+                if overlap_chars:
+                    metadata["overlap_heading_chars"] = heading_chars
+                    metadata["overlap_chars"] = overlap_chars
+                chunks.append(Document(page_content=chunk_text, metadata=metadata))
+        if csv_rows:
+            chunks.extend(self.group_rows(csv_rows))
+
+        return chunks
+
+    def split_text(self, text):
+        """
+        テキストをチャンクに分割
+
+        Args:
+            text: 対象のテキスト
+
+        Returns:
+            チャンクのテキストのリスト
+        """
+        return [chunk_text for chunk_text, _, _ in self.split_text_with_overlap(text)]
+
+    def split_text_with_overlap(self, text):
+        """
+        テキストをチャンクに分割し、前のチャンクから引き継いだ先頭部分の文字数も合わせて取得
+
+        Args:
+            text: 対象のテキスト
+
+        Returns:
+            チャンクのテキスト, 引き継いだ見出しの文字数, 引き継いだ見出しと文の合計文字数（いずれも直後の改行を含む）の組のリスト
+        """
+        chunks = []
+        current = []
+        current_tokens = 0
+        # 区切った直後のチャンクの先頭に引き継いだ、見出しと文の数
+        carried_heading = False
+        carried_count = 0
+
+        def flush():
+            nonlocal current, current_tokens, carried_heading, carried_count
+            if current:
+                heading_chars = len(current[0][0]) + 1 if carried_heading else 0
+                overlap_chars = len("\n".join(sentence for sentence, _ in current[:carried_count])) + 1 if carried_count else 0
+                chunks.append(("\n".join(sentence for sentence, _ in current), heading_chars, overlap_chars))
+            current = []
+            current_tokens = 0
+            carried_heading = False
+            carried_count = 0
+
+        for section in split_sections(text):
+            units = ([section.heading] if section.heading else []) + section.sentences
+            unit_tokens = [count_tokens(unit) for unit in units]
+            # 見出しのまとまりが丸ごと収まらない場合は、見出しの前で区切る
+            if current and current_tokens + sum(unit_tokens) > self.chunk_size:
+                flush()
+
+            for unit, tokens in zip(units, unit_tokens):
+                pieces = [(unit, tokens)]
+                if tokens > self.chunk_size:
+                    pieces = [(piece, count_tokens(piece)) for piece in split_long_sentence(unit, self.chunk_size)]
+                for piece, piece_tokens in pieces:
+                    if current and current_tokens + piece_tokens > self.chunk_size:
+                        # まとまりの途中で区切る場合は、見出しと直前の数文を次のチャンクにも含め、文脈を引き継ぐ
+                        carried = self._overlap(current, section.heading, piece_tokens)
+                        flush()
+                        current = carried
+                        current_tokens = sum(carried_tokens for _, carried_tokens in carried)
+                        carried_heading = bool(carried) and carried[0][0] == section.heading
+                        carried_count = len(carried)
+                    current.append((piece, piece_tokens))
+                    current_tokens += piece_tokens
+        flush()
+
+        return chunks
+
+    def _overlap(self, current, heading, next_tokens):
+        """
+        区切ったチャンクから、次のチャンクに引き継ぐ見出しと末尾の文を取得
+
+        Args:
+            current: 区切るチャンクの文とトークン数の組のリスト
+            heading: 現在の見出し
+            next_tokens: 次に追加する文のトークン数
+
+        Returns:
+            引き継ぐ文とトークン数の組のリスト
+        """
+        budget = self.chunk_size - next_tokens
+        carried = []
+        if heading and current and current[0][0] == heading:
+            heading_tokens = current[0][1]
+            if heading_tokens <= budget:
+                carried.append(current[0])
+                budget -= heading_tokens
+
+        tail = []
+        tail_tokens = 0
+        for sentence, tokens in reversed(current[len(carried):]):
+            if tail_tokens + tokens > min(self.chunk_overlap, budget):
+                break
+            tail.insert(0, (sentence, tokens))
+            tail_tokens += tokens
+        # 引き継ぐ文が区切るチャンクのすべてになる場合は、引き継がない
+        if len(carried) + len(tail) >= len(current):
+            return []
+        return carried + tail
+
+    def group_rows(self, rows):
+        """
+        CSVの連続する行を、上限のトークン数までまとめてチャンクにする
+
+        Args:
+            rows: 1行ずつのドキュメントのリスト
+
+        Returns:
+            チャンクのドキュメントのリスト
+        """
+        chunks = []
+        group = []
+        group_tokens = 0
+
+        def flush():
+            if group:
+                metadata = dict(group[0].metadata)
+                metadata["row_end"] = group[-1].metadata["row"]
+                chunks.append(Document(
+                    page_content="\n\n".join(row.page_content for row in group),
+                    metadata=metadata
+                ))
+
+        for row in rows:
+            tokens = count_tokens(row.page_content)
+            if group and group_tokens + tokens > self.chunk_size:
+                flush()
+                group = []
+                group_tokens = 0
+            group.append(row)
+            group_tokens += tokens
+        flush()
+
+        return chunks
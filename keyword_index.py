@@ -0,0 +1,336 @@
+"""
+このファイルは、全文検索（キーワード一致）用の転置インデックスが記述されたファイルです。
+単語の区切りがない日本語でも検索できるよう、文字のN-gram（1文字・2文字）単位でインデックスを作成します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import re
+import math
+import pickle
+from collections import Counter
+from typing import Dict, List, NamedTuple
+import numpy as np
+from langchain_core.documents import Document
+import constants as ct
+import doc_store
+
+
+############################################################
+# 関数定義
+############################################################
+
+def split_terms(query):
+    """
+    検索文字列を検索語に分割（半角・全角スペース区切り）
+
+    Args:
+        query: 検索文字列
+
+    Returns:
+        重複を除いた検索語のリスト
+    """
+    return list(dict.fromkeys(term for term in re.split(r"\s+", query.strip()) if term))
+
+
+def count_grams(text):
+    """
+    テキストに含まれる1文字・2文字のN-gramと、その出現回数を取得
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        N-gramと出現回数の辞書
+    """
+    counts = Counter(text)
+    counts.update(text[i:i + 2] for i in range(len(text) - 1))
+    return counts
+
+
+def query_grams(term):
+    """
+    検索語の絞り込みに使うN-gramを抽出（2文字以上の語は2-gram、1文字の語はその文字）
+
+    Args:
+        term: 検索語
+
+    Returns:
+        N-gramの集合
+    """
+    if len(term) == 1:
+        return {term}
+    return {term[i:i + 2] for i in range(len(term) - 1)}
+
+
+def intersect_sorted(a, b):
+    """
+    昇順に並んだ2つのID配列の共通部分を取得
+
+    Args:
+        a: ID配列
+        b: ID配列
+
+    Returns:
+        共通するIDの配列（昇順）
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    # 短い方の各IDが長い方のどこに入るかを二分探索し、一致するものだけを残す
+    positions = np.searchsorted(b, a)
+    positions[positions >= len(b)] = len(b) - 1
+    return a[b[positions] == a]
+
+
+def scoring_grams(query):
+    """
+    BM25のスコア計算に使うN-gramを抽出（検索語ごとの2-gram、1文字の語はその文字）
+
+    Args:
+        query: 検索文字列・質問文
+
+    Returns:
+        N-gramと出現回数の辞書
+    """
+    counts = Counter()
+    for term in split_terms(query):
+        if len(term) == 1:
+            counts[term] += 1
+        else:
+            counts.update(term[i:i + 2] for i in range(len(term) - 1))
+    return counts
+
+
+def find_offsets(text, term):
+    """
+    テキスト内で検索語が出現する位置をすべて取得
+
+    Args:
+        text: 対象のテキスト
+        term: 検索語
+
+    Returns:
+        出現位置（先頭からの文字数）のリスト
+    """
+    offsets = []
+    start = text.find(term)
+    while start != -1:
+        offsets.append(start)
+        start = text.find(term, start + 1)
+    return offsets
+
+
+def load_keyword_index(index_path):
+    """
+    インデックスのフォルダに保存済みの転置インデックスを読み込む
+
+    Args:
+        index_path: インデックスのフォルダパス
+
+    Returns:
+        転置インデックス（保存されていない場合はNone）
+    """
+    file_path = os.path.join(index_path, ct.KEYWORD_INDEX_FILE)
+    if not os.path.isfile(file_path):
+        return None
+    with open(file_path, "rb") as f:
+        index = pickle.load(f)
+    # 保存形式が異なる古い転置インデックスは使わない（呼び出し元で作り直す）
+    if getattr(index, "format_version", None) != KeywordIndex.FORMAT_VERSION:
+        return None
+    # チャンクの本文は転置インデックスに含めず、同じ世代の文書ストアをメモリマップして参照する
+    store = doc_store.open_document_store(index_path)
+    if store is None or len(store) != index.doc_count:
+        return None
+    index.documents = store
+    return index
+
+
+############################################################
+# クラス定義
+############################################################
+
+class KeywordHit(NamedTuple):
+    """
+    全文検索のヒット結果
+    - 「document」: ヒットしたドキュメント
+    - 「score」: 検索語の出現回数の合計（多いほど上位）
+    - 「offsets」: 検索語ごとの出現位置のリスト
+    """
+    document: Document
+    score: int
+    offsets: Dict[str, List[int]]
+
+
+class KeywordIndex:
+    """
+    文字N-gramの転置インデックス
+    N-gramごとに、そのN-gramを含むドキュメント番号の配列（昇順）と、各ドキュメントでの出現回数の配列を保持する
+    ドキュメント番号は文書ストアのチャンク番号と対応し、本文は文書ストアから必要な分だけ読み出す
+    """
+
+    # 保持する項目を変更した場合に値を上げる（保存済みの古い転置インデックスは作り直される）
+    FORMAT_VERSION = 3
+
+    def __init__(self, documents):
+        """
+        Args:
+            documents: 検索対象のチャンクの文書ストア
+        """
+        self.format_version = self.FORMAT_VERSION
+        self.documents = documents
+        self.doc_count = len(documents)
+
+        postings = {}
+        frequencies = {}
+        lengths = []
+        for doc_id, text in enumerate(documents.iter_texts()):
+            for gram, count in count_grams(text).items():
+                postings.setdefault(gram, []).append(doc_id)
+                frequencies.setdefault(gram, []).append(count)
+            lengths.append(len(text))
+        # ドキュメント番号の順に追加しているため、各配列は昇順に並んでいる
+        self.postings = {gram: np.asarray(ids, dtype=np.uint32) for gram, ids in postings.items()}
+        self.frequencies = {gram: np.asarray(counts, dtype=np.float32) for gram, counts in frequencies.items()}
+        # BM25の文書長の正規化に使う、各ドキュメントの文字数
+        self.doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_doc_length = float(self.doc_lengths.mean()) if self.doc_count else 0.0
+
+    def __len__(self):
+        return self.doc_count
+
+    def __getstate__(self):
+        """
+        保存時は文書ストアを含めない（読み込み時に同じ世代の文書ストアを開き直す）
+        """
+        state = dict(self.__dict__)
+        state["documents"] = None
+        return state
+
+    def save(self, index_path):
+        """
+        インデックスのフォルダに転置インデックスを保存
+
+        Args:
+            index_path: インデックスのフォルダパス
+        """
+        with open(os.path.join(index_path, ct.KEYWORD_INDEX_FILE), "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def candidates(self, term):
+        """
+        検索語を含む可能性があるドキュメント番号を、N-gramの共通部分から絞り込む
+
+        Args:
+            term: 検索語
+
+        Returns:
+            ドキュメント番号の配列（昇順）
+        """
+        empty = np.empty(0, dtype=np.uint32)
+        arrays = []
+        for gram in query_grams(term):
+            if gram not in self.postings:
+                return empty
+            arrays.append(self.postings[gram])
+
+        # 件数の少ない配列から順に共通部分を取ることで、比較回数を抑える
+        arrays.sort(key=len)
+        result = arrays[0]
+        for array in arrays[1:]:
+            result = intersect_sorted(result, array)
+            if len(result) == 0:
+                break
+        return result
+
+    def search(self, query, max_results=10):
+        """
+        すべての検索語を含むドキュメントを、出現回数の多い順に取得
+
+        Args:
+            query: 検索文字列（スペース区切りで複数の検索語を指定可能）
+            max_results: 最大返却件数
+
+        Returns:
+            ヒット結果のリスト
+        """
+        terms = split_terms(query)
+        if not terms:
+            return []
+
+        # 転置インデックスで候補を絞り込んでから、実際のテキストで出現位置を確認
+        candidate_ids = None
+        for term in sorted(terms, key=len, reverse=True):
+            ids = self.candidates(term)
+            candidate_ids = ids if candidate_ids is None else intersect_sorted(candidate_ids, ids)
+            if len(candidate_ids) == 0:
+                return []
+
+        hits = []
+        for doc_id in candidate_ids.tolist():
+            # N-gramがすべて含まれていても、連続して出現していない場合は除外（本文はデコードせずに判定）
+            if not all(self.documents.contains(doc_id, term) for term in terms):
+                continue
+            document = self.documents[doc_id]
+            offsets = {term: find_offsets(document.page_content, term) for term in terms}
+            hits.append((doc_id, KeywordHit(
+                document=document,
+                score=sum(len(positions) for positions in offsets.values()),
+                offsets=offsets
+            )))
+
+        # 出現回数の多い順、同数の場合はインデックスへの登録順に並べる
+        hits.sort(key=lambda item: (-item[1].score, item[0]))
+        return [hit for _, hit in hits[:max_results]]
+
+    def bm25_search(self, query, max_results=10):
+        """
+        質問文のN-gramとの関連度（BM25）が高い順にドキュメントを取得
+        すべての語を含む必要はなく、社員IDや会社名などの一致が多いドキュメントほど上位になる
+
+        Args:
+            query: 検索文字列・質問文
+            max_results: 最大返却件数
+
+        Returns:
+            ドキュメントとスコアの組のリスト（スコアの高い順）
+        """
+        if not self.doc_count:
+            return []
+
+        doc_count = self.doc_count
+        scores = np.zeros(doc_count, dtype=np.float32)
+        # 本文のないドキュメント（文字を抽出できないスキャンPDFなど）のみの場合に、0で割らないようにする
+        length_norm = ct.BM25_K1 * (1 - ct.BM25_B + ct.BM25_B * self.doc_lengths / max(self.avg_doc_length, 1))
+        for gram, query_count in scoring_grams(query).items():
+            if gram not in self.postings:
+                continue
+            ids = self.postings[gram]
+            tf = self.frequencies[gram]
+            # 多くのドキュメントに出現するN-gramほど、スコアへの寄与を小さくする
+            idf = math.log((doc_count - len(ids) + 0.5) / (len(ids) + 0.5) + 1)
+            # 1つのN-gramの配列内でドキュメント番号は重複しないため、まとめて加算できる
+            scores[ids] += query_count * idf * tf * (ct.BM25_K1 + 1) / (tf + length_norm[ids])
+
+        # 社員IDやメールアドレスなどの英数字の語は、N-gramの一部一致（EMP0001とEMP0010など）と区別するため、
+        # 語全体が一致するドキュメントに、その語のN-gramがすべて一致した場合と同じだけのスコアを加算
+        for term in re.findall(ct.BM25_EXACT_TERM_PATTERN, query):
+            ids = [doc_id for doc_id in self.candidates(term).tolist() if self.documents.contains(doc_id, term)]
+            if ids:
+                bonus = sum(
+                    math.log((doc_count - len(self.postings[gram]) + 0.5) / (len(self.postings[gram]) + 0.5) + 1)
+                    for gram in query_grams(term)
+                ) * (ct.BM25_K1 + 1)
+                scores[ids] += bonus
+
+        # 上位のみを部分ソートで取り出してから、スコア順に並べる
+        top_count = min(max_results, int(np.count_nonzero(scores)))
+        if top_count == 0:
+            return []
+        top_ids = np.argpartition(-scores, top_count - 1)[:top_count]
+        top_ids = top_ids[np.argsort(-scores[top_ids], kind="stable")]
+        return [(self.documents[doc_id], float(scores[doc_id])) for doc_id in top_ids.tolist()]
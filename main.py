@@ -35,20 +35,13 @@ import utils
 import components as cn
 import initialize
 import constants as ct
+import tracing
 
 ############################################################
 # 4. ログ設定
 ############################################################
 logger = logging.getLogger(ct.LOGGER_NAME)
 
-# ==== debug flag ====
-import os
-DEBUG = os.getenv("APP_DEBUG", "0") == "1"
-logger.setLevel(logging.DEBUG if DEBUG else logging.WARNING)
-def dlog(msg):
-    if DEBUG:
-        logger.debug(msg)  # 端末ログにだけ出す（画面には出ない）
-
 ############################################################
 # 5. st.session_state 初期化
 ############################################################
@@ -112,103 +105,64 @@ if user_text is not None:
 ############################################################
 
 if user_text is not None and str(user_text).strip() != "":
-    # 10-1. ユーザーメッセージの表示
-    logger.info({"message": user_text, "application_mode": st.session_state.mode})
-    with st.chat_message("user"):
-        st.markdown(user_text)
-
-    # 10-2. 全文検索（キーワード一致）
-    keyword_results = []
-    try:
-        keyword_results = utils.search_documents_by_keyword(
-            user_text, st.session_state.get("docs_all"), max_results=ct.MAX_KEYWORD_RESULTS
-        )
-        dlog(f"keyword_results: {len(keyword_results)}")
-    except Exception as e:
-        logger.warning(f"全文検索エラー: {e}")
+    # 1回の質問ごとに、処理段階ごとの所要時間とトークン数を計測して記録
+    with tracing.start_turn(st.session_state.session_id, st.session_state.mode, user_text):
+        # 10-1. ユーザーメッセージの表示
+        logger.info({"message": user_text, "application_mode": st.session_state.mode})
+        with st.chat_message("user"):
+            st.markdown(user_text)
+
+        # 10-2. 全文検索（キーワード一致）
         keyword_results = []
-
-    # 10-3. LLMからの回答取得（RAG）
-    try:
-        llm_response = utils.get_llm_response(user_text)
-        dlog(f"llm_response type: {type(llm_response)}")
-    except Exception:
-        logger.exception("get_llm_response failed; fallback to fixed list")
-        utils.render_hr_list_fixed()
-        llm_response = None
-
-    # 10-4. 回答表示
-    try:
-        has_keyword = bool(keyword_results)
-        has_rag = False
-        if st.session_state.mode == ct.ANSWER_MODE_1:
-            content = cn.display_search_llm_response(llm_response)
-        elif st.session_state.mode == ct.ANSWER_MODE_2:
-            content = cn.display_contact_llm_response(llm_response)
-        else:
-            content = cn.display_search_llm_response(llm_response)
-        # contentがdict型の場合はstr型に変換してからstrip()
-        content_str = content if isinstance(content, str) else str(content)
-        has_rag = bool(content_str and str(content_str).strip())
-
-        if has_keyword:
-            st.markdown("#### 🔍 キーワード一致による全文検索結果")
-            for doc in keyword_results:
-                st.expander(f"{doc.metadata.get('source', '')}").write(doc.page_content)
-
-        if has_rag:
-            st.markdown("#### 🤖 AIによる要約・回答")
-            st.markdown(content_str)
-        if not has_keyword and not has_rag:
-            st.warning("入力内容と関連する社内文書・AI回答が見つかりませんでした。入力内容を変更してください。", icon="⚠️")
-            content = "入力内容と関連する社内文書・AI回答が見つかりませんでした。"
-        logger.info({"message": content, "application_mode": st.session_state.mode})
-    except Exception as e:
-        import traceback
-        tb_str = traceback.format_exc()
-        logger.error(f"{ct.DISP_ANSWER_ERROR_MESSAGE}\n{e}\n{tb_str}")
-        st.error(f"エラー詳細:\n{type(e).__name__}: {e}\n\n{tb_str}", icon=ct.ERROR_ICON)
-        st.stop()
-
-
-    # 10-4. アシスタントの回答表示（全文検索＋RAGハイブリッド）
-
-    with st.chat_message("assistant"):
         try:
-            # まず全文検索結果を表示
-            has_keyword = bool(keyword_results)
-            has_rag = False
-            if st.session_state.mode == ct.ANSWER_MODE_1:
-                content = cn.display_search_llm_response(llm_response)
-            elif st.session_state.mode == ct.ANSWER_MODE_2:
-                content = cn.display_contact_llm_response(llm_response)
-            else:
-                content = cn.display_search_llm_response(llm_response)
-            # contentがdict型の場合はstr型に変換してからstrip()
-            if isinstance(content, dict):
-                content_str = str(content)
-            else:
-                content_str = content
-            has_rag = bool(content_str and str(content_str).strip())
-
-            if has_keyword:
-                st.markdown("#### 🔍 キーワード一致による全文検索結果")
-                for doc in keyword_results:
-                    st.expander(f"{doc.metadata.get('source', '')}").write(doc.page_content)
-
-            if has_rag:
-                st.markdown("#### 🤖 AIによる要約・回答")
-                st.markdown(content)
-            if not has_keyword and not has_rag:
-                st.warning("入力内容と関連する社内文書・AI回答が見つかりませんでした。入力内容を変更してください。", icon="⚠️")
-                content = "入力内容と関連する社内文書・AI回答が見つかりませんでした。"
-            logger.info({"message": content, "application_mode": st.session_state.mode})
+            with tracing.stage("keyword_search"):
+                keyword_results = utils.search_documents_by_keyword(
+                    user_text, st.session_state.get("keyword_index"), max_results=ct.MAX_KEYWORD_RESULTS
+                )
         except Exception as e:
-            tb_str = traceback.format_exc()
-            logger.error(f"{ct.DISP_ANSWER_ERROR_MESSAGE}\n{e}\n{tb_str}")
-            st.error(f"エラー詳細:\n{type(e).__name__}: {e}\n\n{tb_str}", icon=ct.ERROR_ICON)
-            st.stop()
-
-    # 10-5. 会話ログに追加
-    st.session_state.messages.append({"role": "user", "content": user_text})
-    st.session_state.messages.append({"role": "assistant", "content": content})
+            logger.warning(f"全文検索エラー: {e}")
+            keyword_results = []
+
+        # 10-3. アシスタントの回答表示（RAG＋全文検索ハイブリッド）
+        # 回答は画面表示用の辞書データに1度だけ整形し、それをチャット欄に1度だけ表示する
+        with st.chat_message("assistant"):
+            # 「社内問い合わせ」モードでは、回答を生成され次第チャット欄に表示する
+            if st.session_state.mode == ct.ANSWER_MODE_2:
+                try:
+                    with tracing.stage("render_stream"):
+                        content = cn.display_contact_llm_response_stream(utils.stream_llm_response(user_text))
+                except Exception:
+                    logger.exception("stream_llm_response failed; fallback to fixed list")
+                    utils.render_hr_list_fixed()
+                    st.error(utils.build_error_message(ct.GET_LLM_RESPONSE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
+                    st.stop()
+            else:
+                try:
+                    llm_response = utils.get_llm_response(user_text)
+                except Exception:
+                    logger.exception("get_llm_response failed; fallback to fixed list")
+                    utils.render_hr_list_fixed()
+                    st.error(utils.build_error_message(ct.GET_LLM_RESPONSE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
+                    st.stop()
+                content = cn.build_llm_response_content(st.session_state.mode, llm_response)
+
+            try:
+                content["keyword_hits"] = cn.build_keyword_hits(keyword_results)
+                with tracing.stage("render"):
+                    # 順次表示した回答・情報源は表示済みのため、全文検索の結果のみ表示する
+                    if st.session_state.mode == ct.ANSWER_MODE_2:
+                        cn.display_keyword_hits(content["keyword_hits"])
+                    else:
+                        cn.display_assistant_content(content)
+                logger.info({"message": content, "application_mode": st.session_state.mode})
+            except Exception as e:
+                tb_str = traceback.format_exc()
+                logger.error(f"{ct.DISP_ANSWER_ERROR_MESSAGE}\n{e}\n{tb_str}")
+                st.error(f"エラー詳細:\n{type(e).__name__}: {e}\n\n{tb_str}", icon=ct.ERROR_ICON)
+                st.stop()
+
+        # 10-4. 会話ログに追加
+        # 古い会話として簡易表示する際のMarkdownは、ここで1度だけ作成しておく
+        for message in [{"role": "user", "content": user_text}, {"role": "assistant", "content": content}]:
+            message["markdown"] = cn.build_message_markdown(message)
+            st.session_state.messages.append(message)
@@ -0,0 +1,545 @@
+"""
+このファイルは、大量のチャンクを少ないメモリで検索するための、int8量子化ベクターストアが記述されたファイルです。
+全チャンクとの類似度はint8に量子化したベクトルで概算し、上位の候補のみをfloat32のベクトルで計算し直して並べ替えます。
+ベクトルと本文はインデックスのフォルダ内のファイルに追記し、検索時はメモリマップして必要な部分だけを読み込みます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import mmap
+import time
+import shutil
+from typing import Any, Iterable, List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+import constants as ct
+from doc_store import DocumentStore, encode_metadata
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_vectors(vectors):
+    """
+    ベクトルを長さ1に正規化（内積がコサイン類似度になるようにする）
+
+    Args:
+        vectors: ベクトルの配列（1次元または2次元）
+
+    Returns:
+        正規化したfloat32のベクトルの配列
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def quantize_vectors(vectors):
+    """
+    ベクトルごとに最大の絶対値が127になるよう、int8に量子化
+
+    Args:
+        vectors: float32のベクトルの2次元配列
+
+    Returns:
+        int8の量子化コードの配列, ベクトルごとの倍率の配列
+    """
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def top_k_indices(scores, k):
+    """
+    スコアの高い上位k件の位置を、スコアの高い順に取得（部分ソートで全件の並べ替えを避ける）
+
+    Args:
+        scores: スコアの配列
+        k: 取得件数
+
+    Returns:
+        位置の配列
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def evaluate_recall(store, k=ct.RETRIEVER_TOP_K, sample_size=ct.QUANTIZED_RECALL_SAMPLE_SIZE, rerank_factor=None):
+    """
+    格納済みのベクトルを検索クエリとして、量子化による近似検索の上位k件が、全件の厳密な検索の上位k件をどれだけ含むか（recall@k）を計測
+    検索クエリにしたベクトル自身は必ず1位で見つかり計測値を押し上げるため、両方の検索結果から除いて比較する
+
+    Args:
+        store: 量子化ベクターストア
+        k: 比較する上位件数
+        sample_size: 検索クエリとして使うベクトル数
+        rerank_factor: 並べ替え直す候補数の倍率（Noneの場合はストアの設定値）
+
+    Returns:
+        計測結果の辞書
+    """
+    live_rows = store.live_rows()
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(live_rows, size=min(sample_size, len(live_rows)), replace=False)
+
+    hits = 0
+    approx_seconds = 0.0
+    exact_seconds = 0.0
+    for row in query_rows.tolist():
+        query = np.array(store.vectors[row], dtype=np.float32)
+
+        start_time = time.perf_counter()
+        approx_rows = store.search_rows(query, k + 1, rerank_factor=rerank_factor)
+        approx_seconds += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        exact_rows = store.exact_search_rows(query, k + 1)
+        exact_seconds += time.perf_counter() - start_time
+
+        approx_rows = approx_rows[approx_rows != row][:k]
+        exact_rows = exact_rows[exact_rows != row][:k]
+
+        hits += len(set(approx_rows.tolist()) & set(exact_rows.tolist()))
+
+    query_count = len(query_rows)
+    # 検索クエリ自身を除くため、比較できる件数は格納済みのベクトル数より1件少ない
+    compared_count = min(k, len(live_rows) - 1)
+    return {
+        "k": k,
+        "rerank_factor": rerank_factor or store.rerank_factor,
+        "vectors": len(live_rows),
+        "queries": query_count,
+        "recall_at_k": round(hits / (query_count * compared_count), 4) if query_count and compared_count > 0 else None,
+        "approx_ms_per_query": round(approx_seconds * 1000 / query_count, 3) if query_count else None,
+        "exact_ms_per_query": round(exact_seconds * 1000 / query_count, 3) if query_count else None
+    }
+
+
+def link_store_files(source_path, target_path):
+    """
+    前の世代の量子化ベクターストアのファイルを、新しい世代のフォルダに用意
+    - ベクトル・本文のファイルは追記しかしないため、複製せずハードリンクで共有する
+      （前の世代は自身のIDの件数分しか読み込まないため、新しい世代が末尾に追記しても影響を受けない）
+    - IDと削除済みの行のファイルは世代ごとに内容が異なるため複製する（チャンク1件あたり数十バイト）
+    - 中断した更新の追記分などで、ファイルが前の世代の件数より長い場合は、その件数分のみを複製する
+
+    Args:
+        source_path: 前の世代のインデックスのフォルダパス
+        target_path: 新しい世代のインデックスのフォルダパス
+    """
+    source_dir = os.path.join(source_path, ct.QUANTIZED_STORE_DIR)
+    if not os.path.isdir(source_dir):
+        return
+    target_dir = os.path.join(target_path, ct.QUANTIZED_STORE_DIR)
+    os.makedirs(target_dir, exist_ok=True)
+
+    for file_name in [ct.QUANTIZED_INFO_FILE, ct.QUANTIZED_IDS_FILE, ct.QUANTIZED_DELETED_FILE]:
+        if os.path.isfile(os.path.join(source_dir, file_name)):
+            shutil.copy2(os.path.join(source_dir, file_name), os.path.join(target_dir, file_name))
+
+    count = 0
+    if os.path.isfile(os.path.join(source_dir, ct.QUANTIZED_IDS_FILE)):
+        with open(os.path.join(source_dir, ct.QUANTIZED_IDS_FILE), encoding="utf8") as f:
+            count = sum(1 for _ in f)
+    dimension = 0
+    if os.path.isfile(os.path.join(source_dir, ct.QUANTIZED_INFO_FILE)):
+        with open(os.path.join(source_dir, ct.QUANTIZED_INFO_FILE), encoding="utf8") as f:
+            dimension = json.load(f)["dimension"]
+    offsets_size = (count * 2 + 1) * np.dtype(np.uint64).itemsize
+    with open(os.path.join(source_dir, ct.QUANTIZED_OFFSETS_FILE), "rb") as f:
+        f.seek(offsets_size - np.dtype(np.uint64).itemsize)
+        blob_size = int(np.frombuffer(f.read(np.dtype(np.uint64).itemsize), dtype=np.uint64)[0])
+
+    # 前の世代の件数から求めた、追記対象のファイルごとのサイズ
+    file_sizes = {
+        ct.QUANTIZED_CODES_FILE: count * dimension,
+        ct.QUANTIZED_SCALES_FILE: count * np.dtype(np.float32).itemsize,
+        ct.QUANTIZED_VECTORS_FILE: count * dimension * np.dtype(np.float32).itemsize,
+        ct.QUANTIZED_BLOB_FILE: blob_size,
+        ct.QUANTIZED_OFFSETS_FILE: offsets_size
+    }
+    for file_name, size in file_sizes.items():
+        source_file = os.path.join(source_dir, file_name)
+        target_file = os.path.join(target_dir, file_name)
+        if not os.path.isfile(source_file):
+            continue
+        if os.path.getsize(source_file) == size:
+            try:
+                os.link(source_file, target_file)
+                continue
+            except OSError:
+                # ハードリンクを作成できないファイルシステムでは複製する
+                pass
+        with open(source_file, "rb") as src, open(target_file, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+            dst.truncate(size)
+
+
+############################################################
+# クラス定義
+############################################################
+
+class QuantizedVectorStore(VectorStore):
+    """
+    int8量子化ベクトルによる概算と、float32ベクトルによる並べ替えで検索するベクターストア
+    - 追加したチャンクはファイルの末尾に追記し、削除したチャンクは削除済みの印を付けて検索対象から外す
+    - 量子化コードはfloat32の1/4のサイズで、検索時に全件を走査するのはこの量子化コードのみ
+    - float32のベクトルは、並べ替え対象の候補の行だけがディスクから読み込まれる
+    """
+
+    def __init__(self, embedding_function, persist_directory, rerank_factor=ct.QUANTIZED_RERANK_FACTOR):
+        """
+        Args:
+            embedding_function: 埋め込みモデル
+            persist_directory: インデックスのフォルダパス
+            rerank_factor: 最終的に返す件数に対する、float32のベクトルで並べ替え直す候補数の倍率
+        """
+        self._embedding_function = embedding_function
+        self.directory = os.path.join(persist_directory, ct.QUANTIZED_STORE_DIR)
+        self.rerank_factor = rerank_factor
+        os.makedirs(self.directory, exist_ok=True)
+
+        # 本文の区切り位置は、先頭に0を置いた状態から追記していく
+        offsets_path = self._path(ct.QUANTIZED_OFFSETS_FILE)
+        if not os.path.isfile(offsets_path):
+            with open(offsets_path, "wb") as f:
+                f.write(np.zeros(1, dtype=np.uint64).tobytes())
+        self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def __len__(self):
+        return len(self.ids) - len(self.deleted_rows)
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def _load(self):
+        """
+        ファイルに保存済みのIDと削除済みの行を読み込む（ベクトルと本文は、検索・取得時にメモリマップする）
+        """
+        info_path = self._path(ct.QUANTIZED_INFO_FILE)
+        self.dimension = None
+        if os.path.isfile(info_path):
+            with open(info_path, encoding="utf8") as f:
+                self.dimension = json.load(f)["dimension"]
+
+        self.ids = []
+        ids_path = self._path(ct.QUANTIZED_IDS_FILE)
+        if os.path.isfile(ids_path):
+            with open(ids_path, encoding="utf8") as f:
+                self.ids = [line.rstrip("\n") for line in f]
+        # 同じIDを追加し直した場合に備え、IDから最後に追加した行を引けるようにする
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+
+        self.deleted_rows = set()
+        deleted_path = self._path(ct.QUANTIZED_DELETED_FILE)
+        if os.path.isfile(deleted_path):
+            with open(deleted_path, encoding="utf8") as f:
+                self.deleted_rows = {int(line) for line in f if line.strip()}
+        self._mapped = False
+
+    def _ensure_mapped(self):
+        """
+        ベクトルと本文を、現在の件数でメモリマップし直す（追加・削除後の最初の検索・取得時に1度だけ行う）
+        大量のチャンクを追加する間は、バッチごとにメモリマップし直さない
+        """
+        if self._mapped:
+            return
+
+        count = len(self.ids)
+        self.deleted_mask = np.zeros(count, dtype=bool)
+        self.deleted_mask[[row for row in self.deleted_rows if row < count]] = True
+        self._mapped = True
+
+        if count == 0 or self.dimension is None:
+            self.codes = np.empty((0, self.dimension or 0), dtype=np.int8)
+            self.scales = np.empty(0, dtype=np.float32)
+            self.vectors = np.empty((0, self.dimension or 0), dtype=np.float32)
+            self.offsets = np.zeros(1, dtype=np.uint64)
+            self.blob = b""
+            self.documents = DocumentStore(self.blob, self.offsets)
+            return
+        self.codes = np.memmap(self._path(ct.QUANTIZED_CODES_FILE), dtype=np.int8, mode="r", shape=(count, self.dimension))
+        self.scales = np.memmap(self._path(ct.QUANTIZED_SCALES_FILE), dtype=np.float32, mode="r", shape=(count,))
+        self.vectors = np.memmap(self._path(ct.QUANTIZED_VECTORS_FILE), dtype=np.float32, mode="r", shape=(count, self.dimension))
+        self.offsets = np.memmap(self._path(ct.QUANTIZED_OFFSETS_FILE), dtype=np.uint64, mode="r", shape=(count * 2 + 1,))
+        with open(self._path(ct.QUANTIZED_BLOB_FILE), "rb") as f:
+            self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b""
+        self.documents = DocumentStore(self.blob, self.offsets)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        """
+        テキストを埋め込み、量子化したベクトルと本文をファイルに追記
+
+        Args:
+            texts: 追加するテキスト
+            metadatas: テキストごとのメタデータ
+            ids: テキストごとのID
+
+        Returns:
+            追加したチャンクのIDのリスト
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [f"{len(self.ids) + i}" for i in range(len(texts))]
+
+        vectors = normalize_vectors(self._embedding_function.embed_documents(texts))
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+            with open(self._path(ct.QUANTIZED_INFO_FILE), "w", encoding="utf8") as f:
+                json.dump({"dimension": self.dimension}, f)
+        codes, scales = quantize_vectors(vectors)
+
+        # 同じIDがすでにあれば、古い行は削除済みとして扱う
+        replaced = [self.rows[chunk_id] for chunk_id in ids if chunk_id in self.rows]
+        if replaced:
+            self._mark_deleted(replaced)
+
+        offsets = []
+        blob_path = self._path(ct.QUANTIZED_BLOB_FILE)
+        position = os.path.getsize(blob_path) if os.path.isfile(blob_path) else 0
+        with open(blob_path, "ab") as f:
+            for text, metadata in zip(texts, metadatas):
+                for data in (text.encode("utf-8"), encode_metadata(metadata)):
+                    f.write(data)
+                    position += len(data)
+                    offsets.append(position)
+        with open(self._path(ct.QUANTIZED_OFFSETS_FILE), "ab") as f:
+            f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        with open(self._path(ct.QUANTIZED_CODES_FILE), "ab") as f:
+            f.write(codes.tobytes())
+        with open(self._path(ct.QUANTIZED_SCALES_FILE), "ab") as f:
+            f.write(scales.tobytes())
+        with open(self._path(ct.QUANTIZED_VECTORS_FILE), "ab") as f:
+            f.write(vectors.tobytes())
+        # IDは最後に追記し、途中で異常終了しても読み込み時の件数がベクトルの件数を超えないようにする
+        with open(self._path(ct.QUANTIZED_IDS_FILE), "a", encoding="utf8") as f:
+            f.writelines(f"{chunk_id}\n" for chunk_id in ids)
+
+        # ファイルを読み込み直さず、追加した分だけ手元の一覧を更新する
+        first_row = len(self.ids)
+        self.ids.extend(ids)
+        self.rows.update((chunk_id, first_row + i) for i, chunk_id in enumerate(ids))
+        self._mapped = False
+        return list(ids)
+
+    def _mark_deleted(self, rows):
+        with open(self._path(ct.QUANTIZED_DELETED_FILE), "a", encoding="utf8") as f:
+            f.writelines(f"{row}\n" for row in rows)
+        self.deleted_rows.update(rows)
+        self._mapped = False
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """
+        指定のIDのチャンクに削除済みの印を付け、検索対象から外す
+
+        Args:
+            ids: 削除するチャンクのIDのリスト
+
+        Returns:
+            削除を実施した場合はTrue
+        """
+        rows = [self.rows[chunk_id] for chunk_id in ids or [] if chunk_id in self.rows]
+        rows = [row for row in rows if row not in self.deleted_rows]
+        if rows:
+            self._mark_deleted(rows)
+        return True
+
+    def compact(self):
+        """
+        削除済みの行を取り除いたファイルを書き出し、元のファイルと置き換える
+        （置き換えは新しいファイルへの差し替えで行うため、同じファイルを参照している他の世代には影響しない）
+
+        Returns:
+            削除済みの行があり、ファイルを置き換えた場合はTrue
+        """
+        if not self.deleted_rows:
+            return False
+        rows = self.live_rows()
+        file_names = [
+            ct.QUANTIZED_CODES_FILE, ct.QUANTIZED_SCALES_FILE, ct.QUANTIZED_VECTORS_FILE,
+            ct.QUANTIZED_BLOB_FILE, ct.QUANTIZED_OFFSETS_FILE, ct.QUANTIZED_IDS_FILE
+        ]
+        temp_paths = {file_name: f"{self._path(file_name)}.tmp" for file_name in file_names}
+        files = {file_name: open(path, "wb") for file_name, path in temp_paths.items()}
+        try:
+            files[ct.QUANTIZED_OFFSETS_FILE].write(np.zeros(1, dtype=np.uint64).tobytes())
+            position = 0
+            for start in range(0, len(rows), ct.QUANTIZED_SEARCH_BLOCK_SIZE):
+                block = rows[start:start + ct.QUANTIZED_SEARCH_BLOCK_SIZE]
+                files[ct.QUANTIZED_CODES_FILE].write(np.ascontiguousarray(self.codes[block]).tobytes())
+                files[ct.QUANTIZED_SCALES_FILE].write(np.ascontiguousarray(self.scales[block]).tobytes())
+                files[ct.QUANTIZED_VECTORS_FILE].write(np.ascontiguousarray(self.vectors[block]).tobytes())
+
+                # 本文とメタデータは、行ごとの区切り位置をずらしながら、元のバイト列をそのまま書き写す
+                offsets = []
+                for row in block.tolist():
+                    start_position, middle_position, end_position = (int(value) for value in self.offsets[row * 2:row * 2 + 3])
+                    files[ct.QUANTIZED_BLOB_FILE].write(self.blob[start_position:end_position])
+                    offsets.append(position + middle_position - start_position)
+                    position += end_position - start_position
+                    offsets.append(position)
+                files[ct.QUANTIZED_OFFSETS_FILE].write(np.asarray(offsets, dtype=np.uint64).tobytes())
+                files[ct.QUANTIZED_IDS_FILE].write("".join(f"{self.ids[row]}\n" for row in block.tolist()).encode("utf8"))
+        finally:
+            for f in files.values():
+                f.close()
+
+        # IDのファイルを最後に置き換え、途中で異常終了しても読み込み時の件数がベクトルの件数を超えないようにする
+        for file_name in file_names:
+            os.replace(temp_paths[file_name], self._path(file_name))
+        os.remove(self._path(ct.QUANTIZED_DELETED_FILE))
+        self._load()
+        return True
+
+    def live_rows(self):
+        """
+        削除されていない行の番号の配列を取得
+        """
+        self._ensure_mapped()
+        return np.flatnonzero(~self.deleted_mask)
+
+    def get(self, include=None, limit=None, offset=None, **kwargs):
+        """
+        格納済みのチャンクを、追加した順に取得（Chromaの「get」と同じ形式で返す）
+
+        Args:
+            include: 取得する項目（「documents」「metadatas」）
+            limit: 最大取得件数
+            offset: 取得を開始する位置
+
+        Returns:
+            「ids」「documents」「metadatas」のリストの辞書
+        """
+        include = include or ["documents", "metadatas"]
+        rows = self.live_rows()
+        start = offset or 0
+        rows = rows[start:start + limit] if limit is not None else rows[start:]
+        return {
+            "ids": [self.ids[row] for row in rows.tolist()],
+            "documents": [self.documents.text(row) for row in rows.tolist()] if "documents" in include else None,
+            "metadatas": [self.documents.metadata(row) for row in rows.tolist()] if "metadatas" in include else None
+        }
+
+    def search_rows(self, query_vector, k, rerank_factor=None):
+        """
+        量子化コードで全件との類似度を概算し、上位の候補をfloat32のベクトルで並べ替えて上位k件の行を取得
+
+        Args:
+            query_vector: 長さ1に正規化した検索クエリのベクトル
+            k: 取得件数
+            rerank_factor: 並べ替え直す候補数の倍率（Noneの場合は設定値）
+
+        Returns:
+            行の番号の配列（類似度の高い順）
+        """
+        self._ensure_mapped()
+        count = len(self.ids)
+        if count == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64)
+        candidate_count = k * (rerank_factor or self.rerank_factor)
+
+        # 一時的なfloat32の配列が大きくなり過ぎないよう、一定件数ずつ計算し、各ブロックの上位候補のみを残す
+        candidate_rows = []
+        candidate_scores = []
+        for start in range(0, count, ct.QUANTIZED_SEARCH_BLOCK_SIZE):
+            end = min(start + ct.QUANTIZED_SEARCH_BLOCK_SIZE, count)
+            scores = (self.codes[start:end].astype(np.float32) @ query_vector) * self.scales[start:end]
+            scores[self.deleted_mask[start:end]] = -np.inf
+            top = top_k_indices(scores, candidate_count)
+            candidate_rows.append(top + start)
+            candidate_scores.append(scores[top])
+        candidate_rows = np.concatenate(candidate_rows)
+        candidate_scores = np.concatenate(candidate_scores)
+        candidate_rows = candidate_rows[top_k_indices(candidate_scores, candidate_count)]
+        candidate_rows = candidate_rows[~self.deleted_mask[candidate_rows]]
+
+        # 候補の行のみ、float32のベクトルで類似度を計算し直す（行番号順に読むことでディスクの読み込みを連続させる）
+        candidate_rows = np.sort(candidate_rows)
+        exact_scores = self.vectors[candidate_rows] @ query_vector
+        return candidate_rows[top_k_indices(exact_scores, k)]
+
+    def exact_search_rows(self, query_vector, k):
+        """
+        float32のベクトルで全件との類似度を計算し、上位k件の行を取得（recall@kの計測用）
+
+        Args:
+            query_vector: 長さ1に正規化した検索クエリのベクトル
+            k: 取得件数
+
+        Returns:
+            行の番号の配列（類似度の高い順）
+        """
+        self._ensure_mapped()
+        count = len(self.ids)
+        if count == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, ct.QUANTIZED_SEARCH_BLOCK_SIZE):
+            end = min(start + ct.QUANTIZED_SEARCH_BLOCK_SIZE, count)
+            scores[start:end] = self.vectors[start:end] @ query_vector
+        scores[self.deleted_mask] = -np.inf
+        return top_k_indices(scores, min(k, len(self)))
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        """
+        検索クエリと類似度の高いチャンクを取得
+
+        Args:
+            query: 検索クエリ
+            k: 取得件数
+
+        Returns:
+            ドキュメントのリスト（類似度の高い順）
+        """
+        query_vector = normalize_vectors(self._embedding_function.embed_query(query))
+        rows = self.search_rows(query_vector, k)
+        return [self.documents[row] for row in rows.tolist()]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Any,
+        metadatas: Optional[List[dict]] = None,
+        persist_directory: Optional[str] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> "QuantizedVectorStore":
+        """
+        テキストを埋め込み、指定のフォルダに量子化ベクターストアを作成
+
+        Args:
+            texts: 追加するテキスト
+            embedding: 埋め込みモデル
+            metadatas: テキストごとのメタデータ
+            persist_directory: インデックスのフォルダパス
+            ids: テキストごとのID
+
+        Returns:
+            量子化ベクターストア
+        """
+        store = cls(embedding_function=embedding, persist_directory=persist_directory)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
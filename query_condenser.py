@@ -0,0 +1,192 @@
+"""
+このファイルは、会話履歴を踏まえて質問文を検索用の独立した質問文に書き換える処理が記述されたファイルです。
+書き換えが不要な質問ではLLMを呼び出さず、同じ会話・質問の書き換え結果は使い回します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+import constants as ct
+import tracing
+
+
+############################################################
+# 関数定義
+############################################################
+
+def is_standalone_question(question):
+    """
+    会話履歴がなくても意味が通る質問かどうかを判定
+    （前の会話を指す語を含む質問や、短すぎる質問は書き換えが必要とみなす）
+
+    Args:
+        question: ユーザー入力値
+
+    Returns:
+        書き換えが不要であればTrue
+    """
+    text = question.strip()
+    if len(text) < ct.QUERY_CONDENSE_MIN_STANDALONE_LENGTH:
+        return False
+    return not any(term in text for term in ct.QUERY_CONDENSE_ANAPHORA_TERMS)
+
+
+def get_history_hash(chat_history):
+    """
+    会話履歴の内容からハッシュ値を作成（書き換え結果のキャッシュのキーに使う）
+
+    Args:
+        chat_history: 会話履歴のメッセージのリスト
+
+    Returns:
+        ハッシュ値
+    """
+    sha256 = hashlib.sha256()
+    for message in chat_history:
+        sha256.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+    return sha256.hexdigest()
+
+
+def heuristic_rewrite(question, chat_history):
+    """
+    LLMを使わずに、直前のユーザーの質問と連結して検索用の質問文を作成
+
+    Args:
+        question: ユーザー入力値
+        chat_history: 会話履歴のメッセージのリスト
+
+    Returns:
+        検索用の質問文
+    """
+    for message in reversed(chat_history):
+        if message.type == "human":
+            return f"{message.content} {question}"
+    return question
+
+
+############################################################
+# クラス定義
+############################################################
+
+class QueryCondenser:
+    """
+    会話履歴を踏まえて、質問文を検索用の独立した質問文に書き換えるクラス
+    モードごとに1つ作成し、LLMの呼び出しを省略できた回数をモードごとに集計する
+    """
+
+    def __init__(self, llm, mode, cache_size=ct.QUERY_CONDENSE_CACHE_SIZE, use_llm=ct.QUERY_CONDENSE_USE_LLM):
+        """
+        Args:
+            llm: 書き換えに使うLLM
+            mode: モード（「社内文書検索」or「社内問い合わせ」）
+            cache_size: 書き換え結果を保持する件数
+            use_llm: Falseの場合、LLMを使わず簡易な書き換えのみを行う
+        """
+        self.mode = mode
+        self.cache_size = cache_size
+        self.use_llm = use_llm
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", ct.SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}")
+        ])
+        # 計測時に回答生成のLLM呼び出しと区別できるよう、タグを付ける
+        self.chain = (prompt | llm | StrOutputParser()).with_config(tags=[ct.TRACE_QUERY_REWRITE_TAG])
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # 書き換え方法ごとの件数
+        # - 「llm_calls」: LLMで書き換えた件数
+        # - 「no_history」: 会話履歴がないため書き換えなかった件数
+        # - 「standalone」: 単独で意味が通る質問のため書き換えなかった件数
+        # - 「cache_hits」: 過去の書き換え結果を使い回した件数
+        # - 「heuristic」: LLMを使わず簡易な書き換えを行った件数
+        self.counts = {"llm_calls": 0, "no_history": 0, "standalone": 0, "cache_hits": 0, "heuristic": 0}
+
+    @property
+    def stats(self):
+        """
+        書き換え方法ごとの件数と、LLMの呼び出しを省略できた件数
+        """
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "mode": self.mode,
+            **counts,
+            "avoided_llm_calls": counts["no_history"] + counts["standalone"] + counts["cache_hits"] + counts["heuristic"]
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def condense(self, question, chat_history):
+        """
+        検索に使う質問文を取得
+
+        Args:
+            question: ユーザー入力値
+            chat_history: 会話履歴のメッセージのリスト
+
+        Returns:
+            検索用の質問文
+        """
+        with tracing.stage("query_rewrite"):
+            return self._condense(question, chat_history)
+
+    def _condense(self, question, chat_history):
+        """
+        検索に使う質問文を取得（書き換え方法を判定し、書き換え方法ごとの件数を集計）
+        """
+        if not chat_history:
+            self._count("no_history")
+            return question
+        if is_standalone_question(question):
+            self._count("standalone")
+            return question
+
+        # 書き換えには直近の会話のみを使う（キャッシュのキーも直近の会話で作成する）
+        recent_history = list(chat_history[-ct.QUERY_CONDENSE_HISTORY_MESSAGES:])
+        key = (get_history_hash(recent_history), question)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.counts["cache_hits"] += 1
+                return self._cache[key]
+
+        if not self.use_llm:
+            self._count("heuristic")
+            return heuristic_rewrite(question, recent_history)
+
+        try:
+            condensed = self.chain.invoke({"input": question, "chat_history": recent_history}).strip()
+        except Exception:
+            # 書き換えに失敗しても回答は続けられるよう、簡易な書き換えで代替する
+            logging.getLogger(ct.LOGGER_NAME).exception("質問文の書き換えに失敗したため、簡易な書き換えで代替します。")
+            self._count("heuristic")
+            return heuristic_rewrite(question, recent_history)
+        self._count("llm_calls")
+        condensed = condensed or question
+
+        with self._lock:
+            self._cache[key] = condensed
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return condensed
+
+    def condense_inputs(self, inputs):
+        """
+        Chainの入力値（「input」「chat_history」）から、検索用の質問文を取得
+
+        Args:
+            inputs: Chainの入力値
+
+        Returns:
+            検索用の質問文
+        """
+        return self.condense(inputs["input"], inputs.get("chat_history") or [])
@@ -0,0 +1,105 @@
+"""
+このファイルは、LLMのクライアントと、モードごとのRAGのChainを組み立てる処理が記述されたファイルです。
+組み立てたChainは入力値に依存しないため、プロセス内で1度だけ作成して全セッションで使い回します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import httpx
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda
+from langchain_openai import ChatOpenAI
+from langchain.chains import create_retrieval_chain
+from langchain.chains.combine_documents import create_stuff_documents_chain
+import constants as ct
+from query_condenser import QueryCondenser
+from context_packer import pack_documents
+
+
+############################################################
+# 関数定義
+############################################################
+
+def create_http_client():
+    """
+    LLMのAPIとの通信に使う、接続を使い回すHTTPクライアントを作成
+
+    Returns:
+        HTTPクライアント
+    """
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=ct.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=ct.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS
+        ),
+        timeout=ct.LLM_HTTP_TIMEOUT
+    )
+
+
+def create_chat_model(http_client=None):
+    """
+    回答生成に使うLLMを作成
+    環境変数「APP_FAKE_LLM」に「1」が指定されている場合は、APIを呼び出さない疑似LLMを作成
+
+    Args:
+        http_client: 通信に使うHTTPクライアント（Noneの場合はLLMごとに作成される）
+
+    Returns:
+        LLM
+    """
+    if os.getenv(ct.FAKE_LLM_ENV_NAME) == "1":
+        return FakeListChatModel(responses=[ct.FAKE_LLM_RESPONSE], sleep=ct.FAKE_LLM_SLEEP)
+    return ChatOpenAI(model=ct.MODEL, temperature=ct.TEMPERATURE, http_client=http_client)
+
+
+def get_answer_system_prompt(mode):
+    """
+    モードに応じた、回答生成用のシステムプロンプトを取得
+
+    Args:
+        mode: モード（「社内文書検索」or「社内問い合わせ」）
+
+    Returns:
+        システムプロンプト
+    """
+    if mode == ct.ANSWER_MODE_1:
+        return ct.SYSTEM_PROMPT_DOC_SEARCH
+    return ct.SYSTEM_PROMPT_INQUIRY
+
+
+def build_rag_chain(mode, retriever, llm, query_condenser=None):
+    """
+    会話履歴を踏まえて検索し、検索結果をもとに回答するRAGのChainを作成
+    ユーザー入力値と会話履歴は、Chainの実行時に「input」「chat_history」として渡す
+    （streamで実行した場合、検索が終わった時点で「context」が、続いて「answer」が1トークンずつ返る）
+
+    Args:
+        mode: モード（「社内文書検索」or「社内問い合わせ」）
+        retriever: 検索に使うRetriever
+        llm: LLM
+        query_condenser: 検索用の質問文への書き換えを行うオブジェクト（Noneの場合は作成する）
+
+    Returns:
+        RAGのChain
+    """
+    if query_condenser is None:
+        query_condenser = QueryCondenser(llm, mode)
+
+    # モードごとに異なる、回答生成用のプロンプトテンプレート
+    question_answer_prompt = ChatPromptTemplate.from_messages([
+        ("system", get_answer_system_prompt(mode)),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}")
+    ])
+
+    # 会話履歴なしでも理解できる質問文に書き換えてから検索（書き換えが不要な場合はLLMを呼び出さない）し、
+    # 取得したチャンクは重複を除いてトークン数の上限内に詰め直してからLLMに渡す
+    history_aware_retriever = (
+        RunnableLambda(query_condenser.condense_inputs) | retriever | RunnableLambda(pack_documents)
+    ).with_config(run_name="history_aware_retriever")
+    question_answer_chain = create_stuff_documents_chain(llm, question_answer_prompt)
+
+    return create_retrieval_chain(history_aware_retriever, question_answer_chain)
@@ -0,0 +1,325 @@
+"""
+このファイルは、社員名簿をメモリ上の表として保持し、名簿に関する質問をLLMを使わずに絞り込み・集計で回答するための処理が記述されたファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_query_text(text):
+    """
+    質問文と名簿の値を照合するため、全角英数字・記号を半角に揃える
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        正規化後のテキスト
+    """
+    return unicodedata.normalize("NFKC", text)
+
+
+def split_multi_value(value):
+    """
+    「, 」区切りで複数の値を持つセルを、値のリストに分割
+
+    Args:
+        value: セルの値
+
+    Returns:
+        値のリスト
+    """
+    if value is None or pd.isna(value):
+        return []
+    return [item.strip() for item in str(value).split(",") if item.strip()]
+
+
+def parse_age_range(question):
+    """
+    「30代」「40歳以上」などの表現から、年齢の範囲を読み取る
+
+    Args:
+        question: 正規化済みの質問文
+
+    Returns:
+        年齢の下限と上限の組（読み取れない場合はNone）
+    """
+    match = re.search(r"(\d+)代", question)
+    if match:
+        lower = int(match.group(1))
+        return (lower, lower + 9)
+    match = re.search(r"(\d+)歳(以上|以下|未満|より上|より下)", question)
+    if match:
+        age = int(match.group(1))
+        return {
+            "以上": (age, None),
+            "以下": (None, age),
+            "未満": (None, age - 1),
+            "より上": (age + 1, None),
+            "より下": (None, age - 1)
+        }[match.group(2)]
+    return None
+
+
+def parse_group_column(question):
+    """
+    「部署ごと」「役職別」などの表現から、集計する列を読み取る
+
+    Args:
+        question: 正規化済みの質問文
+
+    Returns:
+        集計する列名（集計の質問でない場合はNone）
+    """
+    for column, aliases in ct.ROSTER_GROUP_ALIASES.items():
+        for alias in aliases:
+            if any(f"{alias}{suffix}" in question for suffix in ct.ROSTER_GROUP_SUFFIXES):
+                return column
+    return None
+
+
+def format_markdown_table(df):
+    """
+    表をMarkdown形式のテキストに変換
+
+    Args:
+        df: 変換する表
+
+    Returns:
+        Markdown形式の表
+    """
+    def cell(value):
+        if value is None or pd.isna(value):
+            return ""
+        return str(value).replace("|", "\\|").replace("\n", " ")
+
+    lines = [
+        "| " + " | ".join(cell(column) for column in df.columns) + " |",
+        "| " + " | ".join("---" for _ in df.columns) + " |"
+    ]
+    for row in df.itertuples(index=False):
+        lines.append("| " + " | ".join(cell(value) for value in row) + " |")
+    return "\n".join(lines)
+
+
+def parse_roster_query(question, roster):
+    """
+    質問文から、社員名簿の絞り込み・集計の条件を読み取る
+
+    Args:
+        question: ユーザー入力値
+        roster: 社員名簿
+
+    Returns:
+        名簿への質問の条件（名簿への質問と判定できない場合はNone）
+    """
+    text = normalize_query_text(question)
+
+    # 長い値から順に照合し、照合済みの箇所は伏せることで、
+    # 「プロジェクトマネージャ」（資格）の一部を「マネージャー」（役職）と誤って読み取らないようにする
+    conditions = {}
+    for value, columns in roster.vocabulary:
+        start = text.find(value)
+        if start == -1:
+            continue
+        text = text[:start] + "\0" * len(value) + text[start + len(value):]
+        conditions.setdefault(tuple(columns), []).append(value)
+
+    # 一覧・人数を求める語は、名簿の値を伏せた後の質問文から探す
+    # （「正社員の福利厚生」「人事部の社員の育児休業制度」などの制度についての質問は、RAGで回答する）
+    count_only = any(keyword in text for keyword in ct.ROSTER_COUNT_KEYWORDS)
+    if not count_only and not any(keyword in text for keyword in ct.ROSTER_LIST_KEYWORDS):
+        return None
+
+    age_range = parse_age_range(text)
+    group_by = parse_group_column(text)
+    if not conditions and age_range is None and group_by is None:
+        return None
+
+    return RosterQuery(
+        conditions=conditions,
+        age_range=age_range,
+        group_by=group_by,
+        count_only=count_only
+    )
+
+
+def describe_conditions(query):
+    """
+    絞り込み条件を、回答に表示する文字列に変換
+
+    Args:
+        query: 名簿への質問の条件
+
+    Returns:
+        条件の説明文
+    """
+    descriptions = [
+        f"{'または'.join(columns)}: {'または'.join(values)}" for columns, values in query.conditions.items()
+    ]
+    if query.age_range is not None:
+        lower, upper = query.age_range
+        descriptions.append(f"年齢: {'' if lower is None else lower}〜{'' if upper is None else upper}歳")
+    return "、".join(descriptions) if descriptions else "全社員"
+
+
+def answer_roster_question(question, roster):
+    """
+    社員名簿への質問であれば、名簿の絞り込み・集計結果から回答を作成
+
+    Args:
+        question: ユーザー入力値
+        roster: 社員名簿（読み込めていない場合はNone）
+
+    Returns:
+        LLMからの回答と同じ形式の辞書（名簿への質問でない場合はNone）
+    """
+    if roster is None:
+        return None
+    query = parse_roster_query(question, roster)
+    if query is None:
+        return None
+
+    df = roster.select(query.conditions, query.age_range)
+    condition_text = describe_conditions(query)
+
+    if query.group_by is not None:
+        counts = df[query.group_by].value_counts().rename_axis(query.group_by).reset_index(name="人数")
+        answer = "\n\n".join([
+            f"社員名簿から、条件（{condition_text}）に一致する従業員を{query.group_by}ごとに集計しました（合計{len(df)}名）。",
+            format_markdown_table(counts)
+        ])
+    elif df.empty:
+        answer = f"社員名簿に、条件（{condition_text}）に一致する従業員はいませんでした。"
+    elif query.count_only:
+        answer = f"社員名簿で、条件（{condition_text}）に一致する従業員は{len(df)}名です。"
+    else:
+        answer = "\n\n".join([
+            f"社員名簿から、条件（{condition_text}）に一致する従業員を抽出しました（{len(df)}名）。",
+            format_markdown_table(df[ct.ROSTER_DISPLAY_COLUMNS])
+        ])
+
+    # 画面表示の処理を共通化するため、参照元には抽出した行をまとめた1件のドキュメントを渡す
+    context = [Document(
+        page_content=df.to_csv(index=False),
+        metadata={"source": roster.source}
+    )]
+    return {"input": question, "answer": answer, "context": context}
+
+
+############################################################
+# クラス定義
+############################################################
+
+class RosterQuery(NamedTuple):
+    """
+    社員名簿への質問の条件
+    - 「conditions」: 列名の組ごとの絞り込み値のリスト（同じ組の値はいずれか、異なる組はすべてに一致）
+    - 「age_range」: 年齢の下限と上限の組（指定がない側はNone）
+    - 「group_by」: 集計する列名
+    - 「count_only」: 件数のみを回答するかどうか
+    """
+    conditions: Dict[Tuple[str, ...], List[str]]
+    age_range: Optional[Tuple[Optional[int], Optional[int]]]
+    group_by: Optional[str]
+    count_only: bool
+
+
+class EmployeeRoster:
+    """
+    社員名簿を列ごとに型付けした表として保持し、
+    部署・役職・従業員区分・スキルなどの値ごとに、該当する行番号の配列を事前に作成しておく
+    """
+
+    def __init__(self, df, source=ct.ROSTER_FILE_PATH):
+        """
+        Args:
+            df: 社員名簿の表
+            source: 社員名簿のファイルパス
+        """
+        self.df = df.reset_index(drop=True)
+        self.source = source
+
+        # 列ごとに「値→行番号の配列（昇順）」を作成
+        self.indexes = {}
+        for column in ct.ROSTER_INDEXED_COLUMNS:
+            groups = self.df.groupby(column, sort=False, dropna=True).indices
+            self.indexes[column] = {str(value): np.asarray(rows, dtype=np.int64) for value, rows in groups.items()}
+        for column in ct.ROSTER_MULTI_VALUE_COLUMNS:
+            rows_by_value = {}
+            for row, cell in enumerate(self.df[column].tolist()):
+                for value in split_multi_value(cell):
+                    rows_by_value.setdefault(value, []).append(row)
+            self.indexes[column] = {value: np.asarray(rows, dtype=np.int64) for value, rows in rows_by_value.items()}
+
+        # 質問文との照合用に、正規化した値と元の値の対応を作成（長い値から照合する）
+        self.vocabulary_values = {}
+        columns_by_value = {}
+        for column, index in self.indexes.items():
+            for value in index:
+                normalized = normalize_query_text(value)
+                self.vocabulary_values[(column, normalized)] = value
+                columns_by_value.setdefault(normalized, []).append(column)
+        self.vocabulary = sorted(columns_by_value.items(), key=lambda item: -len(item[0]))
+
+    @classmethod
+    def from_csv(cls, path=ct.ROSTER_FILE_PATH):
+        """
+        CSVファイルから社員名簿を読み込む
+
+        Args:
+            path: 社員名簿のファイルパス
+
+        Returns:
+            社員名簿
+        """
+        df = pd.read_csv(path, encoding="utf-8", dtype_backend="pyarrow")
+        for column in ct.ROSTER_DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column], errors="coerce").astype("date32[pyarrow]")
+        return cls(df, source=path)
+
+    def __len__(self):
+        return len(self.df)
+
+    def select(self, conditions, age_range=None):
+        """
+        条件に一致する行を抽出
+
+        Args:
+            conditions: 列名の組ごとの絞り込み値のリスト（同じ組の値はいずれか、異なる組はすべてに一致）
+            age_range: 年齢の下限と上限の組
+
+        Returns:
+            条件に一致する行の表（名簿の並び順）
+        """
+        rows = np.arange(len(self.df))
+        for columns, values in conditions.items():
+            # 同じ値が複数の列にある場合（「インターン」など）は、いずれかの列に一致すればよい
+            value_rows = [
+                self.indexes[column][self.vocabulary_values[(column, value)]]
+                for column in columns for value in values
+                if (column, value) in self.vocabulary_values
+            ]
+            rows = np.intersect1d(rows, np.concatenate(value_rows)) if value_rows else rows[:0]
+
+        df = self.df.iloc[rows]
+        if age_range is not None:
+            lower, upper = age_range
+            if lower is not None:
+                df = df[df["年齢"] >= lower]
+            if upper is not None:
+                df = df[df["年齢"] <= upper]
+        return df
@@ -0,0 +1,20 @@
+"""
+テストの共通設定が記述されたファイルです。
+アプリのモジュールはリポジトリ直下に置かれているため、テストからも同じ名前で読み込めるようにします。
+"""
+
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+# Chroma が要求するバージョンの SQLite を使うため、利用可能であれば pysqlite3 を sqlite3 として使う（main.py と同様）
+try:
+    sys.modules["sqlite3"] = __import__("pysqlite3")
+except ImportError:
+    pass
+# テスト用の疑似サーバーなど、テストのフォルダ内のモジュールも読み込めるようにする
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if TESTS_DIR not in sys.path:
+    sys.path.insert(0, TESTS_DIR)
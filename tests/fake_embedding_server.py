@@ -0,0 +1,142 @@
+"""
+このファイルは、OpenAI互換の埋め込みAPIを模した、テスト用のローカルの疑似サーバーが記述されたファイルです。
+テキストのハッシュ値から常に同じベクトルを返し、指定した回数だけレート制限（429）を返します。
+
+使い方:
+    python tests/fake_embedding_server.py --port 8765 --rate-limit 3
+    （埋め込みモデルの base_url に「http://127.0.0.1:8765/v1」を指定する）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import asyncio
+import hashlib
+import argparse
+import threading
+from aiohttp import web
+
+
+############################################################
+# 関数定義
+############################################################
+
+def fake_vector(text, size=8):
+    """
+    テキストのハッシュ値から、常に同じ埋め込みベクトルを作成
+
+    Args:
+        text: 埋め込み対象のテキスト
+        size: ベクトルの次元数
+
+    Returns:
+        埋め込みベクトル
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [b / 255 for b in digest[:size]]
+
+
+############################################################
+# クラス定義
+############################################################
+
+class FakeEmbeddingServer:
+    """
+    別スレッドで起動する、OpenAI互換の埋め込みAPIの疑似サーバー
+    受け付けたバッチ・レート制限の回数・接続元のポートを記録する
+    """
+
+    def __init__(self, rate_limit_count=0, retry_after=0.01, port=0):
+        """
+        Args:
+            rate_limit_count: 最初の何回のリクエストにレート制限（429）を返すか
+            retry_after: 429に付ける「retry-after」ヘッダーの秒数
+            port: 待ち受けるポート番号（0の場合は空いているポート）
+        """
+        self.rate_limit_count = rate_limit_count
+        self.retry_after = retry_after
+        self.port = port
+        self.batches = []
+        self.rate_limited = 0
+        self.peers = []
+        self._loop = None
+        self._runner = None
+        self._started = threading.Event()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def _embeddings(self, request):
+        body = await request.json()
+        self.peers.append(request.transport.get_extra_info("peername")[1])
+        if self.rate_limited < self.rate_limit_count:
+            self.rate_limited += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429, headers={"retry-after": str(self.retry_after)}
+            )
+
+        self.batches.append(list(body["input"]))
+        data = [
+            {"object": "embedding", "index": i, "embedding": fake_vector(text)}
+            for i, text in enumerate(body["input"])
+        ]
+        # 返す順序に依存しないことを確認できるよう、逆順で返す
+        return web.json_response({
+            "object": "list", "data": data[::-1], "model": body["model"],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        })
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post("/v1/embeddings", self._embeddings)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start())
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def start(self):
+        """
+        別スレッドで疑似サーバーを起動し、待ち受けを開始するまで待機
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        """
+        疑似サーバーを停止
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI互換の埋め込みAPIの疑似サーバー")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate-limit", type=int, default=0, help="最初に429を返すリクエスト数")
+    args = parser.parse_args()
+    server = FakeEmbeddingServer(rate_limit_count=args.rate_limit, port=args.port).start()
+    print(f"listening on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
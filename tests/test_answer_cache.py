@@ -0,0 +1,41 @@
+"""
+セッションをまたいで回答を使い回す、回答キャッシュのテストです。
+"""
+
+import constants as ct
+from answer_cache import AnswerCache
+
+
+def test_sessions_on_previous_generation_do_not_flush_newer_answers():
+    cache = AnswerCache(keep_generations=2)
+    cache.put("mode", "有給休暇の日数は？", "gen-1", "10日", [])
+    cache.put("mode", "有給休暇の日数は？", "gen-2", "12日", [])
+
+    # 切り替え前の世代を開いたままのセッションからの問い合わせで、新しい世代の回答は消えない
+    assert cache.get("mode", "有給休暇の日数は？", "gen-1").answer == "10日"
+    assert cache.get("mode", "有給休暇の日数は？", "gen-2").answer == "12日"
+
+
+def test_old_generations_are_retired():
+    cache = AnswerCache(keep_generations=2)
+    for generation in ["gen-1", "gen-2", "gen-3"]:
+        cache.put("mode", "質問", generation, generation, [])
+
+    assert cache.get("mode", "質問", "gen-1") is None
+    # 破棄済みの世代は、再び追加されても保持しない
+    cache.put("mode", "質問", "gen-1", "gen-1", [])
+    assert cache.get("mode", "質問", "gen-1") is None
+    assert cache.get("mode", "質問", "gen-3").answer == "gen-3"
+    assert cache.stats["generations"] == 2
+
+
+def test_retired_generations_are_bounded():
+    cache = AnswerCache(keep_generations=2)
+    # インデックスを更新するたびに世代が増えても、破棄済みの記録は一定数を超えない
+    for i in range(100):
+        cache.put("mode", "質問", f"gen-{i}", str(i), [])
+
+    assert len(cache._retired_generations) == 2 * ct.ANSWER_CACHE_RETIRED_GENERATIONS_FACTOR
+    assert cache.stats["generations"] == 2
+    assert cache.get("mode", "質問", "gen-99").answer == "99"
+    assert cache.get("mode", "質問", "gen-97") is None
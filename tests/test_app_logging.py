@@ -0,0 +1,61 @@
+"""
+キューを介したログ出力のテストです。
+"""
+
+import queue
+import logging
+from logging.handlers import QueueListener
+import app_logging
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def create_record(message):
+    return logging.makeLogRecord({"name": "test", "levelno": logging.INFO, "levelname": "INFO", "msg": message})
+
+
+def test_dropped_records_are_reported_periodically():
+    log_queue = queue.Queue(maxsize=2)
+    handler = app_logging.StructuredQueueHandler(log_queue, "test")
+    for i in range(5):
+        handler.handle(create_record(f"ログ{i}"))
+    assert handler.dropped == 3
+
+    # キューに空きが出ても、前回の報告から一定時間が経つまでは報告しない
+    log_queue.get_nowait()
+    handler.handle(create_record("ログ5"))
+    assert handler.dropped == 3
+
+    log_queue.get_nowait()
+    log_queue.get_nowait()
+    handler._last_reported -= app_logging.ct.LOG_DROP_REPORT_INTERVAL
+    handler.handle(create_record("ログ6"))
+    records = [log_queue.get_nowait(), log_queue.get_nowait()]
+    assert records[1].levelno == logging.WARNING
+    assert records[1].msg["dropped"] == 3
+    assert handler.dropped == 0
+
+
+def test_unreported_drops_are_written_on_stop():
+    log_queue = queue.Queue(maxsize=1)
+    handler = app_logging.StructuredQueueHandler(log_queue, "test")
+    handler.handle(create_record("ログ0"))
+    handler.handle(create_record("ログ1"))
+
+    recording_handler = RecordingHandler()
+    listener = QueueListener(log_queue, recording_handler)
+    listener.start()
+    app_logging.stop_listener(listener, handler)
+
+    assert [record.msg for record in recording_handler.records][0] == "ログ0"
+    assert recording_handler.records[-1].msg["dropped"] == 1
+    assert recording_handler.records[-1].levelname == "WARNING"
+    # JSONの1行として書き出せる
+    assert '"dropped": 1' in app_logging.JsonFormatter().format(recording_handler.records[-1])
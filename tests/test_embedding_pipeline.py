@@ -0,0 +1,62 @@
+"""
+トークン数単位のバッチで埋め込むパイプラインを、ローカルの疑似サーバーに対して実行するテストです。
+"""
+
+import pytest
+from embedding_pipeline import BatchedEmbeddings
+from fake_embedding_server import FakeEmbeddingServer, fake_vector
+
+
+@pytest.fixture
+def server():
+    with FakeEmbeddingServer() as server:
+        yield server
+
+
+def create_embeddings(server, **kwargs):
+    return BatchedEmbeddings(base_url=server.base_url, api_key="test", **kwargs)
+
+
+def test_embed_documents_splits_batches_and_keeps_order(server):
+    texts = [f"チャンク{i}" for i in range(10)]
+    vectors = create_embeddings(server, max_batch_size=4, max_concurrency=2).embed_documents(texts)
+
+    assert sorted(len(batch) for batch in server.batches) == [2, 4, 4]
+    assert vectors == [fake_vector(text) for text in texts]
+
+
+def test_texts_are_tokenized_once(server, monkeypatch):
+    texts = [f"チャンク{i}" for i in range(10)]
+    embeddings = create_embeddings(server, max_batch_size=4)
+    encoded = []
+    encode = embeddings.encoding.encode
+    monkeypatch.setattr(embeddings.encoding, "encode", lambda text, **kwargs: encoded.append(text) or encode(text, **kwargs))
+
+    embeddings.embed_documents(texts)
+    assert sorted(encoded) == sorted(texts)
+
+
+def test_rate_limited_batches_are_retried():
+    with FakeEmbeddingServer(rate_limit_count=3) as server:
+        texts = [f"チャンク{i}" for i in range(6)]
+        vectors = create_embeddings(server, max_batch_size=2, max_retries=5).embed_documents(texts)
+
+    assert server.rate_limited == 3
+    assert vectors == [fake_vector(text) for text in texts]
+
+
+def test_rate_limited_query_is_retried():
+    with FakeEmbeddingServer(rate_limit_count=2) as server:
+        vector = create_embeddings(server, max_retries=5).embed_query("有給休暇の日数")
+
+    assert server.rate_limited == 2
+    assert vector == fake_vector("有給休暇の日数")
+
+
+def test_queries_reuse_one_connection(server):
+    embeddings = create_embeddings(server)
+    for question in ["有給休暇の日数", "経費精算の期限", "育児休業の申請"]:
+        assert embeddings.embed_query(question) == fake_vector(question)
+
+    # 検索クエリごとにクライアント・接続を作り直さない
+    assert len(set(server.peers)) == 1
@@ -0,0 +1,89 @@
+"""
+インデックスの世代ごとの更新処理のテストです。
+"""
+
+import os
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+import constants as ct
+import index_store
+
+
+@pytest.fixture
+def quantized_index(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    monkeypatch.setattr(ct, "RAG_TOP_FOLDER_PATH", str(data_dir))
+    monkeypatch.setattr(ct, "INDEX_ROOT_DIR", str(tmp_path / "index"))
+    monkeypatch.setattr(ct, "VECTOR_STORE_BACKEND", ct.VECTOR_STORE_BACKEND_QUANTIZED)
+    # 少数のチャンクでの更新でも、削除済みの行を取り除かずに追記させる
+    monkeypatch.setattr(ct, "QUANTIZED_COMPACT_DELETED_RATIO", 1.0)
+    return data_dir
+
+
+def test_incremental_update_shares_append_only_files(quantized_index):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    (quantized_index / "a.txt").write_text("有給休暇は入社半年後に10日付与されます。", encoding="utf8")
+    (quantized_index / "b.txt").write_text("通勤手当は月額上限5万円です。", encoding="utf8")
+    os.makedirs(ct.INDEX_ROOT_DIR)
+    index_store.update_index(embeddings, refresh_web=False)
+    old_path = index_store.get_current_index_path()
+
+    (quantized_index / "b.txt").write_text("通勤手当は月額上限3万円です。", encoding="utf8")
+    db, stats = index_store.update_index(embeddings, refresh_web=False)
+    new_path = index_store.get_current_index_path()
+    assert stats["updated"] == 1
+
+    # 追記しかしないファイルは複製せず、前の世代と共有する
+    old_codes = os.path.join(old_path, ct.QUANTIZED_STORE_DIR, ct.QUANTIZED_CODES_FILE)
+    new_codes = os.path.join(new_path, ct.QUANTIZED_STORE_DIR, ct.QUANTIZED_CODES_FILE)
+    assert os.path.samefile(old_codes, new_codes)
+
+    # 前の世代は、新しい世代の追記・削除の影響を受けない
+    old_texts = sorted(index_store.open_index(embeddings, old_path).get()["documents"])
+    new_texts = sorted(db.get()["documents"])
+    assert any("5万円" in text for text in old_texts)
+    assert not any("3万円" in text for text in old_texts)
+    assert any("3万円" in text for text in new_texts)
+    assert not any("5万円" in text for text in new_texts)
+
+
+def test_interrupted_appends_are_not_shared(quantized_index):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    (quantized_index / "a.txt").write_text("有給休暇は入社半年後に10日付与されます。", encoding="utf8")
+    os.makedirs(ct.INDEX_ROOT_DIR)
+    index_store.update_index(embeddings, refresh_web=False)
+    old_path = index_store.get_current_index_path()
+    old_codes = os.path.join(old_path, ct.QUANTIZED_STORE_DIR, ct.QUANTIZED_CODES_FILE)
+    # 中断した更新が、共有中のファイルの末尾に追記した状態
+    with open(old_codes, "ab") as f:
+        f.write(b"\0" * 32)
+
+    (quantized_index / "b.txt").write_text("通勤手当は月額上限5万円です。", encoding="utf8")
+    db, _ = index_store.update_index(embeddings, refresh_web=False)
+    new_codes = os.path.join(index_store.get_current_index_path(), ct.QUANTIZED_STORE_DIR, ct.QUANTIZED_CODES_FILE)
+    assert not os.path.samefile(old_codes, new_codes)
+    assert os.path.getsize(new_codes) == 32 * len(db.ids)
+    assert len(db.similarity_search("通勤手当", k=2)) == 2
+
+
+def test_changed_paths_limit_rehashing(quantized_index, monkeypatch):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        (quantized_index / name).write_text(f"{name}の内容です。", encoding="utf8")
+    os.makedirs(ct.INDEX_ROOT_DIR)
+    index_store.update_index(embeddings, refresh_web=False)
+
+    (quantized_index / "b.txt").write_text("b.txtの新しい内容です。", encoding="utf8")
+    (quantized_index / "c.txt").unlink()
+    hashed_paths = []
+    compute_file_hash = index_store.data_loader.compute_file_hash
+    monkeypatch.setattr(index_store.data_loader, "compute_file_hash", lambda path: hashed_paths.append(path) or compute_file_hash(path))
+    monkeypatch.setattr(index_store.data_loader, "list_source_files", lambda path=None: pytest.fail("scanned the whole folder"))
+
+    changed_paths = [os.path.join(ct.RAG_TOP_FOLDER_PATH, name) for name in ["b.txt", "c.txt"]]
+    db, stats = index_store.update_index(embeddings, refresh_web=False, changed_paths=changed_paths)
+
+    assert hashed_paths == [changed_paths[0]]
+    assert (stats["updated"], stats["removed"], stats["unchanged"]) == (1, 1, 1)
+    assert sorted(db.get()["documents"]) == ["a.txtの内容です。", "b.txtの新しい内容です。"]
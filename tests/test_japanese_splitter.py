@@ -0,0 +1,70 @@
+"""
+日本語のチャンク分割処理のテストです。
+"""
+
+import os
+import fitz
+import pytest
+from langchain_core.documents import Document
+import constants as ct
+import context_packer
+import japanese_splitter
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "会社について", "株主優待について.pdf")
+
+
+def test_join_wrapped_lines_keeps_headings_and_bullets():
+    text = "株主優待制度の概要\n1. 株主優待の対象者\n●​ 基準日: 毎年3月31日\n○​ 対象商品: ベーシックTシャツ、サステナブルバッグな\nど。\n2. 優待内容"
+    lines = japanese_splitter.join_wrapped_lines(text).split("\n")
+
+    assert "1. 株主優待の対象者" in lines
+    assert "●​ 基準日: 毎年3月31日" in lines
+    assert "○​ 対象商品: ベーシックTシャツ、サステナブルバッグなど。" in lines
+    assert "2. 優待内容" in lines
+
+
+def test_join_wrapped_lines_ignores_trailing_spaces():
+    assert japanese_splitter.join_wrapped_lines("概要です。 \n次の文") == "概要です。\n次の文"
+
+
+@pytest.mark.skipif(not os.path.isfile(PDF_PATH), reason="同梱のPDFがありません")
+def test_bundled_pdf_headings_survive():
+    with fitz.open(PDF_PATH) as pdf:
+        text = japanese_splitter.join_wrapped_lines(pdf[0].get_text())
+
+    headings = [section.heading for section in japanese_splitter.split_sections(text)]
+    assert "1. 株主優待の対象者" in headings
+    assert "2. 優待内容" in headings
+    # 箇条書きの項目は、見出しにも前の行への連結にもならない
+    assert not any(heading.startswith(("●", "○")) for heading in headings if heading)
+    assert "株主優待制度の概要1." not in text
+
+
+def test_split_documents_attaches_heading_to_chunks():
+    splitter = japanese_splitter.JapaneseTextSplitter(chunk_size=ct.CHUNK_SIZE, chunk_overlap=ct.CHUNK_OVERLAP)
+    text = "1. 株主優待の対象者\n基準日時点の株主様が対象です。\n2. 優待内容\n商品引換券を贈呈します。"
+    chunks = splitter.split_text(text)
+
+    assert chunks
+    assert chunks[0].startswith("1. 株主優待の対象者")
+
+
+def test_merged_chunks_of_headed_section_have_no_duplicates():
+    heading = "3. 休暇制度"
+    sentences = [f"第{i}項の休暇について定める文です。" for i in range(12)]
+    doc = Document(page_content="\n".join([heading] + sentences), metadata={"source": "規程.docx"})
+    tokens = japanese_splitter.count_tokens(sentences[0])
+    splitter = japanese_splitter.JapaneseTextSplitter(chunk_size=tokens * 5, chunk_overlap=tokens * 2)
+
+    chunks = splitter.split_documents([doc])
+    assert len(chunks) > 2
+    # 区切った後のチャンクは、見出しと直前の文を引き継いでいる
+    assert chunks[1].page_content.startswith(heading)
+    assert chunks[1].metadata["overlap_chars"] > chunks[1].metadata["overlap_heading_chars"] > 0
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["chunk_id"] = f"規程-{i}"
+
+    merged = context_packer.merge_adjacent_chunks(chunks)
+    assert len(merged) == 1
+    lines = merged[0].page_content.split("\n")
+    assert lines == [heading] + sentences
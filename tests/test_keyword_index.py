@@ -0,0 +1,21 @@
+"""
+全文検索用の転置インデックスのテストです。
+"""
+
+import warnings
+from langchain_core.documents import Document
+from doc_store import DocumentStore
+from keyword_index import KeywordIndex
+
+
+def test_bm25_search_with_only_empty_documents():
+    index = KeywordIndex(DocumentStore.from_documents([
+        Document(page_content="", metadata={"source": "scan1.pdf"}),
+        Document(page_content="", metadata={"source": "scan2.pdf"})
+    ]))
+    assert index.avg_doc_length == 0
+
+    # 0で割った警告やNaNのスコアが出ない
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert index.bm25_search("有給休暇 EMP0001") == []
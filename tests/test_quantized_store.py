@@ -0,0 +1,64 @@
+"""
+int8量子化ベクターストアのテストです。
+"""
+
+import os
+import numpy as np
+from langchain_community.embeddings import DeterministicFakeEmbedding
+import constants as ct
+import quantized_store
+from quantized_store import QuantizedVectorStore
+
+
+def create_store(path):
+    return QuantizedVectorStore(embedding_function=DeterministicFakeEmbedding(size=32), persist_directory=str(path))
+
+
+def test_batches_are_added_without_reloading(tmp_path, monkeypatch):
+    store = create_store(tmp_path)
+    # 追加のたびにファイルを読み込み直さない
+    monkeypatch.setattr(store, "_load", lambda: (_ for _ in ()).throw(AssertionError("reloaded")))
+    for batch in range(5):
+        store.add_texts([f"文書{batch}-{i}" for i in range(10)], ids=[f"{batch}-{i}" for i in range(10)])
+    store.add_texts(["差し替え後"], ids=["0-0"])
+    store.delete(ids=["1-1"])
+
+    assert len(store) == 49
+    assert store.similarity_search("差し替え後", k=1)[0].page_content == "差し替え後"
+    monkeypatch.undo()
+
+    # 開き直しても同じ内容を読み込める
+    reopened = create_store(tmp_path)
+    assert reopened.get() == store.get()
+
+
+def test_compact_removes_deleted_rows(tmp_path):
+    store = create_store(tmp_path)
+    store.add_texts([f"文書{i}" for i in range(20)], metadatas=[{"source": f"{i}.txt"} for i in range(20)], ids=[str(i) for i in range(20)])
+    store.delete(ids=[str(i) for i in range(0, 20, 2)])
+    expected = store.get()
+
+    assert store.compact()
+    assert store.get() == expected
+    assert len(store.ids) == 10
+    assert not os.path.exists(store._path(ct.QUANTIZED_DELETED_FILE))
+    assert os.path.getsize(store._path(ct.QUANTIZED_CODES_FILE)) == 10 * 32
+
+    reopened = create_store(tmp_path)
+    assert reopened.get() == expected
+    query = np.array(reopened.vectors[3], dtype=np.float32)
+    assert reopened.search_rows(query, 1).tolist() == [3]
+    assert not reopened.compact()
+
+
+def test_evaluate_recall_excludes_query_row(tmp_path, monkeypatch):
+    store = create_store(tmp_path)
+    store.add_texts([f"文書{i}" for i in range(10)], ids=[str(i) for i in range(10)])
+    # 近似検索は検索クエリ自身しか正しく返せない状態にする
+    monkeypatch.setattr(store, "search_rows", lambda query, k, rerank_factor=None: np.array(
+        [int(np.argmax(store.vectors @ query))] + [-1] * (k - 1)
+    ))
+
+    result = quantized_store.evaluate_recall(store, k=1, sample_size=5)
+    assert result["recall_at_k"] == 0
+    assert result["queries"] == 5
@@ -0,0 +1,41 @@
+"""
+社員名簿への質問を、絞り込み・集計で回答する処理のテストです。
+"""
+
+import pytest
+import roster
+from roster import EmployeeRoster
+
+
+@pytest.fixture(scope="module")
+def employee_roster():
+    return EmployeeRoster.from_csv()
+
+
+@pytest.mark.parametrize("question", [
+    "正社員の福利厚生について教えて",
+    "契約社員の就業規則は？",
+    "人事部の社員の育児休業制度",
+    "スタッフの服装規定を教えて",
+    "Pythonが得意な社員向けの研修制度はありますか"
+])
+def test_policy_questions_are_not_answered_from_roster(employee_roster, question):
+    assert roster.parse_roster_query(question, employee_roster) is None
+    assert roster.answer_roster_question(question, employee_roster) is None
+
+
+def test_list_question(employee_roster):
+    response = roster.answer_roster_question("人事部の従業員一覧", employee_roster)
+    assert response is not None
+    df = employee_roster.df
+    expected_count = int((df["部署"] == "人事部").sum())
+    assert f"（{expected_count}名）" in response["answer"]
+
+
+def test_count_and_group_questions(employee_roster):
+    query = roster.parse_roster_query("正社員は何人いますか", employee_roster)
+    assert query.count_only
+    assert list(query.conditions.values()) == [["正社員"]]
+
+    query = roster.parse_roster_query("部署ごとの人数を教えて", employee_roster)
+    assert query.group_by == "部署"
@@ -0,0 +1,58 @@
+"""
+「社内問い合わせ」モードで、回答を生成され次第順次表示する処理のテストです。
+"""
+
+from streamlit.testing.v1 import AppTest
+
+
+def stream_contact_answer():
+    import streamlit as st
+    from langchain_core.documents import Document
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from langchain_core.runnables import RunnableLambda
+    import constants as ct
+    import components
+    import rag_chain
+    import utils
+    from conversation_memory import ConversationMemory
+    from query_condenser import QueryCondenser
+
+    documents = [
+        Document(page_content="有給休暇は入社半年後に10日付与されます。", metadata={"source": "./data/規程.pdf", "page": 2}),
+        Document(page_content="有給休暇の申請は3日前までに行います。", metadata={"source": "./data/規程.pdf", "page": 3}),
+        Document(page_content="有給休暇の取得は上長が承認します。", metadata={"source": "./data/手順.docx"})
+    ]
+    # 疑似LLMは回答を1文字ずつ返す
+    llm = FakeListChatModel(responses=["入社半年後に10日付与されます。"])
+    retriever = RunnableLambda(lambda query: documents)
+    st.session_state.mode = ct.ANSWER_MODE_2
+    st.session_state.chat_history = ConversationMemory()
+    st.session_state.rag_chains = {ct.ANSWER_MODE_2: rag_chain.build_rag_chain(ct.ANSWER_MODE_2, retriever, llm)}
+    st.session_state.query_condensers = {ct.ANSWER_MODE_2: QueryCondenser(llm, ct.ANSWER_MODE_2)}
+
+    chunks = []
+
+    def response_stream():
+        for chunk in utils.stream_llm_response("有給休暇は何日もらえますか？"):
+            chunks.append(chunk)
+            yield chunk
+
+    st.session_state.content = components.display_contact_llm_response_stream(response_stream())
+    st.session_state.answer_chunks = sum(1 for chunk in chunks if "answer" in chunk)
+
+
+def test_contact_answer_is_streamed_with_sources():
+    at = AppTest.from_function(stream_contact_answer).run()
+
+    assert not at.exception
+    content = at.session_state["content"]
+    assert content["answer"] == "入社半年後に10日付与されます。"
+    assert content["message"] == "情報源"
+    # 同じファイルの情報源は1つにまとめる
+    assert content["file_info_list"] == ["./data/規程.pdf（ページNo.3）", "./data/手順.docx"]
+    assert "入社半年後に10日付与されます。" in [markdown.value for markdown in at.markdown]
+    assert "./data/手順.docx" in [info.value for info in at.info]
+    # 回答はまとめてではなく、複数回に分けて返される
+    assert at.session_state["answer_chunks"] > 1
+    # 回答をすべて返し終えた時点で、会話履歴に追加される
+    assert len(at.session_state["chat_history"].turns) == 1
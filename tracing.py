@@ -0,0 +1,418 @@
+"""
+このファイルは、1回の質問（ターン）ごとに、処理段階ごとの所要時間とトークン数を計測・記録する処理が記述されたファイルです。
+計測結果は1ターン1行のJSONとしてログフォルダに出力し、OpenTelemetryのスパン・メトリクスとしても記録します。
+（OpenTelemetryの送信先は、環境変数「OTEL_EXPORTER_OTLP_ENDPOINT」を設定した場合のみ有効になります）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from uuid import uuid4
+from langchain_core.callbacks import BaseCallbackHandler
+import constants as ct
+import app_logging
+from conversation_memory import count_tokens
+
+# OpenTelemetryが利用できない環境でも、ファイルへの記録は行えるようにする
+try:
+    from opentelemetry import metrics, trace
+except ImportError:
+    metrics = None
+    trace = None
+
+
+############################################################
+# 設定関連
+############################################################
+# 計測中のターン（Chainの処理がスレッドをまたいでも、同じターンに記録されるようコンテキスト変数で保持）
+_current_turn = ContextVar("current_turn", default=None)
+_setup_lock = threading.Lock()
+_telemetry = None
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_current_turn():
+    """
+    計測中のターンを取得
+
+    Returns:
+        計測中のターン（計測中でなければNone）
+    """
+    return _current_turn.get()
+
+
+@contextmanager
+def stage(name):
+    """
+    計測中のターンについて、処理段階の所要時間を計測（計測中でなければ何もしない）
+
+    Args:
+        name: 処理段階の名前
+    """
+    turn = _current_turn.get()
+    if turn is None:
+        yield
+        return
+    with turn.stage(name):
+        yield
+
+
+def add_tokens(kind, tokens):
+    """
+    計測中のターンにトークン数を加算（計測中でなければ何もしない）
+
+    Args:
+        kind: トークン数の種類（「context」など）
+        tokens: トークン数
+    """
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.add_tokens(kind, tokens)
+
+
+def set_attribute(key, value):
+    """
+    計測中のターンに、回答方法などの付加情報を記録（計測中でなければ何もしない）
+
+    Args:
+        key: 項目名
+        value: 値
+    """
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.set_attribute(key, value)
+
+
+def get_callbacks():
+    """
+    Chainの実行時に渡す、LLMの呼び出しを計測するコールバックのリストを取得
+
+    Returns:
+        コールバックのリスト（計測中でなければ空のリスト）
+    """
+    turn = _current_turn.get()
+    return [TraceCallbackHandler(turn)] if turn is not None else []
+
+
+def create_trace_file_handler():
+    """
+    計測結果をログフォルダのファイルに書き込むハンドラーを作成
+
+    Returns:
+        ハンドラー
+    """
+    os.makedirs(ct.LOG_DIR_PATH, exist_ok=True)
+    handler = logging.FileHandler(os.path.join(ct.LOG_DIR_PATH, ct.TRACE_LOG_FILE), encoding="utf8")
+    # 集計ツールでそのまま読み込めるよう、1行に1つのJSONのみを出力する
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+def get_telemetry():
+    """
+    OpenTelemetryのトレーサー・メトリクスと、JSONの出力先のロガーを用意（プロセス内で1度だけ作成）
+
+    Returns:
+        トレーサー・メトリクス・ロガーの辞書
+    """
+    global _telemetry
+    with _setup_lock:
+        if _telemetry is not None:
+            return _telemetry
+
+        setup_otlp_exporter()
+
+        # アプリケーションのログと同様に、キューを介して専用のスレッドで書き込む
+        logger = app_logging.setup_queued_logger(ct.TRACE_LOGGER_NAME, create_trace_file_handler)
+        # アプリケーションのログには重複して出力しない
+        logger.propagate = False
+
+        telemetry = {"logger": logger, "tracer": None}
+        if trace is not None:
+            meter = metrics.get_meter(ct.TRACE_SERVICE_NAME)
+            telemetry.update({
+                "tracer": trace.get_tracer(ct.TRACE_SERVICE_NAME),
+                "turn_duration": meter.create_histogram(
+                    "chat.turn.duration", unit="ms", description="1ターン全体の所要時間"
+                ),
+                "stage_duration": meter.create_histogram(
+                    "chat.stage.duration", unit="ms", description="処理段階ごとの所要時間"
+                ),
+                "tokens": meter.create_counter(
+                    "chat.tokens", unit="{token}", description="種類ごとのトークン数"
+                )
+            })
+        _telemetry = telemetry
+        return _telemetry
+
+
+def setup_otlp_exporter():
+    """
+    環境変数で送信先が指定されている場合のみ、OpenTelemetryのスパン・メトリクスをOTLPで送信する設定を行う
+    （送信先のCollectorで、Prometheusなどから収集できる形式に変換する）
+    """
+    if trace is None or not os.getenv(ct.TRACE_OTLP_ENDPOINT_ENV_NAME):
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logging.getLogger(ct.LOGGER_NAME).warning("OpenTelemetryのSDKが見つからないため、計測結果は送信しません。")
+        return
+
+    # 送信先などの詳細な設定は、OpenTelemetryの標準の環境変数で行う
+    resource = Resource.create({"service.name": ct.TRACE_SERVICE_NAME})
+    tracer_provider = TracerProvider(resource=resource)
+    tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(tracer_provider)
+    metrics.set_meter_provider(MeterProvider(
+        resource=resource,
+        metric_readers=[PeriodicExportingMetricReader(
+            OTLPMetricExporter(), export_interval_millis=ct.TRACE_METRIC_EXPORT_INTERVAL_MS
+        )]
+    ))
+
+
+def start_turn(session_id, mode, question):
+    """
+    1ターン分の計測を開始（withブロックを抜けた時点で計測結果を記録する）
+
+    Args:
+        session_id: セッションID
+        mode: モード（「社内文書検索」or「社内問い合わせ」）
+        question: ユーザー入力値
+
+    Returns:
+        ターンの計測結果
+    """
+    return TurnTrace(session_id, mode, question)
+
+
+############################################################
+# クラス定義
+############################################################
+
+class TurnTrace:
+    """
+    1ターン分の計測結果
+    - 処理段階ごとの所要時間（同じ段階を複数回実行した場合は合計）と実行回数
+    - 種類ごとのトークン数（質問文・LLMへの入力・LLMの出力・参照元のチャンクなど）
+    - 回答方法（社員名簿・回答キャッシュ・RAG）などの付加情報
+    """
+
+    def __init__(self, session_id, mode, question):
+        """
+        Args:
+            session_id: セッションID
+            mode: モード（「社内文書検索」or「社内問い合わせ」）
+            question: ユーザー入力値
+        """
+        self.request_id = uuid4().hex
+        self.session_id = session_id
+        self.mode = mode
+        self.started_at = datetime.now(timezone.utc)
+        self.stages = {}
+        self.stage_counts = {}
+        self.tokens = {"question": count_tokens(question)}
+        self.attributes = {}
+        self._start_time = None
+        self._token = None
+        self._span = None
+        self._span_context = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        telemetry = get_telemetry()
+        if telemetry["tracer"] is not None:
+            self._span = telemetry["tracer"].start_span("chat_turn", attributes={
+                "request_id": self.request_id, "session_id": self.session_id, "mode": self.mode
+            })
+            self._span_context = trace.set_span_in_context(self._span)
+        self._token = _current_turn.set(self)
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 画面表示の中断（st.stop()）も、エラーとして記録する
+        status = "ok" if exc_type is None else "error"
+        self.finish(status, None if exc_type is None else exc_type.__name__)
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        処理段階の所要時間を計測
+
+        Args:
+            name: 処理段階の名前
+        """
+        span = None
+        if self._span is not None:
+            span = get_telemetry()["tracer"].start_span(name, context=self._span_context)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start_time)
+            if span is not None:
+                span.end()
+
+    def add_stage_time(self, name, seconds):
+        """
+        処理段階の所要時間を加算
+
+        Args:
+            name: 処理段階の名前
+            seconds: 所要時間（秒）
+        """
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+            self.stage_counts[name] = self.stage_counts.get(name, 0) + 1
+
+    def add_tokens(self, kind, tokens):
+        """
+        トークン数を加算
+
+        Args:
+            kind: トークン数の種類
+            tokens: トークン数
+        """
+        with self._lock:
+            self.tokens[kind] = self.tokens.get(kind, 0) + tokens
+
+    def set_attribute(self, key, value):
+        """
+        付加情報を記録
+
+        Args:
+            key: 項目名
+            value: 値
+        """
+        with self._lock:
+            self.attributes[key] = value
+
+    def to_record(self, status, error):
+        """
+        計測結果を、JSONとして出力する辞書に変換
+
+        Args:
+            status: 処理結果（「ok」or「error」）
+            error: エラーの種類
+
+        Returns:
+            計測結果の辞書
+        """
+        with self._lock:
+            return {
+                "type": "chat_turn",
+                "request_id": self.request_id,
+                "session_id": self.session_id,
+                "mode": self.mode,
+                "started_at": self.started_at.isoformat(),
+                "status": status,
+                "error": error,
+                "total_ms": round((time.perf_counter() - self._start_time) * 1000, 3),
+                "stages_ms": {name: round(ms, 3) for name, ms in self.stages.items()},
+                "stage_counts": dict(self.stage_counts),
+                "tokens": dict(self.tokens),
+                "attributes": dict(self.attributes)
+            }
+
+    def finish(self, status="ok", error=None):
+        """
+        計測を終了し、計測結果を記録
+
+        Args:
+            status: 処理結果（「ok」or「error」）
+            error: エラーの種類
+        """
+        _current_turn.reset(self._token)
+        record = self.to_record(status, error)
+        telemetry = get_telemetry()
+        telemetry["logger"].info(json.dumps(record, ensure_ascii=False))
+
+        if self._span is not None:
+            self._span.set_attribute("status", status)
+            for kind, tokens in record["tokens"].items():
+                self._span.set_attribute(f"tokens.{kind}", tokens)
+            self._span.end()
+        if telemetry["tracer"] is not None:
+            attributes = {"mode": self.mode, "status": status}
+            telemetry["turn_duration"].record(record["total_ms"], attributes)
+            for name, ms in record["stages_ms"].items():
+                telemetry["stage_duration"].record(ms, {**attributes, "stage": name})
+            for kind, tokens in record["tokens"].items():
+                telemetry["tokens"].add(tokens, {"mode": self.mode, "kind": kind})
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Chainの中でのLLMの呼び出しについて、所要時間・最初のトークンまでの時間・トークン数を計測するコールバック
+    質問文の書き換え（タグ「query_rewrite」）と、回答生成を区別して記録する
+    """
+
+    def __init__(self, turn):
+        """
+        Args:
+            turn: 記録先のターン
+        """
+        self.turn = turn
+        # 実行中のLLMの呼び出しごとの、処理段階の名前と開始時刻
+        self.runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        name = "query_rewrite_llm" if ct.TRACE_QUERY_REWRITE_TAG in (tags or []) else "generation"
+        self.runs[run_id] = (name, time.perf_counter(), False)
+        self.turn.add_tokens(f"{name}_prompt", sum(
+            count_tokens(message.content) for batch in messages for message in batch
+            if isinstance(message.content, str)
+        ))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        name = "query_rewrite_llm" if ct.TRACE_QUERY_REWRITE_TAG in (tags or []) else "generation"
+        self.runs[run_id] = (name, time.perf_counter(), False)
+        self.turn.add_tokens(f"{name}_prompt", sum(count_tokens(prompt) for prompt in prompts))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self.runs.get(run_id)
+        # 利用者の待ち時間の目安として、最初のトークンが届くまでの時間を記録
+        if run is not None and not run[2]:
+            name, start_time, _ = run
+            self.turn.add_stage_time(f"{name}_first_token", time.perf_counter() - start_time)
+            self.runs[run_id] = (name, start_time, True)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        name, start_time, _ = run
+        self.turn.add_stage_time(name, time.perf_counter() - start_time)
+        # APIから使用量が返された場合はその値を、返されない場合（ストリーミングなど）は出力から計測
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = sum(
+                count_tokens(generation.text) for generations in response.generations for generation in generations
+            )
+        self.turn.add_tokens(f"{name}_completion", completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self.runs.pop(run_id, None)
+        if run is not None:
+            self.turn.add_stage_time(run[0], time.perf_counter() - run[1])
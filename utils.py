@@ -1,42 +1,22 @@
-import glob
-import pandas as pd
 import streamlit as st
-def load_all_staff_csv():
-    dfs = []
-    for path in glob.glob("./data/社員について/*.csv"):
-        try:
-            df = pd.read_csv(path)
-            df["__source"] = path
-            dfs.append(df)
-        except Exception:
-            pass
-    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
-
 def render_hr_list_fixed():
-    df_all = load_all_staff_csv()
-    if df_all.empty:
+    """
+    LLMからの回答取得に失敗した場合に、社員名簿から人事部の従業員一覧を表示
+
+    Returns:
+        人事部の従業員の表（社員名簿を読み込めていない場合はNone）
+    """
+    employee_roster = st.session_state.get("roster")
+    if employee_roster is None:
         st.warning("社員名簿CSVを読み込めませんでした。パスや権限を確認してください。")
         return None
 
-    rename_map = {
+    # 読み込み済みの社員名簿の表から、部署の値ごとに作成済みの行番号で抽出する
+    df_hr = employee_roster.select({("部署",): ["人事部"]})
+    df_hr = df_hr[ct.ROSTER_DISPLAY_COLUMNS].rename(columns={
         "氏名（フルネーム）": "氏名",
         "メールアドレス": "メール",
-    }
-    df_all = df_all.rename(columns=rename_map)
-
-    candidates = [c for c in df_all.columns if "部署" in c]
-    dept_col = candidates[0] if candidates else None
-    if not dept_col:
-        st.warning("CSVに『部署』列が見つかりませんでした。列名をご確認ください。")
-        return None
-
-    df_hr = (
-        df_all[df_all[dept_col] == "人事部"]
-        .copy()
-    )
-
-    cols = [c for c in ["社員ID", "氏名", "部署", "役職", "メール", "__source"] if c in df_hr.columns]
-    df_hr = df_hr[cols].drop_duplicates()
+    })
 
     # st.write("### 人事部に所属している従業員一覧（フォールバック抽出）")
     if df_hr.empty:
@@ -60,25 +40,19 @@ def crash_report(label, fn):
         st.code(str(e))
         st.code("".join(traceback.format_exc()))
         raise
-from typing import List
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
-def search_documents_by_keyword(keyword, docs_all, max_results=10):
+def search_documents_by_keyword(keyword, keyword_index, max_results=10):
     """
     指定キーワードで全ドキュメントから部分一致検索し、ヒットしたものを返す
     Args:
-        keyword: 検索キーワード
-        docs_all: 全ドキュメントリスト（Document型）
+        keyword: 検索キーワード（スペース区切りで複数指定した場合はすべてを含むものを検索）
+        keyword_index: 全文検索用の転置インデックス
         max_results: 最大返却件数
     Returns:
-        ヒットしたDocumentのリスト
+        ヒット結果（KeywordHit型）のリスト（キーワードの出現回数が多い順）
     """
-    results = []
-    for doc in docs_all:
-        if keyword in doc.page_content:
-            results.append(doc)
-            if len(results) >= max_results:
-                break
-    return results
+    if keyword_index is None:
+        return []
+    return keyword_index.search(keyword, max_results=max_results)
 """
 このファイルは、画面表示以外の様々な関数定義のファイルです。
 """
@@ -87,14 +61,14 @@ def search_documents_by_keyword(keyword, docs_all, max_results=10):
 # ライブラリの読み込み
 ############################################################
 import os
+import logging
 from dotenv import load_dotenv
 import streamlit as st
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage
-from langchain_openai import ChatOpenAI
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
 import constants as ct
+import roster
+import tracing
+from query_condenser import is_standalone_question
+from conversation_memory import ConversationMemory
 
 
 ############################################################
@@ -140,141 +114,204 @@ def build_error_message(message):
     return "\n".join([message, ct.COMMON_ERROR_MESSAGE])
 
 
-def get_llm_response(chat_message):
-    def get_chat_history_from_session() -> List[BaseMessage]:
-        raw_hist = st.session_state.get("chat_history", [])
-        hist: List[BaseMessage] = []
-        for role, content in raw_hist:
-            if role == "user":
-                hist.append(HumanMessage(content=content))
-            else:
-                hist.append(AIMessage(content=content))
-        return hist
-
-    chat_history = get_chat_history_from_session()
-    # st.write(f"chat_history len: {len(chat_history)}")
-    # st.write(f"chat_history sample: {chat_history[:2]}")
+def get_chat_history():
     """
-    LLMからの回答取得
+    LLMとのやりとり用の会話履歴を、LangChainのメッセージ形式で取得
+    （古い会話は要約にまとめ、直近の会話のみを原文のまま返す）
+
+    Returns:
+        会話履歴のメッセージのリスト
+    """
+    memory = st.session_state.get("chat_history")
+    if memory is None:
+        return []
+    return memory.messages
+
+
+def add_chat_history(chat_message, answer):
+    """
+    ユーザー入力値と回答を、LLMとのやりとり用の会話履歴に追加
+
+    Args:
+        chat_message: ユーザー入力値
+        answer: 回答
+    """
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = ConversationMemory()
+    st.session_state.chat_history.add(chat_message, answer)
+
+
+def add_history_tokens():
+    """
+    LLMに渡す会話履歴（要約を含む）のトークン数を、計測中のターンに記録
+    """
+    memory = st.session_state.chat_history
+    tracing.add_tokens("history", memory.turn_tokens + memory.summary_tokens)
+
+
+def get_rag_chain():
+    """
+    現在のモードのRAGのChainを取得（プロセス内で作成済みのものを使い、ここでは作成しない）
+
+    Returns:
+        RAGのChain
+    """
+    if st.session_state.mode == ct.ANSWER_MODE_1:
+        return st.session_state.rag_chains[ct.ANSWER_MODE_1]
+    return st.session_state.rag_chains[ct.ANSWER_MODE_2]
+
+
+def get_cached_answer(chat_message, chat_history):
+    """
+    他のセッションも含め、過去に同じ（または十分に近い）質問へ回答済みであれば、その回答を取得
+    （会話の流れに依存する質問は、回答が異なりうるため対象外とする）
 
     Args:
         chat_message: ユーザー入力値
+        chat_history: 会話履歴のメッセージのリスト
 
     Returns:
-        LLMからの回答
+        LLMからの回答と同じ形式の辞書（キャッシュにない場合はNone）
     """
-    # st.write("[get_llm_response] start")
-    # st.write("get_llm_response called")
-    # st.write("before llm init")
-    llm = ChatOpenAI(model_name=ct.MODEL, temperature=ct.TEMPERATURE)
-    # st.write("after llm init")
-    # st.write("checkpoint: after llm init")
-
-    # 会話履歴なしでもLLMに理解してもらえる、独立した入力テキストを取得するためのプロンプトテンプレートを作成
-    # LangChain公式推奨の配線でプロンプトを作成
-    from langchain_core.prompts import ChatPromptTemplate
-    question_generator_prompt = crash_report(
-        "question_generator_prompt",
-        lambda: ChatPromptTemplate.from_messages([
-            ("system", ct.SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT),
-            ("human", "履歴: {chat_history}\n質問: {input}\n人事関連の同義語も考慮して検索クエリを作成してください。")
-        ])
+    answer_cache = st.session_state.get("answer_cache")
+    if answer_cache is None or (chat_history and not is_standalone_question(chat_message)):
+        return None
+    entry = answer_cache.get(st.session_state.mode, chat_message, st.session_state.index_path)
+    if entry is None:
+        return None
+    return {"input": chat_message, "answer": entry.answer, "context": entry.context}
+
+
+def put_cached_answer(chat_message, chat_history, llm_response):
+    """
+    回答を、他のセッションでも使い回せるようキャッシュに追加
+    （会話履歴を使って作成した回答は、そのセッションの会話の内容を含みうるため、他のセッションには使い回さない）
+
+    Args:
+        chat_message: ユーザー入力値
+        chat_history: 回答時に使った会話履歴のメッセージのリスト
+        llm_response: LLMからの回答
+    """
+    answer_cache = st.session_state.get("answer_cache")
+    if answer_cache is None or chat_history:
+        return
+    answer_cache.put(
+        st.session_state.mode, chat_message, st.session_state.index_path,
+        llm_response["answer"], llm_response["context"]
     )
+
+
+def log_query_condenser_stats():
+    """
+    現在のモードで、質問文の書き換えにLLMを呼び出した件数と省略できた件数をログに記録
+    """
     if st.session_state.mode == ct.ANSWER_MODE_1:
-        question_answer_template = ct.SYSTEM_PROMPT_DOC_SEARCH
+        condenser = st.session_state.query_condensers[ct.ANSWER_MODE_1]
     else:
-        question_answer_template = ct.SYSTEM_PROMPT_INQUIRY
-    question_answer_prompt = crash_report(
-        "question_answer_prompt",
-        lambda: ChatPromptTemplate.from_messages([
-            ("system", question_answer_template),
-            ("human", "履歴: {chat_history}\n質問: {input}")
-        ])
-    )
+        condenser = st.session_state.query_condensers[ct.ANSWER_MODE_2]
+    logging.getLogger(ct.LOGGER_NAME).info({"message": "質問文の書き換え状況", **condenser.stats})
 
-    # 会話履歴なしでもLLMに理解してもらえる、独立した入力テキストを取得するためのRetrieverを作成
-    # st.write("before history_aware_retriever init")
-    print("before history_aware_retriever init")
-    # st.write(f"llm is None: {llm is None}")
-    print(f"llm is None: {llm is None}")
-    try:
-    # st.write(f"retriever is None: {st.session_state.retriever is None}")
-        print(f"retriever is None: {st.session_state.retriever is None}")
-    except Exception as e:
-    # st.write(f"retrieverチェック例外: {e}")
-        print(f"retrieverチェック例外: {e}")
-    try:
-    # st.write(f"question_generator_prompt is None: {question_generator_prompt is None}")
-        print(f"question_generator_prompt is None: {question_generator_prompt is None}")
-    except Exception as e:
-    # st.write(f"promptチェック例外: {e}")
-        print(f"promptチェック例外: {e}")
-    # create_history_aware_retriever呼び出しを一時的にコメントアウト
-    # デバッグ出力はここまで、本処理を有効化
-    # st.write(f"retriever type: {type(st.session_state.retriever)}")
-    # st.write(f"retriever sample: {str(st.session_state.retriever)[:300]}")
-    # st.write(f"question_generator_prompt type: {type(question_generator_prompt)}")
-    # st.write(f"question_generator_prompt sample: {str(question_generator_prompt)[:300]}")
-    history_aware_retriever = create_history_aware_retriever(
-        llm, st.session_state.retriever, question_generator_prompt
-    )
-    # st.write("after history_aware_retriever init")
-
-    # --- LangChain公式推奨の配線 ---
-    from langchain_core.prompts import ChatPromptTemplate
-    llm = crash_report("llm init", lambda: ChatOpenAI(model="gpt-4o-mini", temperature=0))
-    question_generator_prompt = crash_report(
-        "question_generator_prompt",
-        lambda: ChatPromptTemplate.from_messages([
-            ("system", "あなたは検索クエリを改善するアシスタントです。"),
-            ("human", "履歴: {chat_history}\n質問: {input}\n人事関連の同義語も考慮して検索クエリを作成してください。")
-        ])
-    )
-    history_aware_retriever = crash_report(
-        "create_history_aware_retriever",
-        lambda: create_history_aware_retriever(llm=llm, retriever=st.session_state.retriever, prompt=question_generator_prompt)
-    )
-    answer_prompt = crash_report(
-        "answer_prompt",
-        lambda: ChatPromptTemplate.from_messages([
-            ("system",
-             "あなたは人事データ抽出ボットです。以下の制約でCSVのみを出力：\n"
-             "- 列: 社員ID, 氏名, 部署, 役職, メール\n"
-             "- 部署が『人事部』のレコードのみ\n"
-             "- ヘッダ1行 + データ行\n"
-             "- 補完しない（不明は空欄）"),
-            ("human", "質問: {input}\n参照コンテキスト:\n{context}")
-        ])
-    )
-    question_answer_chain = crash_report(
-        "create_stuff_documents_chain",
-        lambda: create_stuff_documents_chain(llm, answer_prompt)
-    )
-    rag_chain = crash_report(
-        "create_retrieval_chain",
-        lambda: create_retrieval_chain(history_aware_retriever, question_answer_chain)
-    )
 
-    # LLMへのリクエストとレスポンス取得
-    if 'DEBUG' in globals() and DEBUG:
-        st.write(f"chat_message: {chat_message}")
-        st.write(f"chat_history len: {len(chat_history)}")
-        st.write(f"chat_history sample: {chat_history[:2]}")
-        if hasattr(st.session_state, 'retriever') and hasattr(st.session_state.retriever, 'docs'):
-            st.write(f"context docs len: {len(st.session_state.retriever.docs)}")
-            st.write(f"context docs sample: {st.session_state.retriever.docs[:1]}")
-    import traceback
-    llm_response = crash_report(
-        "rag_chain.invoke",
-        lambda: rag_chain.invoke({"input": chat_message, "chat_history": chat_history})
-    )
-    if 'DEBUG' in globals() and DEBUG:
-        st.write(f"[get_llm_response] llm_response: {llm_response}")
-    # LLMレスポンスを会話履歴に追加（st.session_state.chat_historyはrole/content形式で管理）
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-    st.session_state.chat_history.append(("user", chat_message))
-    st.session_state.chat_history.append(("assistant", llm_response["answer"]))
-    if 'DEBUG' in globals() and DEBUG:
-        st.write("[get_llm_response] before return")
-    return llm_response
\ No newline at end of file
+def get_llm_response(chat_message):
+    """
+    LLMからの回答取得
+
+    Args:
+        chat_message: ユーザー入力値
+
+    Returns:
+        LLMからの回答
+    """
+    chat_history = get_chat_history()
+
+    # 社員名簿への質問（「人事部の従業員一覧」など）は、LLMを使わずに名簿の絞り込み・集計結果で回答
+    with tracing.stage("roster"):
+        roster_response = roster.answer_roster_question(chat_message, st.session_state.get("roster"))
+    if roster_response is not None:
+        tracing.set_attribute("answered_by", "roster")
+        add_chat_history(chat_message, roster_response["answer"])
+        return roster_response
+
+    # 過去に同じ質問へ回答済みであれば、検索・回答生成を行わずにその回答を使う
+    with tracing.stage("answer_cache"):
+        cached_response = get_cached_answer(chat_message, chat_history)
+    if cached_response is not None:
+        tracing.set_attribute("answered_by", "answer_cache")
+        add_chat_history(chat_message, cached_response["answer"])
+        return cached_response
+
+    # モードごとのChainはプロセス内で作成済みのものを使い、ここでは入力値と会話履歴のみを渡す
+    rag_chain = get_rag_chain()
+
+    # LLMへのリクエストとレスポンス取得（検索・質問文の書き換え・回答生成の所要時間はChainの中で計測）
+    tracing.set_attribute("answered_by", "rag")
+    add_history_tokens()
+    with tracing.stage("rag_chain"):
+        llm_response = crash_report(
+            "rag_chain.invoke",
+            lambda: rag_chain.invoke(
+                {"input": chat_message, "chat_history": chat_history},
+                config={"callbacks": tracing.get_callbacks()}
+            )
+        )
+    # LLMレスポンスを会話履歴に追加
+    add_chat_history(chat_message, llm_response["answer"])
+    put_cached_answer(chat_message, chat_history, llm_response)
+    log_query_condenser_stats()
+    return llm_response
+
+
+def stream_llm_response(chat_message):
+    """
+    LLMからの回答を、生成され次第順次取得
+    検索が終わった時点で「context」（参照元のドキュメント）を、続いて「answer」（回答）を1トークンずつ返す
+    回答をすべて返し終えた時点で、会話履歴に追加する
+
+    Args:
+        chat_message: ユーザー入力値
+
+    Yields:
+        「context」または「answer」のいずれかを持つ辞書
+    """
+    # 社員名簿への質問は、名簿の絞り込み・集計結果をまとめて返す
+    with tracing.stage("roster"):
+        roster_response = roster.answer_roster_question(chat_message, st.session_state.get("roster"))
+    if roster_response is not None:
+        tracing.set_attribute("answered_by", "roster")
+        yield {"context": roster_response["context"]}
+        yield {"answer": roster_response["answer"]}
+        add_chat_history(chat_message, roster_response["answer"])
+        return
+
+    chat_history = get_chat_history()
+    # 過去に同じ質問へ回答済みであれば、その回答をまとめて返す
+    with tracing.stage("answer_cache"):
+        cached_response = get_cached_answer(chat_message, chat_history)
+    if cached_response is not None:
+        tracing.set_attribute("answered_by", "answer_cache")
+        yield {"context": cached_response["context"]}
+        yield {"answer": cached_response["answer"]}
+        add_chat_history(chat_message, cached_response["answer"])
+        return
+
+    answer = ""
+    context = []
+    tracing.set_attribute("answered_by", "rag")
+    add_history_tokens()
+    # 回答の表示と交互に進むため、「rag_chain」の所要時間には表示にかかった時間も含まれる
+    with tracing.stage("rag_chain"):
+        chunks = get_rag_chain().stream(
+            {"input": chat_message, "chat_history": chat_history},
+            config={"callbacks": tracing.get_callbacks()}
+        )
+        for chunk in chunks:
+            if "context" in chunk:
+                context = chunk["context"]
+                yield {"context": chunk["context"]}
+            if "answer" in chunk:
+                answer += chunk["answer"]
+                yield {"answer": chunk["answer"]}
+
+    add_chat_history(chat_message, answer)
+    put_cached_answer(chat_message, chat_history, {"answer": answer, "context": context})
+    log_query_condenser_stats()